@@ -0,0 +1,86 @@
+"""
+End to end run of `Acquisition.acquire_calibration` and
+`Acquisition.acquire_modeshape` on the simulated setup
+(`strobing_interferometer.simulator`), followed by the analysis of the file.
+
+Prints the wall time, phase budget and instrument I/O time of each
+acquisition, the frames lost by the camera, the file size and the correlation
+of the analysed mode image with the simulated mode shape. With `adaptive`
+sampling, the calibration biases are chosen by `AdaptiveBiasSampling`
+instead of the 100 evenly spaced biases.
+
+Usage:
+    python benchmarks/bench_acquisition.py [height width fps daq_latency sampling]
+"""
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from strobing_interferometer.acquisition import Acquisition
+from strobing_interferometer.analysis import StdAnalysis
+from strobing_interferometer.sampling import AdaptiveBiasSampling
+from strobing_interferometer.simulator import SimulatedSetup
+
+
+def main(height=270, width=360, fps=50, daq_latency=0.002, sampling="uniform"):
+    height, width, fps = int(height), int(width), float(fps)
+    setup = SimulatedSetup(
+        frame_shape=(height, width), frame_rate=fps, daq_latency=float(daq_latency)
+    )
+    if sampling not in ("uniform", "adaptive"):
+        raise ValueError(f"Unknown sampling: {sampling}")
+    sampling = AdaptiveBiasSampling() if sampling == "adaptive" else None
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "acquisition.h5"
+        acquisition = Acquisition(
+            path,
+            exposure_time_us=1000,
+            n_calib=8,
+            bias_range=(-3, 3),
+            vid_len=96,
+            strobe_detuning=2 * fps / 96,  # two periods per video
+            instruments_manager=setup.instruments(),
+            ramp_speed=5.0,
+            settle_time=0.1,
+            calibration_settle_time=0.0,
+            frame_rate=fps,
+        )
+        budgets = []
+        for name, run in [
+            (
+                "calibration",
+                partial(acquisition.acquire_calibration, sampling=sampling),
+            ),
+            ("modeshape", acquisition.acquire_modeshape),
+        ]:
+            dropped = setup.camera.dropped
+            start = time.perf_counter()
+            run()
+            budgets.append(
+                (name, time.perf_counter() - start, setup.camera.dropped - dropped)
+            )
+            acquisition.instruments_manager.drive_on()
+        print(
+            f"\n{height}x{width} pixels at {fps:g} fps, "
+            f"{len(acquisition.biases)} calibration biases"
+        )
+        for name, elapsed, dropped in budgets:
+            print(f"{name:<12}{elapsed:>8.2f} s{dropped:>6} frames lost")
+        print(f"file: {path.stat().st_size / 2**20:.1f} MiB")
+
+        with h5py.File(path, "r") as f:
+            analysis = StdAnalysis(f)
+            analysis.compute_all()
+        correlation = abs(
+            np.corrcoef(analysis.mode_image.ravel(), setup.shape.ravel())[0, 1]
+        )
+        print(f"mode image correlation: r={correlation:.4f}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
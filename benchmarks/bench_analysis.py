@@ -0,0 +1,89 @@
+"""
+Time and memory profile of each `StdAnalysis.compute_all` stage on synthetic
+acquisitions (`strobing_interferometer.synthetic`) of several sizes, for each
+video engine.
+
+The peak memory is measured with `tracemalloc` (numpy allocations are
+traced). The last column is the correlation of the mode image with the true
+mode shape, to compare the engines.
+
+Usage: python benchmarks/bench_analysis.py [height x width ...]
+       e.g. python benchmarks/bench_analysis.py 120x160 240x320
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import h5py
+import numpy as np
+import scipy.ndimage
+
+from strobing_interferometer.analysis import StdAnalysis
+from strobing_interferometer.synthetic import make_acquisition
+
+STAGES = [
+    "smooth_calibration",
+    "compute_calibration_slopes",
+    "compute_independant_video_images",
+    "combine_images",
+    "apply_membrane_shape_masking",
+    "clip_high_values",
+]
+ENGINES = [
+    ("std", {}),
+    ("std float32", {"dtype": np.float32}),
+    ("lockin", {"engine": "lockin"}),
+]
+
+
+def profile_stages(path, options):
+    """
+    Run every stage and return the `(stage, wall time, peak bytes)` and the
+    analysis
+    """
+    results = []
+    with h5py.File(path, "r") as f:
+        analysis = StdAnalysis(f, **options)
+        for stage in STAGES:
+            tracemalloc.start()
+            start = time.perf_counter()
+            getattr(analysis, stage)()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append((stage, elapsed, peak))
+    return results, analysis
+
+
+def warm_up():
+    """
+    Load the lazily imported scipy.ndimage submodules (masking stage) so
+    that their import is not timed
+    """
+    scipy.ndimage.gaussian_filter(np.zeros((8, 8)), 1)
+
+
+def main(sizes=("120x160", "240x320")):
+    warm_up()
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            frame_shape = tuple(int(n) for n in size.split("x"))
+            path = Path(directory) / f"synthetic_{size}.h5"
+            truth = make_acquisition(path, frame_shape=frame_shape)
+            print(f"\n{size} pixels, {path.stat().st_size / 2**20:.0f} MiB file")
+            print(f"{'engine':<14}{'stage':<36}{'time (s)':>10}{'peak (MiB)':>12}")
+            for name, options in ENGINES:
+                stages, analysis = profile_stages(path, options)
+                for stage, elapsed, peak in stages:
+                    print(f"{name:<14}{stage:<36}{elapsed:>10.3f}{peak / 2**20:>12.1f}")
+                total = sum(elapsed for _, elapsed, _ in stages)
+                correlation = abs(
+                    np.corrcoef(analysis.mode_image.ravel(), truth.ravel())[0, 1]
+                )
+                print(f"{name:<14}{'total':<36}{total:>10.3f}{'':>12}  r={correlation:.4f}")
+
+
+if __name__ == "__main__":
+    main(*[sys.argv[1:]] if len(sys.argv) > 1 else [])
@@ -0,0 +1,81 @@
+"""
+Compare the calibration slopes of the finite difference path
+(`smooth_calibration` + `compute_calibration_slopes` + nearest bias) with the
+fringe model fit (`fit_calibration_fringes` + `fringe_slopes`).
+
+Synthetic fringes with a known slope are used so that both the run time and
+the slope error can be measured.
+
+Usage: python benchmarks/bench_calibration.py [n_pixels]
+"""
+import sys
+import time
+
+import numpy as np
+
+from strobing_interferometer.analysis import StdAnalysis
+
+WINDOW = np.array([0.1, 0.25, 0.3, 0.25, 0.1])
+
+
+def synthetic_fringes(n_pixels, n_biases=100, noise=5.0, seed=0):
+    rng = np.random.default_rng(seed)
+    biases = np.linspace(-3, 3, n_biases)
+    k = rng.uniform(1.2, 3.0, n_pixels)  # at least about one fringe
+    phase = rng.uniform(0, 2 * np.pi, n_pixels)
+    amplitude = rng.uniform(50, 300, n_pixels)
+    offset = rng.uniform(300, 600, n_pixels)
+    curves = offset + amplitude * np.cos(np.outer(biases, k) + phase)
+    curves += rng.normal(scale=noise, size=curves.shape)
+
+    def slopes(video_biases):
+        return -amplitude * k * np.sin(np.outer(video_biases, k) + phase)
+
+    return biases, curves, slopes, amplitude * k
+
+
+def finite_difference(biases, curves, video_biases):
+    analysis = StdAnalysis(None)
+    values = analysis.smooth_along_bias(curves[:, :, None], WINDOW)
+    offset = WINDOW.size // 2
+    analysis.calibration_biases = biases[offset : biases.size - offset]
+    slopes = np.gradient(values, analysis.calibration_biases, axis=0)
+    return slopes[analysis.video_biases_indices(video_biases), :, 0]
+
+
+def fringe_fit(biases, curves, video_biases, chunk_pixels=2**14):
+    analysis = StdAnalysis(None)
+    params = np.concatenate(
+        [
+            analysis.fit_fringes(biases, curves[:, start : start + chunk_pixels])
+            for start in range(0, curves.shape[1], chunk_pixels)
+        ],
+        axis=1,
+    )
+    analysis.fringe_parameters = params
+    return analysis.fringe_slopes(video_biases)
+
+
+def main(n_pixels=100_000):
+    biases, curves, true_slopes, max_slope = synthetic_fringes(n_pixels)
+    video_biases = np.linspace(-2.7, 2.7, 10)
+    truth = true_slopes(video_biases)
+    print(f"{n_pixels} pixels, {biases.size} biases, {video_biases.size} videos")
+    print(f"{'method':<20}{'time (s)':>10}{'s/Mpixel':>10}{'median err':>12}{'p99 err':>10}")
+    for name, method in [
+        ("finite difference", finite_difference),
+        ("fringe fit", fringe_fit),
+    ]:
+        start = time.perf_counter()
+        slopes = method(biases, curves, video_biases)
+        elapsed = time.perf_counter() - start
+        # error relative to the maximum slope of each pixel
+        error = np.abs(slopes - truth) / max_slope
+        print(
+            f"{name:<20}{elapsed:>10.2f}{elapsed / n_pixels * 1e6:>10.1f}"
+            f"{np.median(error):>12.4f}{np.percentile(error, 99):>10.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,106 @@
+"""
+Compare the storage layouts (`strobing_interferometer.storage.StorageLayout`)
+on synthetic 10-bit camera videos: file size, write throughput and read
+throughput for the access patterns of the analysis (whole video, row bands
+with all the frames as in `compute_all_tiled`, frame slabs as in
+`std_image_streaming`), and the run time of the tiled analysis.
+
+The files are read right after being written, so the numbers are those of a
+warm page cache: decompression cost is measured, disk bandwidth is not.
+
+Usage: python benchmarks/bench_storage.py [height width frames]
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import h5py
+
+from strobing_interferometer.analysis import StdAnalysis
+from strobing_interferometer.storage import StorageLayout, open_acquisition
+from strobing_interferometer.synthetic import make_acquisition
+
+LAYOUTS = [
+    ("contiguous", StorageLayout.contiguous()),
+    ("chunked", StorageLayout(compression=None)),
+    ("lzf", StorageLayout(compression="lzf")),
+    ("gzip 1", StorageLayout(compression="gzip", level=1)),
+    ("gzip 4", StorageLayout(compression="gzip", level=4)),
+    ("blosc zstd", StorageLayout(compression="blosc")),
+    ("bitshuffle lz4", StorageLayout(compression="bitshuffle")),
+]
+
+
+def throughput(nbytes, function):
+    start = time.perf_counter()
+    function()
+    return nbytes / (time.perf_counter() - start) / 2**20
+
+
+def main(height=540, width=720, frames=128):
+    height, width, frames = int(height), int(width), int(frames)
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        source = directory / "source.h5"
+        make_acquisition(
+            source, frame_shape=(height, width), n_videos=1, n_frames=frames
+        )
+        with h5py.File(source, "r") as f:
+            video = f["stroboscopic/video0"][()]
+        print(
+            f"video {video.shape}, {video.nbytes / 2**20:.0f} MiB, "
+            "throughputs in MiB/s of uncompressed data"
+        )
+        print(
+            f"{'layout':<16}{'ratio':>7}{'write':>8}{'video':>8}"
+            f"{'bands':>8}{'slabs':>8}{'tiled (s)':>11}"
+        )
+        for name, layout in LAYOUTS:
+            path = directory / "video.h5"
+            with h5py.File(path, "w") as f:
+                write = throughput(
+                    video.nbytes,
+                    lambda: layout.create_dataset(f, "video", data=video),
+                )
+            ratio = video.nbytes / path.stat().st_size
+            with open_acquisition(path) as f:
+                dataset = f["video"]
+                whole = throughput(video.nbytes, lambda: dataset[()])
+                band = (dataset.chunks or (None, 64))[1]
+                bands = throughput(
+                    video.nbytes,
+                    lambda: [
+                        dataset[:, row : row + band] for row in range(0, height, band)
+                    ],
+                )
+                slab = (dataset.chunks or (32,))[0]
+                slabs = throughput(
+                    video.nbytes,
+                    lambda: [
+                        dataset[start : start + slab]
+                        for start in range(0, frames, slab)
+                    ],
+                )
+            path.unlink()
+
+            acquisition = directory / "acquisition.h5"
+            make_acquisition(
+                acquisition,
+                frame_shape=(height // 2, width // 2),
+                n_frames=frames,
+                layout=layout,
+            )
+            with open_acquisition(acquisition) as f:
+                start = time.perf_counter()
+                StdAnalysis(f).compute_all_tiled(memory_limit=2**27)
+                tiled = time.perf_counter() - start
+            acquisition.unlink()
+            print(
+                f"{name:<16}{ratio:>7.2f}{write:>8.0f}{whole:>8.0f}"
+                f"{bands:>8.0f}{slabs:>8.0f}{tiled:>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
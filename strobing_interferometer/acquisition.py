@@ -1,15 +1,42 @@
+import asyncio
+import functools
+import multiprocessing
+import threading
 import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Tuple, Union
 
 import h5py
 import numpy as np
-from HF2 import HF2  # pyright: ignore # TODO: use zhinsts directly
-from RigolDG1032Z.rigol1032 import DG1032Z  # pyright: ignore
-from thorlabs_tsi_sdk.tl_camera import TLCameraSDK
-from tqdm.auto import tqdm, trange
-
-from .idle_camera import camera_lock, camera_semaphore
+from tqdm.auto import tqdm
+
+# The instrument drivers are only needed with the real setup (see
+# `strobing_interferometer.simulator` otherwise)
+try:
+    from HF2 import HF2  # pyright: ignore # TODO: use zhinsts directly
+except ImportError:
+    HF2 = None
+try:
+    from RigolDG1032Z.rigol1032 import DG1032Z  # pyright: ignore
+except ImportError:
+    DG1032Z = None
+try:
+    from thorlabs_tsi_sdk.tl_camera import TLCameraSDK
+except ImportError:
+    TLCameraSDK = None
+try:
+    from .idle_camera import camera_lock, camera_semaphore
+except ImportError:  # no Qt: there is no idle camera window to pause
+    camera_semaphore = multiprocessing.Event()
+    camera_lock = multiprocessing.Lock()
+
+from .pipeline import FramePipeline
+from .profiling import PhaseTimer
+from .storage import StorageLayout
+from .telemetry import Telemetry, measured_frame_rate
 
 
 class InstrumentManager:
@@ -34,19 +61,175 @@ class InstrumentManager:
 
     # TODO: camera_lock = None
 
-    def __init__(self):
-        self.rigol = DG1032Z(self.rigol_addr)
+    def __init__(self, hf2=None, rigol=None, camera_sdk=None, use_cache=True):
+        """
+        The instruments of the setup are used by default. Other backends
+        (e.g. `strobing_interferometer.simulator.SimulatedSetup`) can be
+        given instead.
+
+        The settings read or written through the manager are cached (write
+        through) so that getters don't wait for the instruments. Settings
+        changed outside of the manager (e.g. the drive frequency tuned by
+        hand) are only seen after `InstrumentManager.refresh`, except the
+        bias offset and the drive frequency which are always read from the
+        lock-in before a ramp or before setting the strobe frequency.
+
+        Args:
+            hf2: The lock-in (with a `daq` attribute like `HF2`)
+            rigol: The strobe generator (like `DG1032Z`)
+            camera_sdk (callable): Returns a camera SDK context manager (like
+                `TLCameraSDK`)
+            use_cache (bool): Cache the instrument settings
+        """
+        if rigol is None:
+            if DG1032Z is None:
+                raise ImportError("RigolDG1032Z is needed to use the strobe")
+            rigol = DG1032Z(self.rigol_addr)
+        self.rigol = rigol
         self.rigol.channel = self.rigol_channel
-        self.hf2 = HF2(self.hf2_serial, 1)
+        if hf2 is None:
+            if HF2 is None:
+                raise ImportError("HF2 is needed to use the lock-in")
+            hf2 = HF2(self.hf2_serial, 1)
+        self.hf2 = hf2
+        if camera_sdk is None:
+            if TLCameraSDK is None:
+                raise ImportError("thorlabs_tsi_sdk is needed to use the camera")
+            camera_sdk = TLCameraSDK
+        self.camera_sdk = camera_sdk
+        self.use_cache = use_cache
+        self._state = {}  # cached settings: lock-in nodes and rigol attributes
+        self._batch = None  # lock-in writes waiting for the end of `batch`
+        self.io_stats = {}
+        "Number of calls and time spent in each kind of instrument I/O"
+
+    def _io(self, operation, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            stats = self.io_stats.setdefault(operation, {"count": 0, "time": 0.0})
+            stats["count"] += 1
+            stats["time"] += time.perf_counter() - start
+
+    def _read(self, key):
+        """
+        Read a lock-in node (a path) or a rigol attribute (`"rigol.<name>"`)
+        from the instrument
+        """
+        if key.startswith("rigol."):
+            return self._io("rigol get", getattr, self.rigol, key[6:])
+        if key.startswith("/dev1224/sigouts/0/enables/"):
+            return self._io("hf2 get", self.hf2.daq.getInt, key)
+        return self._io("hf2 get", self.hf2.daq.getDouble, key)
+
+    def _get(self, key, cached=True):
+        """
+        Value of a setting, from the cache if `cached` (and the cache is
+        used), otherwise read from the instrument. A setting written in the
+        current `InstrumentManager.batch` reads as its pending value.
+        """
+        if self._batch is not None and key in self._batch:
+            return self._batch[key]
+        if cached and self.use_cache and key in self._state:
+            return self._state[key]
+        value = self._read(key)
+        self._state[key] = value
+        return value
+
+    def _set(self, key, value):
+        if key.startswith("rigol."):
+            self._io("rigol set", setattr, self.rigol, key[6:], value)
+        elif self._batch is not None:
+            self._batch[key] = value
+            return  # cached once sent
+        elif isinstance(value, int):
+            self._io("hf2 set", self.hf2.daq.setInt, key, value)
+        else:
+            self._io("hf2 set", self.hf2.daq.setDouble, key, value)
+        self._state[key] = value
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager sending the lock-in settings written inside it in a
+        single request when it exits (in the order they were written, the
+        last value of a node wins). Nothing is sent if the block raises.
+        """
+        if self._batch is not None:  # already batching
+            yield
+            return
+        self._batch = {}
+        try:
+            yield
+            settings = list(self._batch.items())
+        finally:
+            self._batch = None
+        if not settings:
+            return
+        daq = self.hf2.daq
+        if hasattr(daq, "set"):
+            self._io("hf2 set", daq.set, settings)
+            self._state.update(settings)
+        else:  # one request per node
+            for key, value in settings:
+                self._set(key, value)
+
+    def refresh(self):
+        """
+        Read back the cached settings from the instruments to detect the
+        ones changed outside of the manager.
+
+        Returns:
+            dict: `{setting: (cached value, actual value)}` of the settings that
+            changed
+        """
+        changes = {}
+        for key, cached in list(self._state.items()):
+            value = self._read(key)
+            if not np.isclose(value, cached, rtol=1e-9, atol=0):
+                changes[key] = (cached, value)
+            self._state[key] = value
+        return changes
+
+    def io_summary(self):
+        """
+        The time spent waiting for the instruments as a printable table
+        """
+        lines = [f"{'instrument I/O':<16}{'calls':>7}{'time (s)':>10}{'mean (ms)':>11}"]
+        for operation, stats in self.io_stats.items():
+            lines.append(
+                f"{operation:<16}{stats['count']:>7}{stats['time']:>10.2f}"
+                f"{1000 * stats['time'] / stats['count']:>11.2f}"
+            )
+        return "\n".join(lines)
 
     def get_drive_freq(self):
-        return self.hf2.daq.getDouble("/dev1224/oscs/0/freq")
+        return self._get("/dev1224/oscs/0/freq")
 
     def get_strobe_frequency(self):
-        return self.hf2.daq.getDouble("/dev1224/sigouts/0/amplitudes/6")
+        return self._get("rigol.frequency")
 
     def get_drive_amplitude(self):
-        return self.rigol.frequency
+        return self._get("/dev1224/sigouts/0/amplitudes/6")
+
+    def set_drive(self, frequency=None, amplitude=None, enabled=None):
+        """
+        Set the drive of the lock-in in a single request (the settings left
+        to `None` are unchanged)
+
+        Args:
+            frequency (float): The drive frequency
+            amplitude (float): The drive amplitude
+            enabled (bool): Turn the drive on or off
+        """
+        with self.batch():
+            if frequency is not None:
+                self._set("/dev1224/oscs/0/freq", float(frequency))
+            if amplitude is not None:
+                self._set("/dev1224/sigouts/0/amplitudes/6", float(amplitude))
+            if enabled is not None:
+                self._set("/dev1224/sigouts/0/enables/6", int(enabled))
 
     def set_freqs(self, x, detun=1):
         """
@@ -58,8 +241,8 @@ class InstrumentManager:
             freq (float): The drive frequency
             detun (float): The detuning of the strobe
         """
-        self.hf2.daq.setDouble("/dev1224/oscs/0/freq", x)
-        self.rigol.frequency = x + detun
+        self.set_drive(frequency=x)
+        self._set("rigol.frequency", x + detun)
 
     def strobe_at(self, detun: float = 1.0):
         """
@@ -70,14 +253,15 @@ class InstrumentManager:
         Args:
             detun (float): The strobe detuning (positive means strobing at higher frequency)
         """
-        f = self.hf2.daq.getDouble("/dev1224/oscs/0/freq")
-        self.rigol.frequency = f + detun
+        # read from the lock-in: the drive frequency is tuned by hand
+        f = self._get("/dev1224/oscs/0/freq", cached=False)
+        self._set("rigol.frequency", f + detun)
 
     def strobe_on(self):
-        self.rigol.output = True
+        self._set("rigol.output", True)
 
     def strobe_off(self):
-        self.rigol.output = False
+        self._set("rigol.output", False)
 
     def lock_camera(self):
         camera_semaphore.clear()
@@ -88,26 +272,47 @@ class InstrumentManager:
         camera_lock.release()
 
     def drive_on(self):
-        self.hf2.daq.setInt("/dev1224/sigouts/0/enables/6", 1)
+        self.set_drive(enabled=True)
 
     def drive_off(self):
-        self.hf2.daq.setInt("/dev1224/sigouts/0/enables/6", 0)
+        self.set_drive(enabled=False)
 
-    def goToBias(self, new_bias, speed=0.2, step_size=0.005):
+    def goToBias(self, new_bias, speed=0.2, step_size=0.005, stop=None):
         """
         Function to go smoothly from one bias value to another
 
+        The steps follow a fixed schedule: the time taken by each write is
+        part of the step duration instead of being added to it. (The HF2 has
+        no ramp of its output offset, so the ramp is driven from here.)
+
         speed in 10V/s
         step in 10V
+
+        Args:
+            stop (threading.Event): Stop the ramp where it is when set
         """
         delta_t = step_size / speed
-        old_bias = self.hf2.daq.getDouble("/dev1224/sigouts/1/offset") / self.bias_gain
+        # read from the lock-in: a stale offset would make the first step
+        # jump from wherever the offset really is
+        offset = self._get("/dev1224/sigouts/1/offset", cached=False)
+        old_bias = offset / self.bias_gain
         span = abs(new_bias - old_bias)
         n_step = int(np.ceil(span / step_size))  # pyright: ignore  # pyright is drunk
-        steps = np.linspace(old_bias, new_bias, n_step)
-        for b in steps:
-            self.hf2.daq.setDouble("/dev1224/sigouts/1/offset", b * self.bias_gain)
-            time.sleep(delta_t)
+        steps = np.linspace(old_bias, new_bias, n_step + 1)[1:]
+        start = time.perf_counter()
+        for i, b in enumerate(steps):
+            self._set("/dev1224/sigouts/1/offset", float(b * self.bias_gain))
+            delay = max(start + (i + 1) * delta_t - time.perf_counter(), 0)
+            if stop is None:
+                time.sleep(delay)
+            elif stop.wait(delay):
+                return
+
+
+class AcquisitionCancelled(Exception):
+    """
+    Raised by an acquisition stopped with `Acquisition.cancel`
+    """
 
 
 class Acquisition:
@@ -122,6 +327,13 @@ class Acquisition:
         vid_len: int = 288,
         strobe_detuning: float = 0.5,
         instruments_manager=None,
+        storage_layout=None,
+        ring_capacity: int = 64,
+        ramp_speed: float = 0.2,
+        settle_time: float = 3.0,
+        calibration_settle_time: float = 0.05,
+        frame_rate: float = 20,
+        trace_memory: bool = False,
         **kwargs,
     ):
         self.path = Path(path)
@@ -147,6 +359,30 @@ class Acquisition:
             self.instruments_manager = InstrumentManager.get_default()
         else:
             self.instruments_manager = instruments_manager
+        if storage_layout is None:
+            storage_layout = StorageLayout()
+        self.storage_layout = storage_layout
+        self.ring_capacity = ring_capacity
+        self.ramp_speed = ramp_speed
+        "Speed of the bias ramps between two steps (10V/s)"
+        self.settle_time = settle_time
+        "Time to wait after the ramp before recording a video (s)"
+        self.calibration_settle_time = calibration_settle_time
+        "Time to wait after each bias step of the calibration (s)"
+        self.frame_rate = frame_rate
+        "Frame rate of the stroboscopic videos (fps)"
+        self.trace_memory = trace_memory
+        "Measure the peak memory of each video (in `self.video_peak_memory`)"
+        self.timer = None
+        "`PhaseTimer` of the last acquisition"
+        self.video_biases = None
+        "Biases of the stroboscopic videos chosen by an adaptive calibration"
+        self._cancel = threading.Event()
+        self._cancel_cleared = False
+        self._running = 0  # asynchronous operations in progress
+        self._on_progress = None
+        self.telemetry = Telemetry()
+        "Telemetry of the acquisitions (see `Telemetry.snapshot`)"
 
         self.kwargs = kwargs
 
@@ -156,109 +392,352 @@ class Acquisition:
     def release_camera_lock(self):
         self.instruments_manager.unlock_camera()
 
-    def acquire_calibration(self):
+    @contextmanager
+    def _open_camera(self):
+        """
+        Open the camera and set its exposure time
         """
-        Record bias calibration. This will use several gigas of RAM.
+        # TODO: move the camera handling logic to the instument_manager
+        with self.instruments_manager.camera_sdk() as sdk:
+            available_cameras = sdk.discover_available_cameras()
+            if len(available_cameras) < 1:
+                raise Exception("no cameras detected")
+            with sdk.open_camera(self.instruments_manager.camera_sn) as camera:
+                camera.exposure_time_us = self.exposure_time_us
+                yield camera
+
+    def _check_exposure(self, camera):
+        """
+        Record one frame and check that it is neither saturated nor too dim
+        """
+        camera.frames_per_trigger_zero_for_unlimited = 1
+        print("Exposure time sanity check...", end="")
+        camera.arm(2)
+        camera.issue_software_trigger()
+        frame = None
+        t0 = time.time()
+        warned = False
+        while frame is None:
+            self._checkpoint()
+            if time.time() - t0 > 2 and not warned:
+                print(
+                    "The frame I'm waiting may have been dropped. Do not hesitate to stop the script if you think it is the case"
+                )
+                warned = True
+            frame = camera.get_pending_frame_or_null()
+
+        print("Done")
+        image = np.array(frame.image_buffer)
+        n_saturating = np.sum(image > 1020)
+        frame_max = np.max(image)
+        print("Number of saturating pixels:", n_saturating)
+        camera.disarm()
+        self._emit(
+            "exposure", image=image, saturating=int(n_saturating), max=int(frame_max)
+        )
+        if (
+            n_saturating > 50000
+        ):  # arbitrary (= few percent of the image are saturating)
+            raise Exception("Saturating image.please decrease exposure time")
+        if frame_max < 1000:
+            raise Exception("Too dim image.please increase exposure time")
+
+    def _begin(self, on_progress):
+        if self._cancel_cleared:
+            # cleared by `_run_async` before the thread started: a cancel
+            # issued meanwhile must not be lost
+            self._cancel_cleared = False
+        else:
+            self._cancel.clear()
+        self._on_progress = on_progress
+
+    def _clear_cancel(self):
+        """
+        Forget a previous `Acquisition.cancel`, unless an operation it may
+        be meant for is still running
+        """
+        if not self._running:
+            self._cancel.clear()
+
+    def _checkpoint(self):
+        """
+        Stop the acquisition here if `Acquisition.cancel` was called
+        """
+        if self._cancel.is_set():
+            raise AcquisitionCancelled("The acquisition was cancelled")
+
+    def _emit(self, event, **info):
+        if self._on_progress is not None:
+            self._on_progress({"event": event, **info})
+
+    def cancel(self):
+        """
+        Stop the running acquisition at the next step (after the current
+        bias or, for the videos, once the current video is saved). Can be
+        called from any thread.
+        """
+        self._cancel.set()
+
+    def acquire_calibration(
+        self, store_videos: bool = True, on_progress=None, sampling=None
+    ):
+        """
+        Record bias calibration.
+
+        The frames of each bias are streamed to the file: only the frames of
+        two biases (if `store_videos`) and the running means and variances
+        are kept in memory. The results of a bias are saved in a background
+        thread while ramping to the next one.
+
+        By default 100 evenly spaced biases are recorded. With an adaptive
+        `sampling`, the biases are chosen from the photos already recorded:
+        they are stored in the acquisition order (the analysis sorts them)
+        and the stroboscopic videos are recorded at the biases chosen by
+        `AdaptiveBiasSampling.video_biases`.
 
         Should not be used while the thorcam software is open
+
+        Args:
+            store_videos (bool): Also store the raw frames in the
+                `bias calibration/videos` dataset. Otherwise only their mean
+                (`photos`) and variance (`variances`) are stored.
+            on_progress (callable): Called with a dict for each step (see
+                `Acquisition.acquire_calibration_async`)
+            sampling (AdaptiveBiasSampling): Adaptive choice of the biases
         """
+        self._begin(on_progress)
 
         self.biases = np.linspace(self.bias_range[0], self.bias_range[1], 100)
+        self.video_biases = None
 
-        biases = self.biases
+        self.check_instruments()
 
         self.instruments_manager.strobe_at(detun=2000)
 
         self.instruments_manager.drive_off()
 
-        self.instruments_manager.goToBias(biases[0], speed=1.0)
-
-        time.sleep(1)
+        self.instruments_manager.goToBias(
+            self.bias_range[0], speed=1.0, stop=self._cancel
+        )
 
-        with TLCameraSDK() as sdk:  # TODO: move the camera handling logic to the instument_manager
-            available_cameras = sdk.discover_available_cameras()
-            if len(available_cameras) < 1:
-                raise Exception("no cameras detected")
+        self._cancel.wait(1)
+        self._checkpoint()
 
-            with sdk.open_camera(self.instruments_manager.camera_sn) as camera:
-                camera.image_poll_timeout_ms = 100
-                camera.exposure_time_us = self.exposure_time_us
+        with self._open_camera() as camera:
+            camera.image_poll_timeout_ms = 100
 
-                camera.frames_per_trigger_zero_for_unlimited = 1
-                frame_shape = (
-                    camera.sensor_height_pixels,
-                    camera.sensor_width_pixels,
-                )
+            frame_shape = (
+                camera.sensor_height_pixels,
+                camera.sensor_width_pixels,
+            )
 
-                # exposure time sanity check
-                print("Exposure time sanity check...", end="")
-                camera.arm(2)
-                camera.issue_software_trigger()
-                frame = None
-                t0 = time.time()
-                while frame is None:
-                    if time.time() - t0 > 2:
-                        print(
-                            "The frame I'm waiting may have been dropped. Do not hesitate to stop the script if you think it is the case"
-                        )
-                    frame = camera.get_pending_frame_or_null()
-
-                print("Done")
-                n_saturating = np.sum(np.array(frame.image_buffer) > 1020)
-                frame_max = np.max(frame.image_buffer)
-                print("Number of saturating pixels:", n_saturating)
-                if (
-                    n_saturating > 50000
-                ):  # arbitrary (= few percent of the image are saturating)
-                    raise Exception("Saturating image.please decrease exposure time")
-                if frame_max < 1000:
-                    raise Exception("Too dim image.please increase exposure time")
-                camera.disarm()
+            self._check_exposure(camera)
 
-                print("Acquiring calibration data")
-                buffer = np.empty(
-                    (len(biases), self.n_calib, *frame_shape), dtype=np.uint16
+            if sampling is None:
+                biases = self.biases
+                n_biases = len(biases)
+            else:
+                biases = sampling.start(self.bias_range, frame_shape)
+                n_biases = sampling.max_biases
+
+            def schedule():
+                batch = biases
+                while len(batch):
+                    yield from batch
+                    if sampling is None:
+                        return
+                    batch = sampling.next_biases(current=batch[-1])
+
+            print("Acquiring calibration data")
+            with h5py.File(self.path, "a") as f:
+                f.attrs["frame_shape"] = np.array(frame_shape)
+                f.attrs.update(self.kwargs)
+                f.attrs["storage layout"] = self.storage_layout.describe()
+                grp = f.create_group("bias calibration")
+                # Resizable: shrunk to the recorded biases at the end (the
+                # adaptive sampling may need less, or the acquisition may be
+                # cancelled). Filled in the acquisition order.
+                bias_dataset = grp.create_dataset(
+                    "biases",
+                    data=biases if sampling is None else np.full(n_biases, np.nan),
+                    maxshape=(None,),
                 )
-                with h5py.File(self.path, "a") as f:
-                    camera.frames_per_trigger_zero_for_unlimited = self.n_calib
-                    camera.arm(2)
-                    for i, bias in tqdm(enumerate(biases), total=len(biases)):
-                        self.instruments_manager.goToBias(bias)
-                        time.sleep(0.05)
-                        camera.issue_software_trigger()
-                        prev_frame = None
-                        for j in range(camera.frames_per_trigger_zero_for_unlimited):
-                            frame = None
-                            while frame is None:
-                                frame = camera.get_pending_frame_or_null()
-                            buffer[i, j] = frame.image_buffer
-                            if (
-                                prev_frame is not None
-                                and frame.frame_count - prev_frame > 1
-                            ):
+                # One chunk row per bias: each bias step is written once
+                photos = self.storage_layout.create_dataset(
+                    grp,
+                    "photos",
+                    (n_biases, *frame_shape),
+                    np.float64,
+                    frames=1,
+                    resizable=True,
+                )
+                variances = self.storage_layout.create_dataset(
+                    grp,
+                    "variances",
+                    (n_biases, *frame_shape),
+                    np.float64,
+                    frames=1,
+                    resizable=True,
+                )
+                datasets = [photos, variances]
+                if store_videos:
+                    videos = self.storage_layout.create_dataset(
+                        grp,
+                        "videos",
+                        (n_biases, self.n_calib, *frame_shape),
+                        np.uint16,
+                        frames=1,
+                        resizable=True,
+                    )
+                    datasets.append(videos)
+                # Two sets of buffers: one is saved while the other is
+                # filled
+                states = [
+                    (
+                        np.empty(frame_shape),
+                        np.empty(frame_shape),
+                        np.empty((self.n_calib, *frame_shape), dtype=np.uint16)
+                        if store_videos
+                        else None,
+                    )
+                    for _ in range(2)
+                ]
+                state = states[0]
+                delta = np.empty(frame_shape)
+
+                def accumulate(index, frames, frame_counts):
+                    mean, m2, buffer = state
+                    for j, image in enumerate(frames, start=index):
+                        if store_videos:
+                            buffer[j] = image
+                        # Welford's running mean and sum of squared deviations
+                        np.subtract(image, mean, out=delta)
+                        mean[...] += delta / (j + 1)
+                        m2[...] += delta * (image - mean)
+
+                def save(i, bias, mean, m2, buffer):
+                    bias_dataset[i] = bias
+                    photos[i] = mean
+                    variances[i] = m2 / max(self.n_calib - 1, 1)
+                    if store_videos:
+                        videos[i] = buffer
+
+                pipeline = FramePipeline(
+                    frame_shape, capacity=min(self.ring_capacity, self.n_calib)
+                )
+                timer = self.timer = PhaseTimer()
+                camera.frames_per_trigger_zero_for_unlimited = self.n_calib
+                # The camera buffers all the frames of a bias: the save of the
+                # previous bias holds the GIL (h5py compression) while they
+                # arrive, which could otherwise overflow the camera buffer
+                camera.arm(self.n_calib)
+                recorded = []
+                try:
+                    with self.telemetry.recording(
+                        f, "calibration", timer, pipeline
+                    ), ThreadPoolExecutor(1) as saver:
+                        saving = None
+                        for i, bias in tqdm(enumerate(schedule()), total=n_biases):
+                            self._checkpoint()
+                            with timer.phase("ramp"):
+                                self.instruments_manager.goToBias(
+                                    bias, speed=self.ramp_speed, stop=self._cancel
+                                )
+                            with timer.phase("settle"):
+                                self._cancel.wait(self.calibration_settle_time)
+                            # a cancelled ramp stopped short of `bias`
+                            self._checkpoint()
+                            state = states[i % 2]
+                            state[0][...] = 0
+                            state[1][...] = 0
+                            with timer.phase("record"):
+                                camera.issue_software_trigger()
+                                try:
+                                    stats = pipeline.run(
+                                        camera, self.n_calib, accumulate
+                                    )
+                                finally:
+                                    self.telemetry.record(i, pipeline, bias)
+                            if stats["dropped"] or stats["camera_dropped"]:
                                 raise Exception(
-                                    "Dropped frame at bias n°{i} (Bias={bias})"
+                                    f"Dropped frame at bias n°{i} (Bias={bias})"
                                 )
-                            prev_frame = frame.frame_count
-                    camera.disarm()
-                    f.attrs["frame_shape"] = np.array(frame_shape)
-                    f.attrs.update(self.kwargs)
-                    grp = f.create_group("bias calibration")
-                    grp.create_dataset("photos", data=np.mean(buffer, axis=1))
-                    grp.create_dataset("videos", data=buffer, dtype=np.uint16)
-                    grp.create_dataset("biases", data=biases)
+                            if sampling is not None:
+                                sampling.add(bias, state[0])
+                            with timer.phase("save wait"):
+                                # the other buffers are free once the previous
+                                # bias is saved
+                                if saving is not None:
+                                    saving.result()
+                            saving = saver.submit(save, i, bias, *state)
+                            recorded.append(bias)
+                            self._emit(
+                                "bias",
+                                index=i,
+                                total=n_biases,
+                                bias=bias,
+                                image=state[0].copy(),
+                                stats=stats,
+                            )
+                        with timer.phase("save wait"):
+                            if saving is not None:
+                                saving.result()
+                finally:
+                    # drop the rows of the biases that were not recorded
+                    for dataset in [bias_dataset, *datasets]:
+                        dataset.resize(len(recorded), axis=0)
+                    if sampling is not None:
+                        grp.attrs["bias sampling"] = sampling.describe()
+                camera.disarm()
+                if sampling is not None:
+                    self.biases = np.sort(recorded)
+                    self.video_biases = sampling.video_biases()
+                    print(
+                        f"{len(recorded)} biases, slope changes: "
+                        + ", ".join(f"{change:.3f}" for change in sampling.changes)
+                    )
+                    print(
+                        f"Video biases: {np.round(self.video_biases, 3)} "
+                        f"({sampling.coverage:.0%} of the pixels covered)"
+                    )
+                print(timer.summary())
+                print(self.instruments_manager.io_summary())
+                self._emit("done", timer=timer.report())
 
         print("Please turn on the drive and find the right frequency")
 
-    def acquire_modeshape(self):
+    def check_instruments(self):
+        """
+        Read back the instrument settings changed since the last acquisition
+        (e.g. the drive frequency) and reset the I/O counters
+        """
+        manager = self.instruments_manager
+        for setting, (cached, value) in manager.refresh().items():
+            print(f"{setting} changed outside of the script: {cached} -> {value}")
+        manager.io_stats.clear()
+
+    def acquire_modeshape(self, on_progress=None):
+        """
+        Record the stroboscopic videos (after `Acquisition.acquire_calibration`)
+
+        Args:
+            on_progress (callable): Called with a dict for each step (see
+                `Acquisition.acquire_modeshape_async`)
+        """
+        self._begin(on_progress)
+        self.check_instruments()
+
         freq = self.instruments_manager.get_drive_freq()
 
-        biases_vid = np.array([self.biases[10 * i + 5] for i in range(10)])
+        if self.video_biases is not None:
+            biases_vid = self.video_biases
+        else:
+            biases_vid = np.array([self.biases[10 * i + 5] for i in range(10)])
 
         self.instruments_manager.strobe_on()
-        self.instruments_manager.strobe_at(detun=0.5)
+        self.instruments_manager.strobe_at(detun=self.strobe_detuning)
 
-        time.sleep(1)
+        self._cancel.wait(1)
 
         begin_time = time.time()
 
@@ -268,71 +747,241 @@ class Acquisition:
             "drive frequency": freq,
         }
 
-        self.instruments_manager.goToBias(biases_vid[0], speed=1)
+        self.instruments_manager.goToBias(biases_vid[0], speed=1, stop=self._cancel)
+        timer = self.timer = PhaseTimer()
 
         print(f"Saving to `{self.path}`")
-        with TLCameraSDK() as sdk:
-            available_cameras = sdk.discover_available_cameras()
-            if len(available_cameras) < 1:
-                print("no cameras detected")
-            else:
-                with sdk.open_camera(self.instruments_manager.camera_sn) as camera:
+        with self._open_camera() as camera:
+            camera.image_poll_timeout_ms = 1000
 
-                    camera.image_poll_timeout_ms = 1000
-                    camera.exposure_time_us = self.exposure_time_us
+            camera.frame_rate_control_value = self.frame_rate
 
-                    camera.frame_rate_control_value = 20
+            cam_shape = (
+                self.vid_len,
+                camera.sensor_height_pixels,
+                camera.sensor_width_pixels,
+            )
 
-                    cam_shape = (
-                        self.vid_len,
-                        camera.sensor_height_pixels,
-                        camera.sensor_width_pixels,
+            chunks = self.storage_layout.chunks(cam_shape, np.uint16)
+            self.video_peak_memory = []
+
+            with h5py.File(self.path, "a") as f:
+                if "stroboscopic" in f:
+                    del f["stroboscopic"]
+                grp = f.create_group("stroboscopic")
+                grp.attrs.update(strobe_attrs)
+                n_video = len(biases_vid)
+                # Batches of whole time chunks so that every chunk is
+                # written (and compressed) once
+                pipeline = FramePipeline(
+                    cam_shape[1:],
+                    capacity=self.ring_capacity,
+                    batch=chunks[0] if self.storage_layout.tile else 32,
+                )
+                previous = None
+
+                def finish_video(i, bias, progress, tracing, preview):
+                    # Wait for the writer thread to save the frames
+                    with timer.phase("save wait"):
+                        try:
+                            stats = pipeline.join()
+                        finally:
+                            progress.close()
+                            self.telemetry.record(i, pipeline, bias)
+                    if tracing:
+                        peak = tracemalloc.get_traced_memory()[1]
+                        tracemalloc.stop()
+                        # the ring buffer is allocated once, before
+                        peak += pipeline.ring.frames.nbytes
+                        self.video_peak_memory.append(peak)
+                        print(f"Peak memory: {peak / 2**20:.0f} MiB")
+                    if stats["dropped"] or stats["camera_dropped"]:
+                        raise Exception(
+                            f"Dropped frame at bias n°{i} (Bias={bias})"
+                        )
+                    self._emit(
+                        "video",
+                        index=i,
+                        total=n_video,
+                        bias=bias,
+                        image=preview.get("image"),
+                        stats=stats,
                     )
 
-                    buffer = np.empty((len(biases_vid), *cam_shape), dtype=np.uint16)
-
-                    with h5py.File(self.path, "a") as f:
-                        if "stroboscopic" in f:
-                            del f["stroboscopic"]
-                        grp = f.create_group("stroboscopic")
-                        grp.attrs.update(strobe_attrs)
-                        buffer = np.empty(cam_shape)
-                        n_video = len(biases_vid)
+                tracing = False
+                try:
+                    with self.telemetry.recording(f, "stroboscopic", timer, pipeline):
                         for i, bias in enumerate(biases_vid):
+                            # The previous video is written and flushed by the
+                            # pipeline during the ramp and the settling
                             print("Going to right bias...", end="")
-                            self.instruments_manager.goToBias(bias)
+                            with timer.phase("ramp"):
+                                self.instruments_manager.goToBias(
+                                    bias, speed=self.ramp_speed, stop=self._cancel
+                                )
                             print(" Sleeping...", end="")
-                            time.sleep(3)  # TODO: make tunable
+                            with timer.phase("settle"):
+                                self._cancel.wait(self.settle_time)
+                            if previous is not None:
+                                finish_video(*previous)
+                            self._checkpoint()
                             print(" Arming camera...")
                             camera.frames_per_trigger_zero_for_unlimited = self.vid_len
-                            # This buffer size comes from thorlabs' live camera example. Let's keep it
-                            camera.arm(2)
-                            camera.issue_software_trigger()
-                            prev_frame = None
-                            for j in trange(
-                                self.vid_len, desc=f"Video n°{i}/{n_video}"
+                            dset = self.storage_layout.create_dataset(
+                                grp, f"video{i}", cam_shape, np.uint16
+                            )
+                            tracing = (
+                                self.trace_memory and not tracemalloc.is_tracing()
+                            )
+                            if tracing:
+                                tracemalloc.start()
+                            progress = tqdm(
+                                total=self.vid_len, desc=f"Video n°{i}/{n_video}"
+                            )
+
+                            preview = {}
+
+                            def write(
+                                index,
+                                frames,
+                                frame_counts,
+                                dset=dset,
+                                progress=progress,
+                                preview=preview,
                             ):
-                                frame = None
-                                while frame is None:
-                                    frame = camera.get_pending_frame_or_null()
-                                buffer[j] = frame.image_buffer
-                                if (
-                                    prev_frame is not None
-                                    and frame.frame_count - prev_frame > 1
-                                ):
-                                    raise Exception(
-                                        f"Dropped frame at bias n°{i} (Bias={bias})"
-                                    )
-                                prev_frame = frame.frame_count
-                            fps = camera.get_measured_frame_rate_fps()  # TODO: fix
+                                if index == 0:
+                                    preview["image"] = np.array(frames[0])
+                                dset[index : index + len(frames)] = frames
+                                progress.update(len(frames))
+
+                            with timer.phase("record"):
+                                # This buffer size comes from thorlabs' live camera example. Let's keep it
+                                camera.arm(2)
+                                camera.issue_software_trigger()
+                                pipeline.start(camera, self.vid_len, write, f.flush)
+                                pipeline.wait_frames()
+                            camera_fps = camera.get_measured_frame_rate_fps()
                             print("Disarming... ", end="")
-                            camera.disarm()
-                            print("Saving...")
-                            dset = grp.create_dataset(
-                                f"video{i}", data=buffer, dtype=np.uint16
+                            with timer.phase("disarm"):
+                                camera.disarm()
+                            # Fitted on the frame numbers and the host timestamps:
+                            # more reliable than the rate measured by the camera
+                            dset.attrs["fps"] = measured_frame_rate(
+                                pipeline.frame_log[: pipeline.received]
                             )
-                            dset.attrs["fps"] = fps
+                            dset.attrs["camera fps"] = camera_fps
                             dset.attrs["bias(V)"] = bias
-                            f.flush()
-                        grp.attrs["acquisition time"] = begin_time - time.time()
+                            previous = (i, bias, progress, tracing, preview)
+                        if previous is not None:
+                            finish_video(*previous)
+                finally:
+                    # an error during a video would leave the tracing on
+                    if tracing and tracemalloc.is_tracing():
+                        tracemalloc.stop()
+                print(timer.summary())
+                print(self.instruments_manager.io_summary())
+                grp.attrs["acquisition time"] = time.time() - begin_time
+                self._emit("done", timer=timer.report())
         print("Data acquisition is succesfully completed.")
+
+    async def _run_async(self, method, on_progress, *args, **kwargs):
+        """
+        Run a blocking acquisition method in the default executor.
+
+        `on_progress` is called in the event loop. Cancelling the task
+        cancels the acquisition and waits for it to stop cleanly (camera
+        disarmed, file closed).
+        """
+        loop = asyncio.get_running_loop()
+        self._clear_cancel()
+        self._cancel_cleared = True
+        if on_progress is not None:
+            callback = on_progress
+
+            def on_progress(event):
+                loop.call_soon_threadsafe(callback, event)
+
+        future = loop.run_in_executor(
+            None, functools.partial(method, *args, on_progress=on_progress, **kwargs)
+        )
+        self._running += 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancel()
+            try:
+                await future
+            except AcquisitionCancelled:
+                pass
+            raise
+        finally:
+            self._running -= 1
+
+    async def acquire_calibration_async(
+        self, store_videos=True, on_progress=None, sampling=None
+    ):
+        """
+        `Acquisition.acquire_calibration` without blocking the event loop
+        (e.g. to update plots in a notebook meanwhile).
+
+        Progress events are dicts with an `"event"` key:
+            - `"exposure"`: the exposure check frame (`image`, `saturating`,
+              `max`)
+            - `"bias"`: a bias was recorded (`index`, `total`, `bias`, the
+              mean `image` and the pipeline `stats`)
+            - `"done"`: the phase budget (`timer`)
+
+        Args:
+            store_videos (bool): See `Acquisition.acquire_calibration`
+            on_progress (callable): Called in the event loop with each event
+            sampling (AdaptiveBiasSampling): See
+                `Acquisition.acquire_calibration`
+        """
+        await self._run_async(
+            self.acquire_calibration, on_progress, store_videos, sampling=sampling
+        )
+
+    async def acquire_modeshape_async(self, on_progress=None):
+        """
+        `Acquisition.acquire_modeshape` without blocking the event loop.
+
+        Progress events are dicts with an `"event"` key:
+            - `"video"`: a video was saved (`index`, `total`, `bias`, its
+              first frame as `image` and the pipeline `stats`)
+            - `"done"`: the phase budget (`timer`)
+
+        Args:
+            on_progress (callable): Called in the event loop with each event
+        """
+        await self._run_async(self.acquire_modeshape, on_progress)
+
+    async def go_to_bias_async(self, bias, speed=None):
+        """
+        `InstrumentManager.goToBias` without blocking the event loop.
+        Cancelling the task stops the ramp where it is.
+
+        Args:
+            bias (float): The target bias
+            speed (float): Ramp speed (`self.ramp_speed` by default)
+        """
+        loop = asyncio.get_running_loop()
+        self._clear_cancel()
+        future = loop.run_in_executor(
+            None,
+            functools.partial(
+                self.instruments_manager.goToBias,
+                bias,
+                self.ramp_speed if speed is None else speed,
+                stop=self._cancel,
+            ),
+        )
+        self._running += 1
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # stop the ramp where it is
+            self.cancel()
+            await future
+            raise
+        finally:
+            self._running -= 1
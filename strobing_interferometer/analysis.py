@@ -1,6 +1,60 @@
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
 import numpy as np
-import scipy
-from tqdm.auto import tqdm, trange
+import scipy.fft
+import scipy.ndimage
+from tqdm.auto import tqdm
+
+from .binning import BinnedGroup
+from .cache import StageCache
+from .profiling import StageProfiler
+from .storage import aligned, open_acquisition
+
+
+def available_memory():
+    """
+    Return the memory available for new processes in bytes (or `None` if
+    it can't be determined on this platform).
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _analysis_worker(cls, filename, options, method, *args):
+    """
+    Open `filename` read-only and call `method(*args)` on a fresh `cls`
+    instance. Used by the process pools of `StdAnalysis`.
+    """
+    with open_acquisition(filename) as f:
+        return getattr(cls(f, **options), method)(*args)
+
+
+def profiled_stage(method):
+    """
+    Record the calls of an analysis stage in `self.profiler` (if profiling
+    is enabled)
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None:
+            return method(self, *args, **kwargs)
+        with self.profiler.stage(method.__name__, owner=self):
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
 
 class StdAnalysis:
@@ -27,6 +81,9 @@ class StdAnalysis:
     calibration_slopes = None
     "Slopes of the calibration curves"
 
+    fringe_parameters = None
+    "Fringe model `offset + a cos(k bias) + b sin(k bias)` fitted on each pixel calibration curve, stacked as `(offset, a, b, k)` (see `StdAnalysis.fit_calibration_fringes`)"
+
     fully_calibrated_images = None
     phase_corrected_images = None
     calibration_slopes_video_indexed = None
@@ -46,14 +103,240 @@ class StdAnalysis:
     clipped_image = None
     "Mode image with extreme values removed"
 
-    def __init__(self, file):
+    sensitivity = None
+    "Amplitude of the calibration curves (used for the membrane shape masking)"
+
+    harmonic_images = None
+    "Complex lock-in components of each video at several harmonics (see `StdAnalysis.compute_harmonic_images`)"
+
+    lockin_slab = 32
+    "Number of frames read at once by the lock-in engine when there is no memory limit"
+
+    def __init__(
+        self,
+        file,
+        memory_limit=None,
+        n_workers=1,
+        roi=None,
+        cache=None,
+        engine="std",
+        lockin_frequency=None,
+        dtype=np.float64,
+        profile=False,
+        binning=1,
+        frame_step=1,
+    ):
         """
         Initialise the analysis class.
 
         Args:
             file (h5py.File): A hdf5 file handle (for instance
+            memory_limit (int): If set, videos are streamed from the file in
+                time slabs so that `StdAnalysis.std_image_streaming` stays
+                below roughly this number of bytes per video.
+            n_workers (int): Number of processes used to compute the video
+                images in parallel. Each worker opens the file read-only on
+                its own so `file` must be an actual file on disk. The number
+                of workers is capped so that they fit in the available memory.
+            roi (tuple | np.ndarray): Restrict the analysis to this region of
+                the sensor (in binned pixels if `binning` is set), as
+                `(rows, columns)` slices, a `(row_start, row_stop,
+                column_start, column_stop)` bounding box or a full frame
+                boolean mask (e.g. the `mask` of a previous run placed back
+                with `StdAnalysis.to_full_frame`), whose bounding box is used.
+                Only the corresponding hyperslabs are read from the file and
+                every stage works on the cropped images. Note that the
+                membrane masking background then only sees the region.
+            cache (StageCache | bool): Cache for the intermediate results
+                (see `strobing_interferometer.cache.StageCache`). `True`
+                uses a cache directory next to the acquisition file.
+            engine (str): How the image of each video is computed:
+                - `"std"`: `StdAnalysis.std_image`
+                - `"lockin"`: `StdAnalysis.lockin_image`, demodulating the
+                  video at the strobe detuning
+            lockin_frequency (float): Demodulation frequency (in Hz) of the
+                lock-in engine. Defaults to the `strobe detuning` attribute
+                of the `stroboscopic` group.
+            dtype (np.dtype): Floating point type of the images and of the
+                video copies. `np.float32` halves the memory of every stage;
+                means, variances and dot products are still accumulated in
+                float64. The float32 mode image differs from the float64 one
+                by a relative error below about 1e-5 with the std engine
+                (rounding of the calibration values, about 1e-7 of the pixel
+                intensity, amplified by the finite difference slopes) and
+                1e-4 with the lock-in engine on low amplitude pixels. Pixels
+                where two videos are equally sensitive (or where the phase
+                sign is ambiguous) may pick a different video.
+            profile (bool): Record the time, memory and hdf5 reads of each
+                stage in `self.profiler` (see
+                `strobing_interferometer.profiling.StageProfiler`).
+            binning (int): Average the images by blocks of `binning x binning`
+                pixels as they are read (see
+                `strobing_interferometer.binning.BinnedDataset`). All the
+                stages then work on the binned images.
+            frame_step (int): Only read one video frame every `frame_step`.
+                The frame rate seen by the lock-in engine is divided
+                accordingly, so the strobe detuning must stay below half of
+                it.
         """
+        if engine not in ("std", "lockin"):
+            raise ValueError(f"Unknown engine: {engine}")
+        if binning < 1 or frame_step < 1:
+            raise ValueError("binning and frame_step must be positive")
+        self.profiler = StageProfiler() if profile else None
+        if self.profiler is not None and file is not None:
+            file = self.profiler.wrap(file)
+        self._source = file
+        if (binning, frame_step) != (1, 1) and file is not None:
+            file = BinnedGroup(file, binning, frame_step)
         self._file = file
+        self.memory_limit = memory_limit
+        self.n_workers = n_workers
+        self.roi = self.roi_slices(roi)
+        if cache is True:
+            cache = StageCache.for_file(file.filename)
+        self.cache = cache or None
+        self._cache_keys = {}
+        self._backgrounds = {}
+        self._backgrounds_source = None
+        self.engine = engine
+        self.lockin_frequency = lockin_frequency
+        self.dtype = np.dtype(dtype)
+        self.binning = binning
+        self.frame_step = frame_step
+
+    def _worker_options(self):
+        """
+        Keyword arguments used to rebuild this analysis in a worker process
+        """
+        return {
+            "memory_limit": self.memory_limit,
+            "roi": self.roi,
+            "engine": self.engine,
+            "lockin_frequency": self.lockin_frequency,
+            "dtype": self.dtype,
+            "binning": self.binning,
+            "frame_step": self.frame_step,
+        }
+
+    @staticmethod
+    def roi_slices(roi, margin=0):
+        """
+        Convert a region of interest to a `(rows, columns)` tuple of slices.
+
+        Args:
+            roi (tuple | np.ndarray): `None` (whole sensor), a tuple of two
+                slices, a `(row_start, row_stop, column_start, column_stop)`
+                bounding box or a 2D boolean mask
+            margin (int): Pixels added around the bounding box of a mask
+
+        Returns:
+            tuple[slice, slice]: The region of interest
+        """
+        if roi is None:
+            return (slice(None), slice(None))
+        if isinstance(roi, np.ndarray):
+            if roi.ndim != 2 or roi.dtype != bool:
+                raise ValueError("A roi mask must be a 2D boolean array")
+            if not roi.any():
+                raise ValueError("The roi mask is empty")
+            bounds = []
+            for axis in (1, 0):
+                indices = np.flatnonzero(roi.any(axis=axis))
+                bounds.append(
+                    slice(
+                        max(int(indices[0]) - margin, 0),
+                        min(int(indices[-1]) + 1 + margin, roi.shape[1 - axis]),
+                    )
+                )
+            return tuple(bounds)
+        roi = tuple(roi)
+        if len(roi) == 4:
+            return (slice(roi[0], roi[1]), slice(roi[2], roi[3]))
+        if len(roi) == 2 and all(isinstance(s, slice) for s in roi):
+            return roi
+        raise ValueError(f"Invalid roi: {roi!r}")
+
+    def to_full_frame(self, image, fill=np.nan):
+        """
+        Place an image of the region of interest (or a stack of them, on the
+        last two axes) back in a full frame
+
+        Args:
+            image (np.ndarray): Result of a stage, e.g. `self.clipped_image`
+            fill: Value of the pixels outside of the region of interest
+
+        Returns:
+            np.ndarray: The full frame image
+        """
+        self.file_open_or_fail()
+        frame_shape = self._file["bias calibration"]["photos"].shape[-2:]
+        full = np.full(
+            (*image.shape[:-2], *frame_shape), fill, np.result_type(image, fill)
+        )
+        full[(Ellipsis, *self.roi)] = image
+        return full
+
+    def _frame_selection(self, rows=slice(None)):
+        """
+        Selection restricting the last two axes of a dataset to `self.roi`
+
+        Args:
+            rows (slice): Only select these rows of the region of interest
+        """
+        if rows == slice(None):
+            return (Ellipsis, *self.roi)
+        roi_rows = self.get_roi_ranges()[0][rows]
+        return (
+            Ellipsis,
+            slice(roi_rows.start, roi_rows.stop, roi_rows.step),
+            self.roi[1],
+        )
+
+    def get_roi_ranges(self):
+        """
+        Rows and columns of the sensor in `self.roi` (as `range` objects)
+        """
+        self.file_open_or_fail()
+        height, width = self._file["bias calibration"]["photos"].shape[-2:]
+        return (
+            range(*self.roi[0].indices(height)),
+            range(*self.roi[1].indices(width)),
+        )
+
+    def get_frame_shape(self):
+        """
+        Shape of the analysed images (i.e. of the region of interest)
+        """
+        rows, columns = self.get_roi_ranges()
+        return (len(rows), len(columns))
+
+    def _cache_key(self, stage, **params):
+        """
+        Key of a stage in `self.cache`.
+
+        Returns `None` (i.e. don't cache) if there is no cache or if the
+        `upstream` stage key is given but unknown.
+        """
+        if self.cache is None or params.get("upstream", "") is None:
+            return None
+        return self.cache.key(
+            stage,
+            source=StageCache.source_identity(self._file.filename),
+            roi=self.roi,
+            binning=self.binning,
+            frame_step=self.frame_step,
+            **params,
+        )
+
+    def _cache_load(self, key):
+        if key is None:
+            return None
+        return self.cache.load(key)
+
+    def _cache_store(self, key, stage, arrays):
+        if key is not None:
+            self.cache.store(key, stage, arrays)
 
     @property
     def is_open(self):
@@ -66,13 +349,35 @@ class StdAnalysis:
         if not self.is_open:
             raise IOError("HDF5 file closed too early")
 
-    def get_calibration_photos(self):
+    def get_calibration_photos(self, rows=slice(None)):
+        """
+        Args:
+            rows (slice): Only read these rows of the region of interest
+        """
         self.file_open_or_fail()
-        return self._file["bias calibration"]["photos"][...]
+        photos = self._file["bias calibration"]["photos"][self._frame_selection(rows)]
+        order = self._calibration_order()
+        if order is not None:
+            photos = photos[order]
+        return photos
 
     def get_calibration_biases(self):
+        """
+        The calibration biases, sorted (an adaptive calibration stores them
+        in the acquisition order)
+        """
         self.file_open_or_fail()
-        return self._file["bias calibration"]["biases"][...]
+        return np.sort(self._file["bias calibration"]["biases"][...])
+
+    def _calibration_order(self):
+        """
+        Order of the calibration photos by increasing bias (`None` if they
+        are already sorted)
+        """
+        biases = self._file["bias calibration"]["biases"][...]
+        if np.all(np.diff(biases) >= 0):
+            return None
+        return np.argsort(biases, kind="stable")
 
     def get_videos(self):
         """
@@ -85,7 +390,7 @@ class StdAnalysis:
         self.file_open_or_fail()
         return (
             (  # Use a generator to load lazily the videos
-                self._file["stroboscopic"][k][...]
+                self._file["stroboscopic"][k][self._frame_selection()]
                 for k in self._file["stroboscopic"].keys()
             ),
             [
@@ -95,43 +400,504 @@ class StdAnalysis:
             len(self._file["stroboscopic"].keys()),
         )
 
-    def smooth_calibration(self, window=np.array([0.1, 0.25, 0.3, 0.25, 0.1])):
+    def get_video_names(self):
+        """
+        Names of the videos in the `stroboscopic` group
+        """
+        self.file_open_or_fail()
+        return list(self._file["stroboscopic"].keys())
+
+    def get_video_datasets(self):
+        """
+        Same as `StdAnalysis.get_videos` but return the video datasets
+        without loading them, so that they can be read by slices.
+
+        The datasets can't outlive the file handle
+        """
+        self.file_open_or_fail()
+        return (
+            [self._file["stroboscopic"][k] for k in self._file["stroboscopic"].keys()],
+            [
+                self._file["stroboscopic"][k].attrs["bias(V)"]
+                for k in self._file["stroboscopic"].keys()
+            ],
+            len(self._file["stroboscopic"].keys()),
+        )
+
+    def video_image(self, name):
+        """
+        Compute the image of a single video (see `StdAnalysis.std_image` and
+        `StdAnalysis.lockin_image`).
+
+        Args:
+            name (str): Name of the video in the `stroboscopic` group
+        """
+        self.file_open_or_fail()
+        video = self._file["stroboscopic"][name]
+        if self.engine == "lockin":
+            return self.lockin_image(self.video_lockin(name)[0])
+        if self.memory_limit is None:
+            return self.std_image(video[self._frame_selection()], self.dtype)
+        return self.std_image_streaming(
+            video, self.memory_limit, self.roi, self.dtype
+        )
+
+    def video_image_memory(self, video_shape, video_dtype=np.uint16):
+        """
+        Estimate the peak memory in bytes needed by `StdAnalysis.video_image`
+        """
+        if self.memory_limit is not None:
+            return self.memory_limit
+        n_pixels = int(np.prod(video_shape[1:]))
+        if self.engine == "lockin":
+            # slab (raw and float copy) + float64 accumulators
+            return self.lockin_slab * n_pixels * (
+                np.dtype(video_dtype).itemsize + self.dtype.itemsize
+            ) + 6 * n_pixels * np.dtype(np.float64).itemsize
+        # raw video + mean subtracted copy + a few float64 images
+        return video_shape[0] * n_pixels * (
+            np.dtype(video_dtype).itemsize + self.dtype.itemsize
+        ) + 4 * n_pixels * np.dtype(np.float64).itemsize
+
+    def video_images(self):
+        """
+        Compute the images of all the videos (see
+        `StdAnalysis.video_image`).
+
+        Images found in `self.cache` are loaded instead of computed. The
+        others are computed on a process pool if `self.n_workers > 1`: the
+        number of workers is then reduced so that the estimated peak memory
+        of the workers fits in the available memory.
+
+        Returns:
+            list[np.ndarray]: One image per video
+        """
+        datasets, _, _ = self.get_video_datasets()
+        names = self.get_video_names()
+        keys = [
+            self._cache_key(
+                "video_image",
+                name=name,
+                engine=self.engine,
+                lockin_frequency=self.lockin_frequency,
+                dtype=self.dtype,
+            )
+            for name in names
+        ]
+        images = [self._cache_load(key) for key in keys]
+        images = [None if image is None else image["image"] for image in images]
+        missing = [i for i, image in enumerate(images) if image is None]
+        if not missing:
+            return images
+
+        per_worker = self.video_image_memory(datasets[0].shape, datasets[0].dtype)
+        n_workers = min(self.n_workers, len(missing))
+        free = available_memory()
+        if free is not None:
+            n_workers = max(1, min(n_workers, free // per_worker))
+
+        if n_workers > 1:
+            with ProcessPoolExecutor(n_workers) as executor:
+                computed = executor.map(
+                    _analysis_worker,
+                    repeat(type(self)),
+                    repeat(self._file.filename),
+                    repeat(self._worker_options()),
+                    repeat("video_image"),
+                    [names[i] for i in missing],
+                )
+                computed = list(
+                    tqdm(computed, total=len(missing), desc="Processing videos")
+                )
+        else:
+            computed = [
+                self.video_image(names[i])
+                for i in tqdm(missing, desc="Processing videos")
+            ]
+        for i, image in zip(missing, computed):
+            images[i] = image
+            self._cache_store(keys[i], "video_image", {"image": image})
+        return images
+
+    @staticmethod
+    def even_biases(biases, tolerance=0.1):
+        """
+        Evenly spaced biases, at the median spacing of `biases`, to resample
+        the calibration of an adaptive acquisition on.
+
+        Returns:
+            np.ndarray: The biases, or `None` if the spacing of `biases` is
+            already even within `tolerance` (relative)
+        """
+        spacing = np.diff(biases)
+        step = np.median(spacing)
+        if np.allclose(spacing, step, rtol=tolerance, atol=0):
+            return None
+        n_biases = int(round((biases[-1] - biases[0]) / step)) + 1
+        return np.linspace(biases[0], biases[-1], n_biases)
+
+    @staticmethod
+    def resample_along_bias(photos, biases, grid):
+        """
+        Linear interpolation of every pixel calibration curve at the `grid`
+        biases
+
+        Args:
+            photos (np.ndarray): Calibration photos (bias along the first axis)
+            biases (np.ndarray): The sorted biases of the photos
+            grid (np.ndarray): The biases to interpolate at
+        """
+        index = np.clip(np.searchsorted(biases, grid), 1, biases.size - 1)
+        weight = (grid - biases[index - 1]) / (biases[index] - biases[index - 1])
+        out = np.empty((grid.size, *photos.shape[1:]))
+        for i, (j, w) in enumerate(zip(index, weight)):
+            np.multiply(photos[j - 1], 1 - w, out=out[i])
+            out[i] += w * photos[j]
+        return out
+
+    @staticmethod
+    def smooth_along_bias(photos, window, out=None, block_size=2**22):
+        """
+        Smooth every pixel calibration curve at once.
+
+        Same as `np.convolve(window, photos[:, i, j], mode="valid")` for each
+        pixel `(i, j)`, as a weighted sum of shifted slices of `photos`. The
+        rows are processed by blocks of about `block_size` bytes so that the
+        shifted slices stay in the CPU cache.
+
+        Args:
+            photos (np.ndarray): Calibration photos (bias along the first axis)
+            window (np.ndarray): The kernel for the smoothing
+            out (np.ndarray): Where to put the result (its dtype is the one
+                of the computation). A float64 array is allocated if `None`.
+            block_size (int): Size in bytes of the blocks of photos
+        """
+        n_smoothed = photos.shape[0] - window.size + 1
+        if out is None:
+            out = np.empty((n_smoothed, *photos.shape[1:]))
+        row_size = photos[:, 0].nbytes if photos.shape[1] else 1
+        block_rows = max(1, block_size // row_size)
+        weighted = np.empty_like(out[:, :block_rows])
+        for start in range(0, photos.shape[1], block_rows):
+            block = photos[:, start : start + block_rows]
+            block_out = out[:, start : start + block_rows]
+            block_weighted = weighted[:, : block.shape[1]]
+            block_out[...] = 0
+            for k, weight in enumerate(window[::-1]):
+                np.multiply(
+                    block[k : k + n_smoothed],
+                    weight,
+                    out=block_weighted,
+                    casting="same_kind",
+                )
+                block_out += block_weighted
+        return out
+
+    @profiled_stage
+    def smooth_calibration(
+        self,
+        window=np.array([0.1, 0.25, 0.3, 0.25, 0.1]),
+        dtype=None,
+        chunk_rows=None,
+    ):
         """
         Smooth the calibration data points.
 
         Sets `self.calibration_biases` and `self.calibration_values` to
         respectively the biases values and the smoothed pixel intensity values.
 
+        The kernel assumes evenly spaced biases: the unevenly spaced photos of
+        an adaptive calibration are first resampled linearly at evenly spaced
+        biases (see `StdAnalysis.even_biases`).
+
         Args:
             window (np.ndarray): The kernel for the smoothing
-
-
+            dtype (np.dtype): dtype of `self.calibration_values`
+                (`np.float32` halves the memory). Defaults to `self.dtype`.
+            chunk_rows (int): Read and smooth the photos by blocks of this
+                number of rows. By default the blocks fit in
+                `self.memory_limit` (or all the rows are read at once if there
+                is no limit).
         """
         if len(window.shape) > 1:
             raise ValueError("Smoothing kernel should be 1-dimensional")
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+
+        key = self._cache_key("smooth_calibration", window=window, dtype=dtype)
+        self._cache_keys["smooth_calibration"] = key
+        self.sensitivity = None
+        cached = self._cache_load(key)
+        if cached is not None:
+            self.calibration_biases = cached["calibration_biases"]
+            self.calibration_values = cached["calibration_values"]
+            return
 
-        photos = self.get_calibration_photos()
         biases = self.get_calibration_biases()
-        smoothed = np.apply_along_axis(
-            lambda x: np.convolve(window, x, mode="valid"), axis=0, arr=photos
+        grid = self.even_biases(biases)
+        smoothed_biases = biases if grid is None else grid
+        height, width = self.get_frame_shape()
+        if chunk_rows is None and self.memory_limit is not None:
+            # photos block (float64), resampled block + smoothing temporary
+            row_size = width * (
+                biases.size * np.dtype(np.float64).itemsize
+                + smoothed_biases.size * np.dtype(dtype).itemsize
+            )
+            if grid is not None:
+                row_size += grid.size * width * np.dtype(np.float64).itemsize
+            chunk_rows = max(1, self.memory_limit // row_size)
+
+        def read_photos(rows=slice(None)):
+            photos = self.get_calibration_photos(rows)
+            if grid is None:
+                return photos
+            return self.resample_along_bias(photos, biases, grid)
+
+        smoothed = np.empty(
+            (smoothed_biases.size - window.size + 1, height, width), dtype
         )
+        if chunk_rows is None or chunk_rows >= height:
+            self.smooth_along_bias(read_photos(), window, smoothed)
+        else:
+            for start in range(0, height, chunk_rows):
+                rows = slice(start, start + chunk_rows)
+                self.smooth_along_bias(read_photos(rows), window, smoothed[:, rows])
         offset = window.size // 2  # number of values missing on each side
 
-        self.calibration_biases = biases[offset:-offset]
+        self.calibration_biases = smoothed_biases[
+            offset : smoothed_biases.size - offset
+        ]
         self.calibration_values = smoothed
+        self._cache_store(
+            key,
+            "smooth_calibration",
+            {
+                "calibration_biases": self.calibration_biases,
+                "calibration_values": self.calibration_values,
+            },
+        )
 
+    @profiled_stage
     def compute_calibration_slopes(self):
         """
         Sets `self.calibration_slopes` to the slopes of calibration curves
+        (in intensity per volt, using the actual spacing of
+        `self.calibration_biases`)
         """
         if self.calibration_values is None:
             raise Exception("")
-        self.calibration_slopes = np.array(
-            np.gradient(self.calibration_values, axis=0)
-        )  # TODO: Provide X values for the gradient
+        key = self._cache_key(
+            "calibration_slopes",
+            upstream=self._cache_keys.get("smooth_calibration"),
+            spacing="biases",
+        )
+        self._cache_keys["calibration_slopes"] = key
+        cached = self._cache_load(key)
+        if cached is not None:
+            self.calibration_slopes = cached["calibration_slopes"]
+            return
+        self.calibration_slopes = np.gradient(
+            self.calibration_values, self.calibration_biases, axis=0
+        )
+        self._cache_store(
+            key, "calibration_slopes", {"calibration_slopes": self.calibration_slopes}
+        )
+
+    @staticmethod
+    def fit_fringes(biases, curves, iterations=3, oversampling=4):
+        """
+        Fit the fringe model `offset + a cos(k bias) + b sin(k bias)` on many
+        calibration curves at once.
+
+        The fit is done for all the curves simultaneously (arrays of shape
+        `(n_biases, n_curves)`):
+            1. `k` is seeded with the peak of the zero padded spectrum of the
+               curves (resampled at evenly spaced biases) and `offset`,
+               `a` and `b` are solved linearly at this `k`.
+            2. The four parameters are refined with damped Gauss-Newton
+               (Levenberg-Marquardt) iterations, a step being accepted per
+               curve only if it decreases the residual.
+
+        Args:
+            biases (np.ndarray): The calibration biases
+            curves (np.ndarray): Calibration curves (one per column)
+            iterations (int): Number of Gauss-Newton iterations
+            oversampling (int): Zero padding factor of the spectrum used to
+                seed `k`
+        Returns:
+            np.ndarray: `(offset, a, b, k)` for each curve, shape `(4, n_curves)`
+        """
+        origin = np.mean(biases)
+        x = (biases - origin)[:, None]  # centered for a better conditioning
+        y = np.asarray(curves, dtype=np.float64)
+        n_biases, n_curves = y.shape
+        curve_index = np.arange(n_curves)
+        diagonal = np.arange(4)
+
+        # Seed k with the spectrum peak (with a parabolic interpolation)
+        step = (biases[-1] - biases[0]) / (n_biases - 1)
+        n_fft = oversampling * n_biases
+        grid = biases[0] + step * np.arange(n_biases)
+        if np.allclose(biases, grid, rtol=0, atol=0.1 * step):
+            even = y
+        else:  # adaptive calibration: resample the curves evenly
+            index = np.clip(np.searchsorted(biases, grid), 1, n_biases - 1)
+            width = biases[index] - biases[index - 1]
+            weight = ((grid - biases[index - 1]) / width)[:, None]
+            even = y[index - 1] * (1 - weight) + y[index] * weight
+        spectrum = np.abs(np.fft.rfft(even - np.mean(even, axis=0), n=n_fft, axis=0))
+        peak = np.clip(np.argmax(spectrum[1:], axis=0) + 1, 1, spectrum.shape[0] - 2)
+        left = spectrum[peak - 1, curve_index]
+        middle = spectrum[peak, curve_index]
+        right = spectrum[peak + 1, curve_index]
+        curvature = left - 2 * middle + right
+        shift = np.divide(
+            0.5 * (left - right),
+            curvature,
+            out=np.zeros(n_curves),
+            where=curvature != 0,
+        )
+        k = 2 * np.pi * (peak + shift) / (n_fft * step)
+
+        def solve(normal, rhs):
+            # Regularize the (nearly) singular systems of flat curves
+            size = normal.shape[-1]
+            normal[:, np.arange(size), np.arange(size)] += 1e-12 * (
+                np.max(normal[:, np.arange(size), np.arange(size)], axis=1)[:, None]
+                + 1e-300
+            )
+            return np.linalg.solve(normal, rhs[..., None])[..., 0]
+
+        # Linear solve of offset, a, b at fixed k
+        phase = x * k
+        design = np.stack([np.ones_like(phase), np.cos(phase), np.sin(phase)], -1)
+        offset, a, b = solve(
+            np.einsum("npi,npj->pij", design, design, optimize=True),
+            np.einsum("npi,np->pi", design, y, optimize=True),
+        ).T
+        params = np.stack([offset, a, b, k])
+
+        def evaluate(params):
+            offset, a, b, k = params
+            phase = x * k
+            cos, sin = np.cos(phase), np.sin(phase)
+            residual = y - (offset + a * cos + b * sin)
+            return residual, cos, sin, np.sum(residual**2, axis=0)
+
+        residual, cos, sin, cost = evaluate(params)
+        damping = np.full(n_curves, 1e-3)
+        for _ in range(iterations):
+            offset, a, b, k = params
+            jacobian = np.stack(
+                [np.ones_like(cos), cos, sin, x * (b * cos - a * sin)], -1
+            )
+            normal = np.einsum("npi,npj->pij", jacobian, jacobian, optimize=True)
+            normal[:, diagonal, diagonal] *= 1 + damping[:, None]
+            candidate = params + solve(
+                normal, np.einsum("npi,np->pi", jacobian, residual, optimize=True)
+            ).T
+            (
+                candidate_residual,
+                candidate_cos,
+                candidate_sin,
+                candidate_cost,
+            ) = evaluate(candidate)
+            better = candidate_cost < cost
+            improvement = np.max((cost - candidate_cost)[better] / cost[better], initial=0)
+            params = np.where(better, candidate, params)
+            residual = np.where(better, candidate_residual, residual)
+            cos = np.where(better, candidate_cos, cos)
+            sin = np.where(better, candidate_sin, sin)
+            cost = np.where(better, candidate_cost, cost)
+            damping = np.where(better, damping / 3, damping * 10)
+            if improvement < 1e-10:
+                break  # converged for all the curves
+
+        # Express the phase with respect to bias 0 instead of `origin`
+        offset, a, b, k = params
+        phase = k * origin
+        return np.stack(
+            [
+                offset,
+                a * np.cos(phase) - b * np.sin(phase),
+                a * np.sin(phase) + b * np.cos(phase),
+                k,
+            ]
+        )
+
+    @profiled_stage
+    def fit_calibration_fringes(self, iterations=3, chunk_pixels=2**14):
+        """
+        Fit a fringe model on the (raw) calibration curve of each pixel (see
+        `StdAnalysis.fit_fringes`) and set `self.fringe_parameters`.
+
+        Once fitted, `StdAnalysis.compute_independant_video_images` uses the
+        analytic slopes of the model at the exact bias of each video
+        (`StdAnalysis.fringe_slopes`) instead of the nearest finite difference
+        slope, so `StdAnalysis.smooth_calibration` and
+        `StdAnalysis.compute_calibration_slopes` are not needed.
+
+        Args:
+            iterations (int): Number of Gauss-Newton iterations
+            chunk_pixels (int): Number of pixels fitted at once (the fit
+                temporaries use about `chunk_pixels * n_biases * 120` bytes)
+        """
+        key = self._cache_key("fringe_fit", iterations=iterations)
+        self._cache_keys["fringe_fit"] = key
+        cached = self._cache_load(key)
+        if cached is not None:
+            self.fringe_parameters = cached["fringe_parameters"]
+            return
+        photos = self.get_calibration_photos()
+        biases = self.get_calibration_biases()
+        curves = photos.reshape(photos.shape[0], -1)
+        params = np.empty((4, curves.shape[1]))
+        for start in tqdm(range(0, curves.shape[1], chunk_pixels), desc="Fitting"):
+            params[:, start : start + chunk_pixels] = self.fit_fringes(
+                biases, curves[:, start : start + chunk_pixels], iterations
+            )
+        self.fringe_parameters = params.reshape(4, *photos.shape[1:])
+        self._cache_store(
+            key, "fringe_fit", {"fringe_parameters": self.fringe_parameters}
+        )
+
+    def fringe_model(self, biases):
+        """
+        Value of the fitted fringe model of each pixel at the given biases
+        (shape `(len(biases), *frame_shape)`)
+        """
+        offset, a, b, k = self.fringe_parameters
+        phase = np.multiply.outer(biases, k)
+        return offset + a * np.cos(phase) + b * np.sin(phase)
+
+    def fringe_slopes(self, biases):
+        """
+        Analytic slopes of the fitted fringe model of each pixel at the given
+        biases (shape `(len(biases), *frame_shape)`)
+        """
+        _, a, b, k = self.fringe_parameters
+        phase = np.multiply.outer(biases, k)
+        return k * (b * np.cos(phase) - a * np.sin(phase))
+
+    @staticmethod
+    def time_std(video, dtype=np.float64):
+        """
+        Stddev of each pixel of a video along time.
+
+        `np.std` would make a float64 copy of the whole video: the variance
+        is accumulated in float64 from a `dtype` mean subtracted copy
+        instead.
+
+        Returns:
+            tuple: The stddev image and the mean subtracted video (`dtype`)
+        """
+        normalized_video = np.subtract(video, np.mean(video, axis=0), dtype=dtype)
+        variance = np.einsum(
+            "ijk,ijk->jk", normalized_video, normalized_video, dtype=np.float64
+        ) / len(normalized_video)
+        return np.sqrt(variance).astype(dtype, copy=False), normalized_video
 
     @staticmethod
-    def std_image(video):
+    def std_image(video, dtype=np.float64):
         """
         Compute the mode shape (with phase) image for a single video.
 
@@ -147,47 +913,118 @@ class StdAnalysis:
 
         Args:
             video (np.ndarray): The raw video from the camera.
+            dtype (np.dtype): Type of the mean subtracted copy of the video
+                and of the result (the variance is accumulated in float64)
         Returns:
             np.ndarray: `± std(video, axis=time)`. The ± is determined according to the phase with respect to the reference pixel time trace
         """
-        std = np.std(video, axis=0)
+        std, normalized_video = StdAnalysis.time_std(video, dtype)
 
         # Get coordinates of the brightest pixel
         bightest_pixel: tuple[int, int] = np.unravel_index(
             np.argmax(std, axis=None), std.shape
         )  # pyright: ignore
 
-        transposed_normalized_video = np.transpose(
-            video - np.mean(video, axis=0), (1, 2, 0)
-        )
-
-        brightest_pixel_time_trace = transposed_normalized_video[
-            bightest_pixel[0], bightest_pixel[1], :
+        brightest_pixel_time_trace = normalized_video[
+            :, bightest_pixel[0], bightest_pixel[1]
         ]
 
-        video_dot: np.ndarray = np.dot(
-            transposed_normalized_video, brightest_pixel_time_trace
+        # accumulated in float64 whatever `dtype`
+        video_dot: np.ndarray = np.einsum(
+            "ijk,i->jk", normalized_video, brightest_pixel_time_trace, dtype=np.float64
         )
         return np.where(video_dot > 0, std, -std)
 
-    ## Function that takes in an HDF5 file and returns a list of calibrated videos.
-    def compute_independant_video_images(self):
+    @staticmethod
+    def std_image_streaming(
+        video, memory_limit, roi=(slice(None), slice(None)), dtype=np.float64
+    ):
         """
-        Apply `self.std_images` to each video and then apply a proportional
-        correction using the calibration data to correct
-          1. the spatial intensity variation of the laser
-          2. the position on the interference fringe (if light intensity
-             increase or decrease when the membrane displacement increase).
+        Same as `StdAnalysis.std_image` but read the video by slabs of frames.
 
-        The result is stored in `self.fully_calibrated_images`
+        The video is read twice:
+            1. The per pixel mean and variance are accumulated slab by slab
+               (merging the slab statistics with Chan's formula). The
+               reference pixel is the one with the largest stddev.
+            2. The time trace of the reference pixel is read and the dot
+               product of each pixel time trace with it is accumulated slab by
+               slab.
 
-        We also store the image apply only the second correction to `self.phase_corrected_images`
+        The slab length is chosen so that the slab (raw and `dtype` copy) and
+        the per pixel float64 accumulators fit in `memory_limit`. At least one
+        frame is read at once whatever the limit.
+
+        Args:
+            video (h5py.Dataset): The raw video from the camera. Anything
+                that can be sliced along the first axis works (e.g. a
+                `np.ndarray` or a `np.memmap`).
+            memory_limit (int): Memory budget in bytes.
+            roi (tuple[slice, slice]): Only read this region of the frames
+            dtype (np.dtype): Type of the slab copies and of the result
+        Returns:
+            np.ndarray: Same as `StdAnalysis.std_image`
         """
+        n_frames = video.shape[0]
+        frame_shape = tuple(
+            len(range(*s.indices(n))) for s, n in zip(roi, video.shape[1:])
+        )
+        n_pixels = int(np.prod(frame_shape))
+        # mean, m2, dot, std and temporaries of the slab merge
+        accumulators_size = 6 * n_pixels * np.dtype(np.float64).itemsize
+        frame_size = n_pixels * (
+            np.dtype(video.dtype).itemsize + np.dtype(dtype).itemsize
+        )
+        slab = int(max(1, (memory_limit - accumulators_size) // frame_size))
+        slab = aligned(slab, (getattr(video, "chunks", None) or (None,))[0])
 
-        if self.calibration_slopes is None:
-            raise Exception("")
+        mean = np.zeros(frame_shape)
+        m2 = np.zeros(frame_shape)
+        count = 0
+        for start in range(0, n_frames, slab):
+            chunk = np.asarray(video[(slice(start, start + slab), *roi)], dtype=dtype)
+            chunk_count = chunk.shape[0]
+            chunk_mean = np.mean(chunk, axis=0, dtype=np.float64)
+            chunk -= chunk_mean
+            delta = chunk_mean - mean
+            total = count + chunk_count
+            mean += delta * (chunk_count / total)
+            m2 += np.einsum("ijk,ijk->jk", chunk, chunk, dtype=np.float64)
+            m2 += delta**2 * (count * chunk_count / total)
+            count = total
+        std = np.sqrt(m2 / count).astype(dtype, copy=False)
+
+        # Get coordinates of the brightest pixel
+        bightest_pixel: tuple[int, int] = np.unravel_index(
+            np.argmax(std, axis=None), std.shape
+        )  # pyright: ignore
+        # Read only the reference pixel (in the coordinates of the full frame)
+        rows = range(*roi[0].indices(video.shape[1]))
+        columns = range(*roi[1].indices(video.shape[2]))
+        brightest_pixel_time_trace = (
+            np.asarray(
+                video[:, rows[bightest_pixel[0]], columns[bightest_pixel[1]]],
+                dtype=np.float64,
+            )
+            - mean[bightest_pixel]
+        ).astype(dtype, copy=False)
+
+        video_dot = np.zeros(frame_shape)
+        for start in range(0, n_frames, slab):
+            chunk = np.asarray(video[(slice(start, start + slab), *roi)], dtype=dtype)
+            chunk -= mean
+            video_dot += np.einsum(
+                "ijk,i->jk",
+                chunk,
+                brightest_pixel_time_trace[start : start + slab],
+                dtype=np.float64,
+            )
+        return np.where(video_dot > 0, std, -std)
 
-        videos, specific_biases, video_number = self.get_videos()
+    def video_biases_indices(self, specific_biases):
+        """
+        Find the indices in `self.calibration_*` arrays corresponding to the
+        video biases (nearest calibration bias)
+        """
 
         def find_nearest(array, value):
             idx = np.searchsorted(array, value, side="left")
@@ -198,43 +1035,494 @@ class StdAnalysis:
                 return idx - 1
             return idx
 
-        # Find the indices in calibration_* arrays corresponding to the videos
-        specific_biases_indices = np.array(
+        return np.array(
             [
                 find_nearest(self.calibration_biases, specific_bias)
                 for specific_bias in specific_biases
             ]
         )
+
+    def calibrate_video_images(self, std_images, calibration_slopes_video_indexed):
+        """
+        Apply the calibration to the video images and set
+        `self.fully_calibrated_images`, `self.phase_corrected_images` and
+        `self.calibration_slopes_video_indexed`.
+
+        Args:
+            std_images (np.ndarray): The video images (one per video)
+            calibration_slopes_video_indexed (np.ndarray): The calibration
+                slopes at the bias of each video
+        """
         specific_biases_calibration_slope: np.ndarray = (
-            1 / self.calibration_slopes[specific_biases_indices, :, :]
+            1 / calibration_slopes_video_indexed
+        )
+        std_images_phase_calibrated = np.where(
+            specific_biases_calibration_slope > 0, std_images, -std_images
+        )
+        std_images_full_calibrated = std_images * specific_biases_calibration_slope
+        self._cache_keys.pop("video_images", None)
+        self.fully_calibrated_images = std_images_full_calibrated  # Phase+amplitude
+        self.phase_corrected_images = std_images_phase_calibrated  # phase only
+        self.calibration_slopes_video_indexed = calibration_slopes_video_indexed
+
+    @staticmethod
+    def lockin_components(
+        video,
+        frequency,
+        fps,
+        harmonics=(1,),
+        memory_limit=None,
+        roi=(slice(None), slice(None)),
+        slab=32,
+        dtype=np.float64,
+    ):
+        """
+        Demodulate each pixel time trace at `frequency` (and its harmonics).
+
+        For each harmonic `h`, compute the complex Fourier component
+        `2/N sum_n (video[n] - mean) exp(-2iπ h frequency n / fps)` in a
+        single pass over the frames, reading the video by slabs. The modulus
+        is the amplitude of the pixel oscillation and the argument its phase.
+
+        Args:
+            video (h5py.Dataset): The raw video from the camera (or anything
+                that can be sliced along the first axis)
+            frequency (float): Demodulation frequency in Hz
+            fps (float): Frame rate of the video
+            harmonics (tuple[int]): Harmonics of `frequency` to compute
+            memory_limit (int): If set, the slab length is chosen to fit in
+                this budget (in bytes)
+            roi (tuple[slice, slice]): Only read this region of the frames
+            slab (int): Number of frames read at once if `memory_limit` is
+                not set
+            dtype (np.dtype): Type of the slab copies (the sums are
+                accumulated in float64)
+        Returns:
+            np.ndarray: Complex array of shape `(len(harmonics), *frame_shape)`
+            (complex64 if `dtype` is float32)
+        """
+        n_frames = video.shape[0]
+        frame_shape = tuple(
+            len(range(*s.indices(n))) for s, n in zip(roi, video.shape[1:])
         )
+        n_pixels = int(np.prod(frame_shape))
+        if memory_limit is not None:
+            # real and imaginary parts per harmonic, sum and mean
+            accumulators_size = (
+                (2 * len(harmonics) + 2) * n_pixels * np.dtype(np.float64).itemsize
+            )
+            frame_size = n_pixels * (
+                np.dtype(video.dtype).itemsize + np.dtype(dtype).itemsize
+            )
+            slab = int(max(1, (memory_limit - accumulators_size) // frame_size))
+            slab = aligned(slab, (getattr(video, "chunks", None) or (None,))[0])
 
-        std_images = np.array(
+        angles = (
+            2
+            * np.pi
+            * frequency
+            / fps
+            * np.outer(np.asarray(harmonics, dtype=np.float64), np.arange(n_frames))
+        )
+        cos, sin = np.cos(angles).astype(dtype), np.sin(angles).astype(dtype)
+        real = np.zeros((len(harmonics), *frame_shape))
+        imaginary = np.zeros((len(harmonics), *frame_shape))
+        total = np.zeros(frame_shape)
+        for start in range(0, n_frames, slab):
+            chunk = np.asarray(video[(slice(start, start + slab), *roi)], dtype=dtype)
+            total += np.sum(chunk, axis=0, dtype=np.float64)
+            real += np.einsum(
+                "hi,ijk->hjk", cos[:, start : start + slab], chunk, dtype=np.float64
+            )
+            imaginary -= np.einsum(
+                "hi,ijk->hjk", sin[:, start : start + slab], chunk, dtype=np.float64
+            )
+        # Remove the contribution of the mean (the frames may not cover an
+        # integer number of periods)
+        mean = total / n_frames
+        real -= np.sum(cos, axis=1, dtype=np.float64)[:, None, None] * mean
+        imaginary += np.sum(sin, axis=1, dtype=np.float64)[:, None, None] * mean
+        return ((real + 1j * imaginary) * (2 / n_frames)).astype(
+            np.result_type(dtype, np.complex64), copy=False
+        )
+
+    @staticmethod
+    def lockin_image(components):
+        """
+        Build the same kind of image as `StdAnalysis.std_image` from the
+        lock-in components of a video at the oscillation frequency.
+
+        The pixel with the largest amplitude is the reference. Each pixel is
+        `± amplitude / sqrt(2)` (the stddev of a sinusoid of this amplitude),
+        the sign being the one of the cosine of the phase difference with the
+        reference pixel.
+
+        Args:
+            components (np.ndarray): Complex lock-in components of a video
+                (see `StdAnalysis.lockin_components`)
+        """
+        amplitude = np.abs(components)
+        reference = components[
+            np.unravel_index(np.argmax(amplitude, axis=None), amplitude.shape)
+        ]
+        in_phase = np.real(components * np.conj(reference)) > 0
+        return np.where(in_phase, amplitude, -amplitude) / 2**0.5
+
+    def video_lockin(self, name, harmonics=(1,)):
+        """
+        Compute the lock-in components of a single video (see
+        `StdAnalysis.lockin_components`) at `self.lockin_frequency` (or the
+        strobe detuning) using the `fps` attribute of the video.
+
+        Args:
+            name (str): Name of the video in the `stroboscopic` group
+            harmonics (tuple[int]): Harmonics of the frequency to compute
+        """
+        self.file_open_or_fail()
+        group = self._file["stroboscopic"]
+        frequency = self.lockin_frequency
+        if frequency is None:
+            frequency = abs(group.attrs["strobe detuning"])
+        return self.lockin_components(
+            group[name],
+            frequency,
+            group[name].attrs["fps"],
+            harmonics=harmonics,
+            memory_limit=self.memory_limit,
+            roi=self.roi,
+            slab=self.lockin_slab,
+            dtype=self.dtype,
+        )
+
+    def compute_harmonic_images(self, harmonics=(1, 2, 3)):
+        """
+        Set `self.harmonic_images` to the complex lock-in components of each
+        video at the given harmonics of the demodulation frequency. The array
+        has shape `(n_videos, len(harmonics), *frame_shape)`.
+
+        Args:
+            harmonics (tuple[int]): Harmonics of the demodulation frequency
+        """
+        self.harmonic_images = np.array(
             [
-                self.std_image(video)
-                for video in tqdm(
-                    videos,
-                    total=video_number,
-                    desc="Processing videos",
-                )
+                self.video_lockin(name, harmonics)
+                for name in tqdm(self.get_video_names(), desc="Processing videos")
             ]
         )
-        std_images_phase_calibrated = std_images * np.where(
-            specific_biases_calibration_slope > 0, 1, -1
+
+    ## Function that takes in an HDF5 file and returns a list of calibrated videos.
+    @profiled_stage
+    def compute_independant_video_images(self):
+        """
+        Apply `self.std_images` to each video and then apply a proportional
+        correction using the calibration data to correct
+          1. the spatial intensity variation of the laser
+          2. the position on the interference fringe (if light intensity
+             increase or decrease when the membrane displacement increase).
+
+        The result is stored in `self.fully_calibrated_images`
+
+        We also store the image apply only the second correction to `self.phase_corrected_images`
+
+        If `StdAnalysis.fit_calibration_fringes` was run, the slopes of the
+        fringe model at the video biases are used instead of
+        `self.calibration_slopes`.
+        """
+
+        _, specific_biases, _ = self.get_video_datasets()
+        if self.fringe_parameters is not None:
+            slopes = self.fringe_slopes(np.asarray(specific_biases)).astype(
+                self.dtype, copy=False
+            )
+            upstream = self._cache_keys.get("fringe_fit")
+        elif self.calibration_slopes is not None:
+            slopes = self.calibration_slopes[self.video_biases_indices(specific_biases)]
+            upstream = self._cache_keys.get("calibration_slopes")
+        else:
+            raise Exception("")
+
+        std_images = np.array(self.video_images())
+        self.calibrate_video_images(std_images, slopes)
+        self._cache_keys["video_images"] = self._cache_key(
+            "video_images",
+            upstream=upstream,
+            names=self.get_video_names(),
+            engine=self.engine,
+            lockin_frequency=self.lockin_frequency,
+            dtype=self.dtype,
         )
-        std_images_full_calibrated = std_images * specific_biases_calibration_slope
-        self.fully_calibrated_images = std_images_full_calibrated  # Phase+amplitude
-        self.phase_corrected_images = std_images_phase_calibrated  # phase only
-        self.calibration_slopes_video_indexed = self.calibration_slopes[
-            specific_biases_indices
+
+    def tile_pixel_memory(self):
+        """
+        Estimate the memory in bytes needed per pixel to process a tile in
+        `StdAnalysis.compute_all_tiled`.
+        """
+        self.file_open_or_fail()
+        datasets, _, video_number = self.get_video_datasets()
+        n_biases = self._file["bias calibration"]["photos"].shape[0]
+        grid = self.even_biases(self.get_calibration_biases())
+        n_frames = max(dataset.shape[0] for dataset in datasets)
+        float_size = self.dtype.itemsize
+        # photos (float64), smoothed photos and slopes (and the gradient
+        # temporaries)
+        calibration = n_biases * (np.dtype(np.float64).itemsize + 3 * float_size)
+        if grid is not None:  # resampled photos (float64), larger stacks
+            calibration += grid.size * np.dtype(np.float64).itemsize
+            calibration += (grid.size - n_biases) * 3 * float_size
+        # raw video and mean subtracted copy
+        video = n_frames * (np.dtype(datasets[0].dtype).itemsize + float_size)
+        # tile results
+        results = 3 * video_number * float_size
+        return max(calibration, video) + results
+
+    def plan_tiles(self, memory_limit):
+        """
+        Split `self.roi` in tiles whose processing fits in `memory_limit`
+        bytes (see `StdAnalysis.tile_pixel_memory`).
+
+        Tiles are bands of full rows when possible so that hyperslab reads
+        stay contiguous on disk. With chunked datasets, tiles at least as
+        big as a chunk have their edges aligned on the chunk grid so that no
+        chunk is read by two tiles. Smaller tiles (when a chunk doesn't fit
+        in `memory_limit`) share the chunks they cut.
+
+        Returns:
+            list[tuple[slice, slice]]: The tiles in sensor coordinates
+        """
+        rows, columns = self.get_roi_ranges()
+        if rows.step != 1 or columns.step != 1:
+            raise ValueError("Tiling needs a contiguous region of interest")
+        tile_pixels = memory_limit // self.tile_pixel_memory()
+        if tile_pixels < 1:
+            raise ValueError("memory_limit is too small to process a single pixel")
+        chunks = self._file["bias calibration"]["photos"].chunks or (None, None)
+        tile_width = aligned(min(len(columns), tile_pixels), chunks[-1])
+        tile_height = max(1, min(len(rows), tile_pixels // tile_width))
+        tile_height = aligned(tile_height, chunks[-2])
+
+        def edges(indices, size, chunk):
+            if not chunk or size % chunk:
+                return [*range(indices.start, indices.stop, size), indices.stop]
+            first = (indices.start // size + 1) * size
+            return [indices.start, *range(first, indices.stop, size), indices.stop]
+
+        row_edges = edges(rows, tile_height, chunks[-2])
+        column_edges = edges(columns, tile_width, chunks[-1])
+        return [
+            (slice(top, bottom), slice(left, right))
+            for top, bottom in zip(row_edges, row_edges[1:])
+            for left, right in zip(column_edges, column_edges[1:])
         ]
 
-    def combine_images(self):
+    def tile_first_pass(self, window):
+        """
+        First pass of `StdAnalysis.compute_all_tiled` on `self.roi`: smooth
+        the calibration, compute the slopes, the sensitivity and the stddev
+        of each video along time (or its lock-in components with the lock-in
+        engine).
+        """
+        self.smooth_calibration(window)
+        self.compute_calibration_slopes()
+        videos, specific_biases, _ = self.get_videos()
+        result = {
+            "calibration_biases": self.calibration_biases,
+            "calibration_slopes_video_indexed": self.calibration_slopes[
+                self.video_biases_indices(specific_biases)
+            ],
+            "sensitivity": np.std(
+                self.calibration_values, axis=0, dtype=np.float64
+            ).astype(self.dtype, copy=False),
+        }
+        # the calibration stacks would otherwise add up with the videos
+        # (`StdAnalysis.tile_pixel_memory` counts the larger of the two)
+        self.calibration_values = None
+        self.calibration_slopes = None
+        if self.engine == "lockin":
+            result["lockin"] = np.array(
+                [self.video_lockin(name)[0] for name in self.get_video_names()]
+            )
+        else:
+            result["std"] = np.array(
+                [self.time_std(video, self.dtype)[0] for video in videos]
+            )
+        return result
+
+    def tile_second_pass(self, reference_time_traces):
+        """
+        Second pass of `StdAnalysis.compute_all_tiled` on `self.roi`: dot
+        product of each pixel time trace with the (mean subtracted) time trace
+        of the reference pixel of the video.
+        """
+        videos, _, _ = self.get_videos()
+        return np.array(
+            [
+                np.einsum(
+                    "ijk,i->jk",
+                    np.subtract(video, np.mean(video, axis=0), dtype=self.dtype),
+                    reference_time_trace,
+                    dtype=np.float64,
+                )
+                for video, reference_time_trace in zip(videos, reference_time_traces)
+            ]
+        )
+
+    def _map_tiles(self, tiles, executor, n_workers, method, *args):
+        """
+        Call `method(*args)` on an analysis restricted to each tile, on a pool
+        of threads or processes. Results are returned in the order of `tiles`.
+        """
+        options = dict(self._worker_options(), memory_limit=None, n_workers=1)
+        if executor == "thread":
+
+            def run(tile):
+                return getattr(
+                    type(self)(self._source, **dict(options, roi=tile)), method
+                )(*args)
+
+            with ThreadPoolExecutor(n_workers) as pool:
+                return list(tqdm(pool.map(run, tiles), total=len(tiles)))
+        if executor == "process":
+            with ProcessPoolExecutor(n_workers) as pool:
+                futures = [
+                    pool.submit(
+                        _analysis_worker,
+                        type(self),
+                        self._file.filename,
+                        dict(options, roi=tile),
+                        method,
+                        *args,
+                    )
+                    for tile in tiles
+                ]
+                return [future.result() for future in tqdm(futures)]
+        raise ValueError(f"Unknown executor: {executor}")
+
+    @profiled_stage
+    def compute_all_tiled(
+        self,
+        memory_limit=None,
+        executor="thread",
+        n_workers=None,
+        window=np.array([0.1, 0.25, 0.3, 0.25, 0.1]),
+    ):
+        """
+        Same as `StdAnalysis.compute_all` but process the sensor by tiles so
+        that the whole analysis fits in `memory_limit` bytes.
+
+        Only the hyperslabs of the calibration photos and videos matching a
+        tile are read at once. Since the reference pixel of
+        `StdAnalysis.std_image` is global to the frame, videos are read twice
+        (once with the lock-in engine):
+            1. Per tile: calibration smoothing and slopes, sensitivity and
+               stddev of each video. The reference pixel of each video is then
+               picked on the stitched stddev images.
+            2. Per tile: dot product with the reference pixel time trace.
+
+        The remaining stages work on stitched full frame images. The full
+        calibration stacks (`self.calibration_values` and
+        `self.calibration_slopes`) are not kept and the stages are not cached.
+
+        Args:
+            memory_limit (int): Memory budget in bytes. Defaults to
+                `self.memory_limit`.
+            executor (str): `"thread"` or `"process"` pool for the tiles
+            n_workers (int): Number of tiles processed concurrently. Defaults
+                to `self.n_workers`.
+            window (np.ndarray): The kernel for the calibration smoothing
+        """
+        memory_limit = self.memory_limit if memory_limit is None else memory_limit
+        if memory_limit is None:
+            raise ValueError("A memory limit is needed for the tiled analysis")
+        n_workers = self.n_workers if n_workers is None else n_workers
+        self._cache_keys = {}  # the tiled stages are not cached
+
+        datasets, _, video_number = self.get_video_datasets()
+        frame_shape = self.get_frame_shape()
+        n_pixels = int(np.prod(frame_shape))
+        # stitched images and temporaries of the full frame stages
+        resident = (6 * video_number + 8) * n_pixels * self.dtype.itemsize
+        tiles = self.plan_tiles((memory_limit - resident) // n_workers)
+
+        rows, columns = self.get_roi_ranges()
+
+        def stitch(results, key=None):
+            image = None
+            origin = (rows.start, columns.start)
+            for tile, result in zip(tiles, results):
+                if key is not None:
+                    result = result[key]
+                if image is None:
+                    image = np.empty((*result.shape[:-2], *frame_shape), result.dtype)
+                image[
+                    ...,
+                    tile[0].start - origin[0] : tile[0].stop - origin[0],
+                    tile[1].start - origin[1] : tile[1].stop - origin[1],
+                ] = result
+            return image
+
+        first_pass = self._map_tiles(
+            tiles, executor, n_workers, "tile_first_pass", window
+        )
+        self.calibration_biases = first_pass[0]["calibration_biases"]
+        self.calibration_values = None
+        self.calibration_slopes = None
+        self.sensitivity = stitch(first_pass, "sensitivity")
+        calibration_slopes_video_indexed = stitch(
+            first_pass, "calibration_slopes_video_indexed"
+        )
+        if self.engine == "lockin":
+            # The lock-in components are per pixel: no second pass needed
+            self.calibrate_video_images(
+                np.array(
+                    [self.lockin_image(c) for c in stitch(first_pass, "lockin")]
+                ),
+                calibration_slopes_video_indexed,
+            )
+            del first_pass
+            self.combine_images()
+            self.apply_membrane_shape_masking()
+            self.clip_high_values()
+            return
+        std = stitch(first_pass, "std")
+        del first_pass
+
+        reference_time_traces = []
+        for dataset, video_std in zip(datasets, std):
+            row, column = np.unravel_index(np.argmax(video_std), video_std.shape)
+            trace = np.asarray(dataset[:, rows[row], columns[column]], np.float64)
+            reference_time_traces.append((trace - np.mean(trace)).astype(self.dtype))
+
+        video_dot = stitch(
+            self._map_tiles(
+                tiles, executor, n_workers, "tile_second_pass", reference_time_traces
+            )
+        )
+        self.calibrate_video_images(
+            np.where(video_dot > 0, std, -std), calibration_slopes_video_indexed
+        )
+        del std, video_dot
+
+        self.combine_images()
+        self.apply_membrane_shape_masking()
+        self.clip_high_values()
+
+    @profiled_stage
+    def combine_images(self, fusion="best"):
         """
         Combine images.
 
             1. Flip the phase of some images so that all the images show the same global phase
             2. For each pixel take the value from the most sensitive video shot (according to calibration data)
+
+        Args:
+            fusion (str): How to merge the videos for each pixel:
+                - `"best"`: take the value from the video with the largest
+                  `|calibration_slopes_video_indexed|`
+                - `"weighted"`: average all the videos weighted by
+                  `|calibration_slopes_video_indexed|`
+
+        `self.best_video_index` is always set to the most sensitive video,
+        whatever the fusion mode.
         """
         if self.fully_calibrated_images is None:
             raise Exception("")
@@ -242,15 +1530,25 @@ class StdAnalysis:
             raise Exception("")
         if self.calibration_slopes_video_indexed is None:
             raise Exception("")
+        if fusion not in ("best", "weighted"):
+            raise ValueError(f"Unknown fusion mode: {fusion}")
+        key = self._cache_key(
+            "combine_images",
+            upstream=self._cache_keys.get("video_images"),
+            fusion=fusion,
+        )
+        cached = self._cache_load(key)
+        if cached is not None:
+            self.mode_image = cached["mode_image"]
+            self.best_video_index = cached["best_video_index"]
+            return
         absolute_slopes = np.abs(self.calibration_slopes_video_indexed)
-        to_flip = np.array(
-            [
-                np.vdot(
-                    self.phase_corrected_images[0, :, :],
-                    self.phase_corrected_images[i, :, :],
-                )
-                for i in trange(0, self.phase_corrected_images.shape[0])
-            ]
+        # Same as `np.vdot(phase_corrected_images[0], phase_corrected_images[i])` for each i
+        to_flip = np.einsum(
+            "vij,ij->v",
+            self.phase_corrected_images,
+            self.phase_corrected_images[0, :, :],
+            dtype=np.float64,
         )
         corrected_photos: np.ndarray = np.where(
             to_flip[:, None, None] > 0,
@@ -258,25 +1556,149 @@ class StdAnalysis:
             -self.fully_calibrated_images,  # pyright: ignore
         )
 
-        # Initialize empty images
-        self.mode_image = np.empty(corrected_photos.shape[1:])
-        self.best_video_index = np.empty(corrected_photos.shape[1:], dtype=np.uint64)
-        # For each pixel get the best video time trace
-        with np.nditer(
-            self.mode_image,
-            flags=["multi_index"],
-            op_flags=["writeonly"],  # pyright: ignore
-        ) as it:
-            for pixel in tqdm(it, total=self.mode_image.size):
-                best_video = np.argmax(
-                    absolute_slopes[:, it.multi_index[0], it.multi_index[1]]
-                )
-                pixel[...] = corrected_photos[  # pyright: ignore
-                    best_video, it.multi_index[0], it.multi_index[1]
-                ]
-                self.best_video_index[it.multi_index[0], it.multi_index[1]] = best_video
+        best_video = np.argmax(absolute_slopes, axis=0)
+        self.best_video_index = best_video.astype(np.uint64)
+        if fusion == "best":
+            # For each pixel get the value from the best video
+            self.mode_image = np.take_along_axis(
+                corrected_photos, best_video[None, :, :], axis=0
+            )[0]
+        else:
+            # `|slope| * std / slope` is the phase corrected image: summing it
+            # avoids `0 * inf` where a video has a zero slope
+            weighted = np.where(
+                to_flip[:, None, None] > 0,
+                self.phase_corrected_images,
+                -self.phase_corrected_images,
+            )
+            weighted[absolute_slopes == 0] = 0
+            self.mode_image = np.sum(weighted, axis=0) / np.sum(
+                absolute_slopes, axis=0
+            )
+        self._cache_store(
+            key,
+            "combine_images",
+            {"mode_image": self.mode_image, "best_video_index": self.best_video_index},
+        )
+
+    def compute_sensitivity(self):
+        """
+        Sets `self.sensitivity` to the standard deviation of each pixel
+        calibration curve, or to the fringe amplitude `hypot(a, b) / √2` if
+        only the fringe model was fitted (same as the standard deviation of
+        the fitted fringe over a large bias range)
+        """
+        if self.calibration_values is not None:
+            key = self._cache_key(
+                "sensitivity", upstream=self._cache_keys.get("smooth_calibration")
+            )
+            cached = self._cache_load(key)
+            if cached is not None:
+                self.sensitivity = cached["sensitivity"]
+                return
+            self.sensitivity = np.std(
+                self.calibration_values, axis=0, dtype=np.float64
+            ).astype(self.calibration_values.dtype, copy=False)
+            self._cache_store(key, "sensitivity", {"sensitivity": self.sensitivity})
+        elif self.fringe_parameters is not None:
+            self.sensitivity = np.hypot(*self.fringe_parameters[1:3]) / np.sqrt(2)
+        else:
+            raise Exception("")
 
-    def apply_membrane_shape_masking(self, threshold=1.0, sigma=100):
+    @staticmethod
+    def _interpolation_matrix(size, coarse_size, factor, offset=0):
+        """
+        Matrix linearly interpolating `coarse_size` block means (of `factor`
+        pixels) back on `size` pixels, pixel 0 being in block `offset`
+        """
+        position = offset + (np.arange(size) - (factor - 1) / 2) / factor
+        position = np.clip(position, 0, coarse_size - 1)
+        low = np.minimum(position.astype(int), coarse_size - 2)
+        fraction = position - low
+        matrix = np.zeros((size, coarse_size))
+        matrix[np.arange(size), low] = 1 - fraction
+        matrix[np.arange(size), low + 1] += fraction
+        return matrix
+
+    @staticmethod
+    def gaussian_background(image, sigma, method="exact"):
+        """
+        Gaussian filter of `image` (with `mode="reflect"` borders, as
+        `scipy.ndimage.gaussian_filter`).
+
+        Args:
+            image (np.ndarray): A 2D image
+            sigma (float): Standard deviation of the Gaussian kernel in pixels
+            method (str):
+                - `"exact"`: `scipy.ndimage.gaussian_filter`, its cost grows
+                  linearly with `sigma`.
+                - `"downsample"`: average blocks of `round(sigma / 10)`
+                  pixels, filter the small image (with the block width
+                  removed from `sigma`) and interpolate it back linearly.
+                - `"fft"`: multiply by the Gaussian transfer function in
+                  Fourier space, after reflecting `4 sigma` pixels on each
+                  border.
+                With sigma from 20 to 100, the error of both fast methods
+                stays below 1e-3 of the maximum of the exact background
+                (about 6e-4 for `"downsample"`, 1e-4 for `"fft"`) and less
+                than 2e-4 of the mask pixels flip. On a 1080x1440 image at
+                `sigma=100`, `"downsample"` is about 20 times faster than
+                `"exact"` and `"fft"` about 5 times.
+
+        Returns:
+            np.ndarray: The filtered image
+        """
+        if method == "exact":
+            return scipy.ndimage.gaussian_filter(image, sigma=sigma)
+        if method == "downsample":
+            factor = max(1, int(round(sigma / 10)))
+            if factor == 1:
+                return scipy.ndimage.gaussian_filter(image, sigma=sigma)
+            height, width = image.shape
+            # reflect a margin wide enough for the borders of the coarse
+            # filter to be those of the image
+            margin = factor * int(np.ceil(4 * sigma / factor))
+            padded = np.pad(
+                image,
+                (
+                    (margin, margin + -height % factor),
+                    (margin, margin + -width % factor),
+                ),
+                "symmetric",
+            )
+            coarse = padded.reshape(
+                padded.shape[0] // factor, factor, padded.shape[1] // factor, factor
+            ).mean(axis=(1, 3))
+            # a block mean is a box filter of variance (factor**2 - 1) / 12
+            coarse_sigma = max(sigma**2 - (factor**2 - 1) / 12, 0) ** 0.5 / factor
+            coarse = scipy.ndimage.gaussian_filter(coarse, sigma=coarse_sigma)
+            offset = margin // factor
+            rows = StdAnalysis._interpolation_matrix(
+                height, coarse.shape[0], factor, offset
+            )
+            columns = StdAnalysis._interpolation_matrix(
+                width, coarse.shape[1], factor, offset
+            )
+            return (rows @ coarse @ columns.T).astype(image.dtype, copy=False)
+        if method == "fft":
+            pad = int(4 * sigma + 0.5)
+            # "symmetric" numpy padding is the "reflect" mode of scipy.ndimage
+            padded = np.pad(image, pad, "symmetric")
+            shape = [scipy.fft.next_fast_len(n, real=True) for n in padded.shape]
+            spectrum = scipy.fft.rfft2(padded, shape)
+            frequencies = (
+                scipy.fft.fftfreq(shape[0])[:, None] ** 2
+                + scipy.fft.rfftfreq(shape[1])[None, :] ** 2
+            )
+            spectrum *= np.exp(-2 * np.pi**2 * sigma**2 * frequencies)
+            filtered = scipy.fft.irfft2(spectrum, shape)
+            return filtered[
+                pad : pad + image.shape[0], pad : pad + image.shape[1]
+            ].astype(image.dtype, copy=False)
+        raise ValueError(f"Unknown background method: {method}")
+
+    @profiled_stage
+    def apply_membrane_shape_masking(self, threshold=1.0, sigma=100, method="exact"):
         """
         Compute the membrane shape in `self.mask`.
 
@@ -286,14 +1708,34 @@ class StdAnalysis:
             - For each pixel:
                 1. Compute the average sensitivity in the nearby area (typical size of `sigma` pixels)
                 2. Pick this pixel as a pixel from the membrane if the pixel sensitivity is greater than 
+                   `threshold` times this average
+
+        The sensitivity and the backgrounds (per `sigma` and `method`) are
+        kept, so sweeping `threshold` or going back to a previous `sigma`
+        only costs a comparison.
+
+        Args:
+            threshold (float): Relative sensitivity threshold
+            sigma (float): Size of the averaging area in sensor pixels
+                (divided by `self.binning`)
+            method (str): How the average is computed (see
+                `StdAnalysis.gaussian_background`). Use `"downsample"` for
+                interactive `sigma` sweeps.
         """
-        if self.calibration_values is None:
-            raise Exception("")
-        sensitivity = np.std(self.calibration_values, axis=0)
-        smoothed = scipy.ndimage.gaussian_filter(sensitivity, sigma=sigma)
-        self.mask = sensitivity > (threshold * smoothed)
+        if self.sensitivity is None:
+            self.compute_sensitivity()
+        if self._backgrounds_source is not self.sensitivity:
+            self._backgrounds = {}
+            self._backgrounds_source = self.sensitivity
+        if (sigma, method) not in self._backgrounds:
+            self._backgrounds[sigma, method] = self.gaussian_background(
+                self.sensitivity, sigma / self.binning, method
+            )
+        smoothed = self._backgrounds[sigma, method]
+        self.mask = self.sensitivity > (threshold * smoothed)
         self.masked_image = self.mode_image * self.mask
 
+    @profiled_stage
     def clip_high_values(self, percentile=99.0):
         if self.masked_image is None:
             raise Exception("")
@@ -307,3 +1749,37 @@ class StdAnalysis:
         self.combine_images()
         self.apply_membrane_shape_masking()
         self.clip_high_values()
+
+    def preview(self, binning=4, frame_step=1):
+        """
+        Quick look at the result: run `StdAnalysis.compute_all` on images
+        binned by `binning x binning` pixels and on one video frame every
+        `frame_step`, with the same options as this analysis.
+
+        Args:
+            binning (int): Binning factor (e.g. 2, 4 or 8)
+            frame_step (int): Frame decimation of the videos
+
+        Returns:
+            np.ndarray: The low resolution `clipped_image`
+        """
+        self.file_open_or_fail()
+        roi = tuple(
+            slice(
+                None if s.start is None else s.start // binning,
+                None if s.stop is None else s.stop // binning,
+                s.step,
+            )
+            for s in self.roi
+        )
+        options = dict(
+            self._worker_options(),
+            roi=roi,
+            n_workers=self.n_workers,
+            cache=self.cache,
+            binning=self.binning * binning,
+            frame_step=self.frame_step * frame_step,
+        )
+        preview = type(self)(self._source, **options)
+        preview.compute_all()
+        return preview.clipped_image
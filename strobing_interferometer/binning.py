@@ -0,0 +1,154 @@
+import numpy as np
+
+
+class BinnedGroup:
+    """
+    Read-only view of a `h5py.File` (or group) where every image dataset is
+    replaced by a `BinnedDataset`. Frames are only decimated in the
+    `stroboscopic` videos (the first axis of the calibration datasets is the
+    bias).
+    """
+
+    def __init__(self, group, binning=1, frame_step=1):
+        self._group = group
+        self.binning = binning
+        self.frame_step = frame_step
+
+    def __getitem__(self, name):
+        item = self._group[name]
+        if hasattr(item, "keys"):
+            return BinnedGroup(item, self.binning, self.frame_step)
+        if len(item.shape) < 2:
+            return item
+        strobed = item.name.startswith("/stroboscopic/")
+        return BinnedDataset(item, self.binning, self.frame_step if strobed else 1)
+
+    def __getattr__(self, name):
+        return getattr(self._group, name)
+
+    def __bool__(self):
+        return bool(self._group)
+
+    def __contains__(self, name):
+        return name in self._group
+
+    def __iter__(self):
+        return iter(self._group)
+
+    def __len__(self):
+        return len(self._group)
+
+
+class BinnedDataset:
+    """
+    Read-only view of an image dataset (images on the last two axes) binned
+    by `binning x binning` pixels and, on the first axis, keeping one frame
+    every `frame_step`.
+
+    Only the hyperslab of the full resolution dataset matching a selection is
+    read, then averaged by blocks. Rows and columns that don't fill a whole
+    block are dropped. The `fps` attribute is divided by `frame_step`.
+    """
+
+    def __init__(self, dataset, binning=1, frame_step=1):
+        self._dataset = dataset
+        self.binning = binning
+        self.frame_step = frame_step
+
+    @property
+    def shape(self):
+        shape = list(self._dataset.shape)
+        shape[0] = len(range(0, shape[0], self.frame_step))
+        shape[-2] //= self.binning
+        shape[-1] //= self.binning
+        return tuple(shape)
+
+    @property
+    def chunks(self):
+        chunks = self._dataset.chunks
+        if chunks is None:
+            return None
+        chunks = list(chunks)
+        chunks[0] = max(1, chunks[0] // self.frame_step)
+        chunks[-2] = max(1, chunks[-2] // self.binning)
+        chunks[-1] = max(1, chunks[-1] // self.binning)
+        return tuple(chunks)
+
+    @property
+    def ndim(self):
+        return len(self._dataset.shape)
+
+    @property
+    def dtype(self):
+        if self.binning == 1:
+            return self._dataset.dtype
+        return np.dtype(np.float64)
+
+    @property
+    def attrs(self):
+        attrs = dict(self._dataset.attrs)
+        if "fps" in attrs:
+            attrs["fps"] = attrs["fps"] / self.frame_step
+        return attrs
+
+    def __getattr__(self, name):
+        return getattr(self._dataset, name)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _selection(self, selection):
+        if not isinstance(selection, tuple):
+            selection = (selection,)
+        if Ellipsis in selection:
+            index = selection.index(Ellipsis)
+            fill = (slice(None),) * (self.ndim - len(selection) + 1)
+            selection = selection[:index] + fill + selection[index + 1 :]
+        return selection + (slice(None),) * (self.ndim - len(selection))
+
+    def __getitem__(self, selection):
+        selection = self._selection(selection)
+        shape = self.shape
+        source = list(selection)
+        if self.frame_step != 1:
+            first = selection[0]
+            if isinstance(first, slice):
+                start, stop, step = first.indices(shape[0])
+                if step < 0:
+                    raise ValueError("Can't read frames backwards")
+                source[0] = slice(
+                    start * self.frame_step,
+                    stop * self.frame_step,
+                    step * self.frame_step,
+                )
+            else:
+                source[0] = range(shape[0])[first] * self.frame_step
+        squeeze = []
+        for axis in (-2, -1):
+            index = selection[axis]
+            if isinstance(index, slice):
+                start, stop, step = index.indices(shape[axis])
+                if step != 1:
+                    raise ValueError("Binned datasets only support contiguous slices")
+                stop = max(start, stop)
+            else:
+                start = range(shape[axis])[index]
+                stop = start + 1
+                squeeze.append(axis)
+            source[axis] = slice(start * self.binning, stop * self.binning)
+        data = self._dataset[tuple(source)]
+        if self.binning != 1:
+            rows, columns = data.shape[-2:]
+            data = data.reshape(
+                *data.shape[:-2],
+                rows // self.binning,
+                self.binning,
+                columns // self.binning,
+                self.binning,
+            ).mean(axis=(-3, -1))
+        if squeeze:
+            data = np.squeeze(data, axis=tuple(squeeze))
+        return data
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[()], dtype=dtype)
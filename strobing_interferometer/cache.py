@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+
+class StageCache:
+    """
+    On-disk cache of the intermediate results of `StdAnalysis`.
+
+    Each entry is a small hdf5 file stored in `directory` and named after the
+    hash of its key. Keys are built from the identity of the acquisition file
+    (path, size and modification time) and the parameters of the stage (and
+    the keys of the stages it depends on), so a stage is only recomputed if
+    something it depends on changed.
+
+    When the cache grows over `max_bytes`, the least recently used entries
+    are deleted.
+    """
+
+    suffix = ".h5"
+
+    def __init__(self, directory, max_bytes=None):
+        """
+        Args:
+            directory (Path | str): Directory holding the cache entries
+                (created if needed)
+            max_bytes (int): Maximum size of the cache on disk. No limit if
+                `None`.
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def for_file(cls, filename, **kwargs):
+        """
+        Cache stored in a sidecar directory next to `filename` (e.g.
+        `acquisition.h5.cache/` for `acquisition.h5`)
+        """
+        return cls(Path(str(filename) + ".cache"), **kwargs)
+
+    @staticmethod
+    def source_identity(filename):
+        """
+        Identity of an acquisition file: it changes whenever the file is
+        modified.
+        """
+        stat = os.stat(filename)
+        return {
+            "path": os.path.abspath(filename),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    @staticmethod
+    def _jsonable(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, slice):
+            return [value.start, value.stop, value.step]
+        if isinstance(value, (tuple, set)):
+            return list(value)
+        if isinstance(value, np.dtype) or isinstance(value, type):
+            return np.dtype(value).str
+        raise TypeError(f"Can't use {value!r} in a cache key")
+
+    def key(self, stage, **params):
+        """
+        Build the key of a stage from its parameters.
+
+        Args:
+            stage (str): Name of the stage
+            **params: Anything that changes the output of the stage (numpy
+                arrays, slices and scalars are supported)
+        """
+        description = json.dumps(
+            {"stage": stage, "params": params}, sort_keys=True, default=self._jsonable
+        )
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key):
+        return self.directory / (key + self.suffix)
+
+    def load(self, key):
+        """
+        Return the arrays stored under `key` (as a dict) or `None` if the key
+        is not in the cache.
+        """
+        path = self._path(key)
+        try:
+            with h5py.File(path, "r") as f:
+                arrays = {name: f[name][()] for name in f.keys()}
+        except (OSError, KeyError):
+            return None
+        os.utime(path)  # mark as recently used
+        return arrays
+
+    def store(self, key, stage, arrays):
+        """
+        Store the arrays (a dict of `np.ndarray`) under `key`, then evict old
+        entries if the cache is too big.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix(".tmp")
+        with h5py.File(tmp_path, "w") as f:
+            f.attrs["stage"] = stage
+            f.attrs["created"] = time.time()
+            for name, array in arrays.items():
+                f.create_dataset(name, data=array)
+        os.replace(tmp_path, path)  # atomic, a reader never sees half an entry
+        self.evict(keep=key)
+
+    def entries(self):
+        """
+        Return the cache entries as a list of `(path, size, last use)`
+        """
+        if not self.directory.is_dir():
+            return []
+        result = []
+        for path in self.directory.glob("*" + self.suffix):
+            stat = path.stat()
+            result.append((path, stat.st_size, stat.st_mtime))
+        return result
+
+    def size(self):
+        """
+        Total size of the cache on disk in bytes
+        """
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """
+        Delete the least recently used entries until the cache fits in
+        `self.max_bytes`.
+
+        Args:
+            keep (str): A key that must not be deleted
+        """
+        if self.max_bytes is None:
+            return
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == self._path(keep):
+                continue
+            path.unlink()
+            total -= size
+
+    def clear(self):
+        """
+        Delete all the cache entries
+        """
+        for path, _, _ in self.entries():
+            path.unlink()
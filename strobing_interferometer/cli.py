@@ -0,0 +1,217 @@
+"""
+Batch analysis of acquisition files (`strobe-analyze` command).
+
+Every acquisition is analysed with `StdAnalysis.compute_all_tiled` and its
+`mode_image`, `mask` and `clipped_image` are written to a results file next
+to the acquisition (`<name>.results.h5`, or in `--output-dir`). Files whose
+results are up to date are skipped.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from .analysis import StdAnalysis, available_memory
+from .cache import StageCache
+from .storage import open_acquisition
+
+RESULTS_SUFFIX = ".results.h5"
+RESULTS_DATASETS = ("mode_image", "mask", "clipped_image")
+
+
+def parse_size(size):
+    """
+    Parse a size in bytes with an optional K, M, G or T suffix (e.g. `16G`)
+    """
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def find_acquisitions(patterns):
+    """
+    List the acquisition files matching the given directories or glob
+    patterns (results files are ignored)
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(Path(pattern).glob("*.h5"))
+        else:
+            matches = sorted(Path(match) for match in glob.glob(pattern))
+        files.extend(
+            path
+            for path in matches
+            if path.is_file() and not path.name.endswith(RESULTS_SUFFIX)
+        )
+    return list(dict.fromkeys(files))  # remove duplicates, keep the order
+
+
+def results_path(acquisition, output_dir=None):
+    """
+    Path of the results file of an acquisition
+    """
+    directory = acquisition.parent if output_dir is None else Path(output_dir)
+    return directory / (acquisition.stem + RESULTS_SUFFIX)
+
+
+def is_up_to_date(acquisition, results, options):
+    """
+    Whether `results` was computed from the current version of
+    `acquisition` with the same analysis options
+    """
+    if not results.exists():
+        return False
+    identity = StageCache.source_identity(acquisition)
+    try:
+        with h5py.File(results, "r") as f:
+            return (
+                f.attrs.get("source size") == identity["size"]
+                and f.attrs.get("source mtime_ns") == identity["mtime_ns"]
+                and f.attrs.get("options") == repr(sorted(options.items()))
+            )
+    except OSError:
+        return False
+
+
+def analyze_file(acquisition, results, memory_limit, options, profile=False):
+    """
+    Analyse one acquisition and write its results file.
+
+    Args:
+        profile (bool): Store the stage profile (see
+            `strobing_interferometer.profiling.StageProfiler`) as JSON in the
+            `profile` attribute of the results file
+
+    Returns:
+        float: The analysis duration in seconds
+    """
+    start = time.perf_counter()
+    identity = StageCache.source_identity(acquisition)
+    with open_acquisition(acquisition) as f:
+        analysis = StdAnalysis(
+            f, memory_limit=memory_limit, profile=profile, **options
+        )
+        analysis.compute_all_tiled()
+    duration = time.perf_counter() - start
+
+    results.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = results.with_suffix(".tmp")
+    with h5py.File(tmp_path, "w") as f:
+        for name in RESULTS_DATASETS:
+            f.create_dataset(name, data=getattr(analysis, name))
+        f.attrs["source"] = str(acquisition)
+        f.attrs["source size"] = identity["size"]
+        f.attrs["source mtime_ns"] = identity["mtime_ns"]
+        f.attrs["options"] = repr(sorted(options.items()))
+        f.attrs["analysis time"] = duration
+        if profile:
+            analysis.profiler.store(f.attrs)
+    os.replace(tmp_path, results)  # never leave a half written results file
+    return duration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="strobe-analyze",
+        description="Analyse a batch of stroboscopic acquisitions.",
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="Acquisition files, directories or glob patterns"
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of acquisitions analysed in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "-m",
+        "--memory-limit",
+        type=parse_size,
+        default=None,
+        help="Total memory used by all the workers, e.g. 12G "
+        "(default: 80%% of the available memory)",
+    )
+    parser.add_argument(
+        "-o", "--output-dir", default=None, help="Where to write the results files"
+    )
+    parser.add_argument(
+        "--engine", choices=("std", "lockin"), default="std", help="Video engine"
+    )
+    parser.add_argument(
+        "--float32", action="store_true", help="Compute in single precision"
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Store the time and memory used by each stage in the results files",
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="Analyse up to date files again"
+    )
+    args = parser.parse_args(argv)
+
+    options = {"engine": args.engine}
+    if args.float32:
+        options["dtype"] = np.float32
+
+    acquisitions = find_acquisitions(args.paths)
+    if not acquisitions:
+        parser.error("no acquisition file found")
+    todo = []
+    for acquisition in acquisitions:
+        results = results_path(acquisition, args.output_dir)
+        if not args.force and is_up_to_date(acquisition, results, options):
+            print(f"{acquisition}: up to date")
+        else:
+            todo.append((acquisition, results))
+    if not todo:
+        return 0
+
+    memory_limit = args.memory_limit
+    if memory_limit is None:
+        free = available_memory()
+        if free is None:
+            parser.error("can't guess the available memory, use --memory-limit")
+        memory_limit = int(0.8 * free)
+    n_workers = max(1, min(args.workers, len(todo)))
+    per_file = memory_limit // n_workers
+    print(
+        f"Analysing {len(todo)} file(s) with {n_workers} worker(s), "
+        f"{per_file / 2**30:.1f} GiB each"
+    )
+
+    failures = 0
+    begin = time.perf_counter()
+    with ProcessPoolExecutor(n_workers) as executor:
+        futures = {
+            executor.submit(
+                analyze_file, acquisition, results, per_file, options, args.profile
+            ): (acquisition, results)
+            for acquisition, results in todo
+        }
+        for future in as_completed(futures):
+            acquisition, results = futures[future]
+            try:
+                duration = future.result()
+            except Exception as err:  # keep going with the other files
+                failures += 1
+                print(f"{acquisition}: failed ({err!r})", file=sys.stderr)
+            else:
+                print(f"{acquisition}: {duration:.1f} s -> {results}")
+    print(f"Done in {time.perf_counter() - begin:.1f} s, {failures} failure(s)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
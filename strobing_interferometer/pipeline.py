@@ -0,0 +1,414 @@
+"""
+Producer/consumer pipeline between the camera and the file.
+
+A reader thread polls the camera (blocking up to
+`camera.image_poll_timeout_ms`, instead of spinning) and copies each frame in
+a preallocated ring buffer. A writer thread drains the ring buffer by batches
+into a sink (an hdf5 dataset, running statistics...). Disk latency is then
+absorbed by the ring buffer instead of stalling the camera.
+
+Nothing here depends on the camera SDK: a camera is anything with a
+`get_pending_frame_or_null()` method returning `None` or an object with an
+`image_buffer` and a `frame_count`.
+"""
+import threading
+import time
+
+import numpy as np
+
+FRAME_LOG_DTYPE = np.dtype(
+    [
+        ("frame_count", np.int64),
+        ("timestamp", np.float64),
+        ("poll_wait", np.float64),
+        ("polls", np.int32),
+    ]
+)
+"""
+One row per received frame: camera frame number, host time when it was
+received (`time.time()`), time spent polling the camera for it and number
+of polls
+"""
+
+
+class FrameRingBuffer:
+    """
+    Preallocated ring buffer of frames for one producer and one consumer
+    thread.
+
+    `put` blocks while the buffer is full (backpressure) and drops the frame
+    if no slot is freed within its timeout. The consumer reads contiguous
+    batches of frames in place with `peek` and frees them with `release`.
+    """
+
+    def __init__(self, capacity, frame_shape, dtype=np.uint16):
+        """
+        Args:
+            capacity (int): Number of frames in the buffer
+            frame_shape (tuple): Shape of a frame
+            dtype (np.dtype): Type of the frames
+        """
+        self.frames = np.empty((capacity, *frame_shape), dtype=dtype)
+        self.frame_counts = np.zeros(capacity, dtype=np.int64)
+        self.timestamps = np.zeros(capacity)
+        self.capacity = capacity
+        self._head = 0  # next slot to write
+        self._tail = 0  # next slot to read
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self.dropped = 0
+        "Frames dropped because the buffer stayed full"
+        self.high_water = 0
+        "Maximum number of frames waiting in the buffer"
+        self.put_wait = 0.0
+        "Total time the producer waited for a free slot (s)"
+
+    def __len__(self):
+        return self._size
+
+    def put(self, image, frame_count=0, timeout=None):
+        """
+        Copy `image` in the next free slot.
+
+        Args:
+            image (np.ndarray): The frame
+            frame_count (int): Frame number given by the camera
+            timeout (float): Maximum time to wait for a free slot (forever if
+                `None`)
+
+        Returns:
+            bool: `False` if the frame was dropped
+        """
+        with self._condition:
+            if self._size == self.capacity:
+                start = time.perf_counter()
+                self._condition.wait_for(
+                    lambda: self._size < self.capacity, timeout=timeout
+                )
+                self.put_wait += time.perf_counter() - start
+                if self._size == self.capacity:
+                    self.dropped += 1
+                    return False
+            slot = self._head
+        # Only the producer writes this slot until it is published below
+        self.frames[slot] = np.asarray(image).reshape(self.frames.shape[1:])
+        self.frame_counts[slot] = frame_count
+        self.timestamps[slot] = time.time()
+        with self._condition:
+            self._head = (slot + 1) % self.capacity
+            self._size += 1
+            self.high_water = max(self.high_water, self._size)
+            self._condition.notify_all()
+        return True
+
+    def peek(self, max_frames=None, timeout=None, min_frames=1):
+        """
+        Wait for frames and return the oldest ones without copying them.
+
+        The returned batch is contiguous in the buffer, so it may be shorter
+        than the number of waiting frames at the end of the ring. The slots
+        are not reused until `FrameRingBuffer.release` is called.
+
+        Args:
+            max_frames (int): Maximum length of the batch
+            timeout (float): Maximum time to wait for a frame
+            min_frames (int): Wait until this number of frames is available
+                (or the buffer is closed)
+
+        Returns:
+            tuple: `(start, frames, frame_counts)` where `start` is the slot
+            of the first frame. `frames` is empty if the timeout expired or
+            if the buffer was closed and is empty.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._size >= min_frames or self._closed, timeout
+            )
+            count = min(self._size, self.capacity - self._tail)
+            if max_frames is not None:
+                count = min(count, max_frames)
+            start = self._tail
+        stop = start + count
+        return start, self.frames[start:stop], self.frame_counts[start:stop]
+
+    def release(self, count):
+        """
+        Free the `count` oldest frames (after `FrameRingBuffer.peek`)
+        """
+        with self._condition:
+            if count > self._size:
+                raise ValueError("Can't release frames that were not written")
+            self._tail = (self._tail + count) % self.capacity
+            self._size -= count
+            self._condition.notify_all()
+
+    def close(self):
+        """
+        Tell the consumer that no more frames will come
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def reset(self):
+        """
+        Empty and reopen the buffer and reset its statistics
+        """
+        with self._condition:
+            self._head = self._tail = self._size = 0
+            self._closed = False
+            self.dropped = 0
+            self.high_water = 0
+            self.put_wait = 0.0
+
+
+class FramePipeline:
+    """
+    Acquire a given number of frames with a reader and a writer thread
+    sharing a `FrameRingBuffer`.
+    """
+
+    def __init__(
+        self,
+        frame_shape,
+        capacity=64,
+        batch=32,
+        put_timeout=1.0,
+        frame_timeout=10.0,
+        dtype=np.uint16,
+    ):
+        """
+        Args:
+            frame_shape (tuple): Shape of the camera frames
+            capacity (int): Frames in the ring buffer
+            batch (int): Number of frames given to the sink at once (only the
+                last batch may be shorter). The capacity is rounded up to a
+                multiple of `batch` of at least two batches.
+            put_timeout (float): Time the reader waits for a free slot before
+                dropping a frame
+            frame_timeout (float): Time without any frame from the camera
+                before giving up
+        """
+        batch = min(batch, capacity)
+        # at least two batches: the reader fills one while the sink drains the
+        # other
+        capacity = max(-(-capacity // batch), 2) * batch
+        self.ring = FrameRingBuffer(capacity, frame_shape, dtype)
+        self.batch = batch
+        self.put_timeout = put_timeout
+        self.frame_timeout = frame_timeout
+        self.stats = {}
+        self.frame_log = np.zeros(0, dtype=FRAME_LOG_DTYPE)
+        "`FRAME_LOG_DTYPE` row of each received frame (filled live)"
+        self.write_log = []
+        "`(first frame, frames, seconds)` of each batch given to the sink"
+        self.events = []
+        "Dropped frames: dicts with the `kind` of drop, `index`, `frame_count`"
+        self._threads = []
+        self._received = 0
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    @property
+    def received(self):
+        """
+        Number of frames received so far
+        """
+        return self.stats.get("received", self._received)
+
+    def _read(self, camera, n_frames, stop, errors):
+        ring = self.ring
+        received = 0
+        camera_dropped = 0
+        polls = 0
+        previous = None
+        log = self.frame_log
+        last_frame = time.perf_counter()
+        frame_polls = 0
+        try:
+            # frames lost by the camera count: they will never come
+            while received + camera_dropped < n_frames and not stop.is_set():
+                frame = camera.get_pending_frame_or_null()  # blocking poll
+                polls += 1
+                frame_polls += 1
+                now = time.perf_counter()
+                if frame is None:
+                    if now - last_frame > self.frame_timeout:
+                        raise TimeoutError(
+                            f"No frame from the camera for {self.frame_timeout} s "
+                            f"({received}/{n_frames} frames received)"
+                        )
+                    continue
+                log[received] = (
+                    frame.frame_count,
+                    time.time(),
+                    now - last_frame,
+                    frame_polls,
+                )
+                last_frame = now
+                frame_polls = 0
+                if previous is not None and frame.frame_count - previous > 1:
+                    missing = frame.frame_count - previous - 1
+                    camera_dropped += missing
+                    self.events.append(
+                        dict(
+                            kind="camera",
+                            index=received,
+                            frame_count=frame.frame_count,
+                            missing=missing,
+                        )
+                    )
+                previous = frame.frame_count
+                put = ring.put(frame.image_buffer, frame.frame_count, self.put_timeout)
+                if not put:
+                    self.events.append(
+                        dict(
+                            kind="ring buffer full",
+                            index=received,
+                            frame_count=frame.frame_count,
+                            missing=1,
+                        )
+                    )
+                received += 1
+                self._received = received
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+        finally:
+            self.stats.update(
+                received=received, camera_dropped=camera_dropped, polls=polls
+            )
+            ring.close()
+
+    def _write(self, sink, stop, errors, finish=None):
+        ring = self.ring
+        written = 0
+        write_time = 0.0
+        try:
+            while True:
+                start, frames, frame_counts = ring.peek(
+                    self.batch, min_frames=self.batch
+                )
+                if not len(frames):
+                    break  # closed and drained
+                begin = time.perf_counter()
+                sink(written, frames, frame_counts)
+                duration = time.perf_counter() - begin
+                write_time += duration
+                self.write_log.append((written, len(frames), duration))
+                written += len(frames)
+                ring.release(len(frames))
+            if finish is not None:
+                begin = time.perf_counter()
+                finish()
+                write_time += time.perf_counter() - begin
+        except BaseException as error:
+            errors.append(error)
+            stop.set()
+            # keep draining so the reader is never blocked on a full buffer
+            while True:
+                _, frames, _ = ring.peek(self.batch)
+                if not len(frames):
+                    break
+                ring.release(len(frames))
+        finally:
+            self.stats.update(written=written, write_time=write_time)
+
+    def start(self, camera, n_frames, sink, finish=None):
+        """
+        Start reading `n_frames` from `camera` and giving them to `sink` in
+        the background.
+
+        The camera must already be armed and triggered. Use
+        `FramePipeline.wait_frames` to know when the camera is done and
+        `FramePipeline.join` to wait for the sink.
+
+        Args:
+            camera: The camera
+            n_frames (int): Number of frames to acquire
+            sink (callable): Called from the writer thread as
+                `sink(index, frames, frame_counts)` where `index` is the
+                number of frames already written. `frames` is a view of the
+                ring buffer only valid during the call.
+            finish (callable): Called from the writer thread after the last
+                batch (e.g. to flush the file)
+        """
+        if self._threads and any(thread.is_alive() for thread in self._threads):
+            raise RuntimeError("The previous acquisition is still running")
+        self.ring.reset()
+        self.stats = {}
+        self.frame_log = np.zeros(n_frames, dtype=FRAME_LOG_DTYPE)
+        self.write_log = []
+        self.events = []
+        self._received = 0
+        self._stop = threading.Event()
+        self._errors = []
+        self._start_time = time.perf_counter()
+        self._threads = [
+            threading.Thread(
+                target=self._read,
+                args=(camera, n_frames, self._stop, self._errors),
+                daemon=True,
+            ),
+            threading.Thread(
+                target=self._write,
+                args=(sink, self._stop, self._errors, finish),
+                daemon=True,
+            ),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def wait_frames(self):
+        """
+        Wait until all the frames were read from the camera (they may still
+        be waiting in the ring buffer). Errors are raised by
+        `FramePipeline.join`.
+
+        Returns:
+            float: Time spent reading the frames (s)
+        """
+        self._threads[0].join()
+        return time.perf_counter() - self._start_time
+
+    def join(self):
+        """
+        Wait for the end of the acquisition started by `FramePipeline.start`
+
+        Returns:
+            dict: Statistics of the acquisition (frames received, written,
+            dropped by the ring buffer and by the camera, time spent in the
+            sink and its throughput...). The details per frame and per
+            batch are in `frame_log`, `write_log` and `events`.
+        """
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.frame_log = self.frame_log[: self.stats["received"]]
+        write_time = self.stats["write_time"]
+        self.stats.update(
+            duration=time.perf_counter() - self._start_time,
+            dropped=self.ring.dropped,
+            high_water=self.ring.high_water,
+            put_wait=self.ring.put_wait,
+            # MiB/s of frames given to the sink
+            write_throughput=self.stats["written"]
+            * self.ring.frames[0].nbytes
+            / 2**20
+            / write_time
+            if write_time
+            else 0.0,
+        )
+        if self._errors:
+            raise self._errors[0]
+        return self.stats
+
+    def run(self, camera, n_frames, sink, finish=None):
+        """
+        Same as `FramePipeline.start` followed by `FramePipeline.join`
+        """
+        self.start(camera, n_frames, sink, finish)
+        return self.join()
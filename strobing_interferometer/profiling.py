@@ -0,0 +1,252 @@
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def max_rss():
+    """
+    Peak resident memory of the process in bytes (`None` if unknown)
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on linux
+
+
+class StageProfiler:
+    """
+    Records, for each stage of an analysis, the wall time, CPU time,
+    `tracemalloc` peak, peak resident memory, bytes read from each hdf5
+    dataset and the size of the arrays the stage produced.
+
+    The hdf5 reads are counted by wrapping the file handle with
+    `StageProfiler.wrap`. Only the reads and the CPU time of the current
+    process are recorded: work done in worker processes is only visible in
+    the wall time.
+
+    Stages can be nested (e.g. `combine_images` in `compute_all_tiled`).
+    Reads are then counted in every running stage, but the `tracemalloc`
+    peak is only measured for the outermost one (`None` for the others, as
+    well as when `tracemalloc` was already started by someone else).
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.bytes_read = {}
+        self._running = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, owner=None):
+        """
+        Context manager recording a stage.
+
+        Args:
+            name (str): Name of the stage
+            owner (object): Object whose new `np.ndarray` attributes are
+                recorded as the outputs of the stage
+        """
+        record = {"stage": name, "bytes_read": {}, "outputs": {}}
+        before = self._array_ids(owner)
+        trace = not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+        self._running.append(record)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_time"] = time.perf_counter() - wall
+            record["cpu_time"] = time.process_time() - cpu
+            record["tracemalloc_peak"] = None
+            if trace:
+                record["tracemalloc_peak"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            record["max_rss"] = max_rss()
+            for attribute, array in self._arrays(owner).items():
+                if before.get(attribute) != id(array):
+                    record["outputs"][attribute] = {
+                        "shape": list(array.shape),
+                        "dtype": array.dtype.str,
+                        "nbytes": array.nbytes,
+                    }
+            self._running.remove(record)
+            self.stages.append(record)
+
+    @staticmethod
+    def _arrays(owner):
+        if owner is None:
+            return {}
+        return {
+            attribute: value
+            for attribute, value in vars(owner).items()
+            if isinstance(value, np.ndarray)
+        }
+
+    def _array_ids(self, owner):
+        return {attribute: id(array) for attribute, array in self._arrays(owner).items()}
+
+    def count_read(self, dataset, nbytes):
+        """
+        Record that `nbytes` bytes were read from `dataset` (its hdf5 path)
+        """
+        with self._lock:
+            for counts in [self.bytes_read] + [r["bytes_read"] for r in self._running]:
+                counts[dataset] = counts.get(dataset, 0) + nbytes
+
+    def wrap(self, file):
+        """
+        Wrap a `h5py.File` (or group) so that the dataset reads are counted
+        """
+        return _ProfiledGroup(file, self)
+
+    def report(self):
+        """
+        The profile as a dict: the `stages` records (in the order they
+        finished) and the total `bytes_read` per dataset
+        """
+        return {"stages": self.stages, "bytes_read": dict(self.bytes_read)}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.report(), **kwargs)
+
+    def store(self, attrs, name="profile"):
+        """
+        Store the report as JSON in the hdf5 attributes `attrs`
+        """
+        attrs[name] = self.to_json()
+
+
+class PhaseTimer:
+    """
+    Time budget of an acquisition: total wall time spent in each phase (bias
+    ramp, settling, recording, waiting for the file...).
+
+    Phases may overlap work done in other threads (e.g. saving the previous
+    video during the ramp): only the time of the thread using the timer is
+    counted, so the fractions show where this thread waits.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+        self.log = []
+        "`(phase, start, duration)` of each phase, start since the creation"
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager adding its duration to the phase `name`
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.log.append((name, start - self._start, duration))
+            self.add(name, duration)
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def report(self):
+        """
+        The budget as a dict: the `total` wall time since the creation of the
+        timer and, for each phase, its `time`, `count` and `fraction` of the
+        total
+        """
+        total = time.perf_counter() - self._start
+        return {
+            "total": total,
+            "phases": {
+                name: {
+                    "time": duration,
+                    "count": self.counts[name],
+                    "fraction": duration / total if total else 0.0,
+                }
+                for name, duration in self.durations.items()
+            },
+        }
+
+    def summary(self):
+        """
+        The budget as a printable table
+        """
+        report = self.report()
+        lines = [f"{'phase':<12}{'time (s)':>10}{'count':>7}{'share':>8}"]
+        for name, phase in report["phases"].items():
+            lines.append(
+                f"{name:<12}{phase['time']:>10.2f}{phase['count']:>7}"
+                f"{phase['fraction']:>8.1%}"
+            )
+        lines.append(f"{'total':<12}{report['total']:>10.2f}")
+        return "\n".join(lines)
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.report(), **kwargs)
+
+
+class _ProfiledGroup:
+    """
+    Proxy of a `h5py.Group` returning profiled groups and datasets
+    """
+
+    def __init__(self, group, profiler):
+        self._group = group
+        self._profiler = profiler
+
+    def __getitem__(self, name):
+        item = self._group[name]
+        if hasattr(item, "keys"):
+            return _ProfiledGroup(item, self._profiler)
+        return _ProfiledDataset(item, self._profiler)
+
+    def __getattr__(self, name):
+        return getattr(self._group, name)
+
+    def __bool__(self):
+        return bool(self._group)
+
+    def __contains__(self, name):
+        return name in self._group
+
+    def __iter__(self):
+        return iter(self._group)
+
+    def __len__(self):
+        return len(self._group)
+
+
+class _ProfiledDataset:
+    """
+    Proxy of a `h5py.Dataset` counting the bytes read
+    """
+
+    def __init__(self, dataset, profiler):
+        self._dataset = dataset
+        self._profiler = profiler
+
+    def __getitem__(self, selection):
+        data = self._dataset[selection]
+        self._profiler.count_read(self._dataset.name, np.asarray(data).nbytes)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._dataset, name)
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __array__(self, dtype=None):
+        return np.asarray(self[()], dtype=dtype)
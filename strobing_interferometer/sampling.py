@@ -0,0 +1,214 @@
+"""
+Adaptive choice of the calibration biases.
+
+Between two calibration biases the analysis interpolates the intensity of
+each pixel, so the calibration only needs to be dense where the fringes bend.
+A coarse sweep is refined by batches of biases where the per-pixel slopes
+change the most, until the slopes stop changing. The slopes then tell which
+biases make the most pixels sensitive for the stroboscopic videos.
+"""
+import numpy as np
+
+
+def _resample(x, y, grid):
+    """
+    Linear interpolation of the columns of `y` (sampled at the increasing
+    `x`) at the `grid` points
+    """
+    index = np.clip(np.searchsorted(x, grid), 1, len(x) - 1)
+    weight = ((grid - x[index - 1]) / (x[index] - x[index - 1]))[:, None]
+    return y[index - 1] * (1 - weight) + y[index] * weight
+
+
+class AdaptiveBiasSampling:
+    """
+    Chooses the calibration biases from the photos already recorded (see
+    `Acquisition.acquire_calibration`).
+
+    The photos are followed on a grid of about `n_pixels` pixels:
+        1. `coarse` evenly spaced biases are recorded.
+        2. Each refinement adds the midpoints of the `batch` intervals with
+           the largest `width * median(|slope change|)`, the slope change of
+           a pixel being the difference of its slopes at both ends of the
+           interval (the error of a linear interpolation of its fringe).
+        3. It stops when the per-pixel slopes at the coarse biases changed by
+           less than `tolerance` (relative to their median) with the last
+           refinement, after `max_biases` biases or when no interval is wider
+           than `2 * min_step`.
+
+    Each refinement is recorded in a single ramp across the range, so a
+    refinement costs the ramp time of a whole sweep: large batches keep their
+    number small.
+
+    Example:
+        sampling = AdaptiveBiasSampling(coarse=21, max_biases=70)
+        acquisition.acquire_calibration(sampling=sampling)
+        acquisition.acquire_modeshape()  # at `sampling.video_biases()`
+    """
+
+    def __init__(
+        self,
+        coarse=21,
+        max_biases=100,
+        batch=16,
+        tolerance=0.05,
+        min_step=None,
+        n_pixels=4096,
+    ):
+        """
+        Args:
+            coarse (int): Number of evenly spaced biases of the first sweep
+            max_biases (int): Maximum number of biases
+            batch (int): Number of biases added by each refinement
+            tolerance (float): Relative change of the slopes under which the
+                sampling is converged
+            min_step (float): Smallest spacing of two biases (a quarter of
+                the coarse spacing by default)
+            n_pixels (int): Approximate number of pixels followed
+        """
+        if coarse < 3:
+            raise ValueError("The coarse sweep needs at least 3 biases")
+        if max_biases < coarse:
+            raise ValueError("max_biases is smaller than the coarse sweep")
+        self.coarse = coarse
+        self.max_biases = max_biases
+        self.batch = batch
+        self.tolerance = tolerance
+        self.min_step = min_step
+        self.n_pixels = n_pixels
+        self.biases = []
+        "Recorded biases (in the acquisition order)"
+        self.samples = []
+        "Followed pixels of the photo of each recorded bias"
+        self.changes = []
+        "Relative change of the slopes with each refinement"
+        self.converged = False
+
+    def start(self, bias_range, frame_shape):
+        """
+        Start a new calibration
+
+        Args:
+            bias_range (tuple): Minimum and maximum bias
+            frame_shape (tuple): Shape of the photos
+
+        Returns:
+            np.ndarray: The biases of the coarse sweep
+        """
+        self.coarse_biases = np.linspace(bias_range[0], bias_range[1], self.coarse)
+        self.step = self.min_step
+        if self.step is None:
+            self.step = (bias_range[1] - bias_range[0]) / (self.coarse - 1) / 4
+        self.stride = max(
+            1, int(np.sqrt(frame_shape[0] * frame_shape[1] / self.n_pixels))
+        )
+        self.biases = []
+        self.samples = []
+        self.changes = []
+        self.converged = False
+        self._estimate = None
+        return self.coarse_biases
+
+    def add(self, bias, photo):
+        """
+        Record the (mean) photo of a bias
+        """
+        self.biases.append(float(bias))
+        self.samples.append(
+            np.asarray(photo[:: self.stride, :: self.stride], np.float64).flatten()
+        )
+
+    def slopes(self):
+        """
+        Slope of the followed pixels at each recorded bias
+
+        Returns:
+            tuple: The sorted biases and the slopes (shape
+            `(n_biases, n_pixels)`)
+        """
+        order = np.argsort(self.biases, kind="stable")
+        biases = np.array(self.biases)[order]
+        values = np.array(self.samples)[order]
+        return biases, np.gradient(values, biases, axis=0)
+
+    def next_biases(self, current=None):
+        """
+        Biases of the next refinement, once all the previous biases were
+        `AdaptiveBiasSampling.add`-ed
+
+        Args:
+            current (float): Bias of the setup: the biases are given in the
+                order of a single ramp from there
+
+        Returns:
+            np.ndarray: The biases to record (empty when the sampling is over)
+        """
+        none = np.zeros(0)
+        biases, slopes = self.slopes()
+        estimate = _resample(biases, slopes, self.coarse_biases)
+        if self._estimate is not None:
+            scale = np.median(np.abs(estimate)) or 1.0
+            change = (
+                np.mean(np.median(np.abs(estimate - self._estimate), axis=1)) / scale
+            )
+            self.changes.append(change)
+            if change < self.tolerance:
+                self.converged = True
+                return none
+        self._estimate = estimate
+        n_new = min(self.batch, self.max_biases - len(biases))
+        width = np.diff(biases)
+        score = width * np.median(np.abs(np.diff(slopes, axis=0)), axis=1)
+        score[width < 2 * self.step * (1 - 1e-9)] = -np.inf
+        refined = np.argsort(score)[::-1][:n_new]
+        refined = np.sort(refined[np.isfinite(score[refined])])
+        new = (biases[refined] + biases[refined + 1]) / 2
+        if len(new) and current is not None:
+            if abs(current - new[-1]) < abs(current - new[0]):
+                new = new[::-1]
+        return new
+
+    def video_biases(self, n_videos=10, margin=2):
+        """
+        Biases of the stroboscopic videos, among the recorded ones, so that
+        as many pixels as possible are sensitive in one of the videos.
+
+        The sensitivity of a pixel at a bias is its slope relative to its
+        steepest slope. The biases are picked one by one, each time the one
+        that increases most the sum over the pixels of their best
+        sensitivity among the picked biases.
+
+        Args:
+            n_videos (int): Number of videos
+            margin (int): Number of biases excluded at each end of the range
+                (lost by the smoothing of the analysis)
+
+        Returns:
+            np.ndarray: The sorted video biases
+        """
+        biases, slopes = self.slopes()
+        strength = np.abs(slopes[margin : len(biases) - margin])
+        if not len(strength):
+            raise ValueError("Not enough calibration biases for the videos")
+        strength /= np.maximum(strength.max(axis=0), np.finfo(np.float64).tiny)
+        best = np.zeros(strength.shape[1])
+        picked = []
+        for _ in range(min(n_videos, len(strength))):
+            gain = np.maximum(strength, best).sum(axis=1)
+            gain[picked] = -np.inf
+            pick = int(np.argmax(gain))
+            picked.append(pick)
+            best = np.maximum(best, strength[pick])
+        self.coverage = np.mean(best >= 0.5)
+        "Fraction of the pixels at more than half their steepest slope"
+        return np.sort(biases[margin:][picked])
+
+    def describe(self):
+        """
+        Description of the sampling (stored in the calibration attributes)
+        """
+        return (
+            f"adaptive: {self.coarse} coarse biases, batches of {self.batch}, "
+            f"tolerance {self.tolerance:g}, {len(self.biases)} biases, "
+            + ("converged" if self.converged else "not converged")
+        )
@@ -0,0 +1,338 @@
+"""
+In-process simulation of the setup (lock-in, strobe generator and camera)
+to run, test and benchmark the acquisition without the instruments.
+
+The simulated membrane follows the model of
+`strobing_interferometer.synthetic`: every pixel sees a fringe
+`offset + contrast * cos(k * (bias + displacement) + phase)`. The
+displacement is a membrane mode oscillating at the drive frequency, and the
+strobe makes it appear at the strobe detuning.
+
+Example:
+    setup = SimulatedSetup(frame_shape=(270, 360), frame_rate=100)
+    acquisition = Acquisition(
+        "membrane.h5", 1000, 10, (-3, 3), instruments_manager=setup.instruments()
+    )
+"""
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .synthetic import membrane_mode
+
+Range = namedtuple("Range", "min max")
+
+
+class SimulatedDAQ:
+    """
+    Node tree of the HF2 lock-in (`getDouble`, `setDouble`, `getInt`,
+    `setInt` of the zhinst `ziDAQServer`)
+    """
+
+    defaults = {
+        "/dev1224/oscs/0/freq": 1.0e5,
+        "/dev1224/sigouts/0/amplitudes/6": 0.1,
+        "/dev1224/sigouts/0/enables/6": 0,
+        "/dev1224/sigouts/1/offset": 0.0,
+    }
+
+    def __init__(self, latency=0.0):
+        """
+        Args:
+            latency (float): Duration of each call (s), as the round trip to
+                the data server
+        """
+        self.nodes = dict(self.defaults)
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self, path):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if path not in self.nodes:
+            raise RuntimeError(f"Unknown node: {path}")
+
+    def getDouble(self, path):
+        self._call(path)
+        return float(self.nodes[path])
+
+    def getInt(self, path):
+        self._call(path)
+        return int(self.nodes[path])
+
+    def setDouble(self, path, value):
+        self._call(path)
+        self.nodes[path] = float(value)
+
+    def setInt(self, path, value):
+        self._call(path)
+        self.nodes[path] = int(value)
+
+    def set(self, settings):
+        """
+        Set several nodes in one request (`[(path, value), ...]`)
+        """
+        for path, _ in settings:
+            if path not in self.nodes:
+                raise RuntimeError(f"Unknown node: {path}")
+        self._call(settings[0][0])
+        for path, value in settings:
+            self.nodes[path] = type(self.defaults[path])(value)
+
+
+class SimulatedHF2:
+    """
+    The `HF2` wrapper: only its `daq` is used
+    """
+
+    def __init__(self, daq):
+        self.daq = daq
+
+
+class SimulatedRigol:
+    """
+    The `DG1032Z` strobe generator: a frequency and an output switch
+    """
+
+    def __init__(self, frequency=1.0e5):
+        self.frequency = frequency
+        self.output = False
+        self.channel = 1
+
+
+class SimulatedFrame:
+    def __init__(self, image_buffer, frame_count):
+        self.image_buffer = image_buffer
+        self.frame_count = frame_count
+
+
+class SimulatedCamera:
+    """
+    A Thorlabs `TLCamera` streaming the images of a `SimulatedSetup`.
+
+    After a software trigger, a thread produces
+    `frames_per_trigger_zero_for_unlimited` frames at the frame rate, the
+    first one `latency` seconds after the trigger. They wait in a buffer of
+    the size given to `arm`: frames produced while it is full are lost, like
+    those randomly dropped with probability `drop_rate`. Lost frames show up
+    as gaps in `frame_count`.
+    """
+
+    def __init__(self, setup, frame_rate=30.0, latency=0.01, drop_rate=0.0):
+        self.setup = setup
+        self.serial = "25779"
+        self.sensor_height_pixels, self.sensor_width_pixels = setup.frame_shape
+        self.exposure_time_range_us = Range(64, 10**6)
+        self.exposure_time_us = 1000
+        self.image_poll_timeout_ms = 0
+        self.frames_per_trigger_zero_for_unlimited = 1
+        self.frame_rate_control_value = frame_rate
+        self.latency = latency
+        self.drop_rate = drop_rate
+        self.dropped = 0
+        "Frames lost since the camera was opened"
+        self._buffer = None
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.dispose()
+
+    def arm(self, frames_to_buffer):
+        if self._buffer is not None:
+            raise RuntimeError("The camera is already armed")
+        self._buffer_size = frames_to_buffer
+        self._buffer = []
+        self._frame_count = 0
+        self._delivered = []
+
+    def disarm(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stop.clear()
+        self._buffer = None
+
+    def dispose(self):
+        self.disarm()
+
+    def issue_software_trigger(self):
+        if self._buffer is None:
+            raise RuntimeError("The camera must be armed before a trigger")
+        if self._thread is not None:
+            self._thread.join()  # the previous trigger is not over
+        self._thread = threading.Thread(
+            target=self._produce,
+            args=(
+                time.perf_counter() + self.latency,
+                self.frame_rate_control_value,
+                self.frames_per_trigger_zero_for_unlimited or np.inf,
+                self.exposure_time_us,
+            ),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _produce(self, start, frame_rate, n_frames, exposure_time_us):
+        index = 0
+        while index < n_frames:
+            frame_time = start + index / frame_rate
+            if self._stop.wait(max(frame_time - time.perf_counter(), 0)):
+                return
+            index += 1
+            self._frame_count += 1
+            with self._condition:
+                full = len(self._buffer) >= self._buffer_size
+            if full or self.setup.rng.random() < self.drop_rate:
+                self.dropped += 1
+                continue
+            image = self.setup.render(frame_time, exposure_time_us)
+            with self._condition:
+                self._buffer.append(SimulatedFrame(image, self._frame_count))
+                self._delivered.append(frame_time)
+                self._condition.notify_all()
+
+    def get_pending_frame_or_null(self):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._buffer, self.image_poll_timeout_ms / 1000
+            )
+            if not self._buffer:
+                return None
+            return self._buffer.pop(0)
+
+    def get_measured_frame_rate_fps(self):
+        times = self._delivered[-100:]
+        if len(times) < 2:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+
+class SimulatedCameraSDK:
+    """
+    The `TLCameraSDK`, giving access to the camera of a `SimulatedSetup`
+    """
+
+    def __init__(self, camera):
+        self.camera = camera
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.dispose()
+
+    def discover_available_cameras(self):
+        return [self.camera.serial]
+
+    def open_camera(self, serial):
+        if serial != self.camera.serial:
+            raise RuntimeError(f"No camera with the serial number {serial}")
+        return self.camera
+
+    def dispose(self):
+        pass
+
+
+class SimulatedSetup:
+    """
+    A simulated membrane with its instruments.
+
+    The bias is read from the lock-in offset, the motion is only visible
+    when the drive is enabled and the strobe output is on.
+    """
+
+    def __init__(
+        self,
+        frame_shape=(270, 360),
+        frame_rate=30.0,
+        latency=0.01,
+        drop_rate=0.0,
+        daq_latency=0.0,
+        modes=((1, 2, 1.0),),
+        amplitude=0.02,
+        noise=3.0,
+        seed=0,
+        bias_gain=0.1,
+    ):
+        """
+        Args:
+            frame_shape (tuple): `(height, width)` of the sensor
+            frame_rate (float): Frame rate until the acquisition sets one
+            latency (float): Delay between a trigger and the first frame (s)
+            drop_rate (float): Probability that the camera loses a frame
+            daq_latency (float): Duration of each lock-in call (s)
+            modes (tuple): `(m, n, weight)` of the membrane modes
+            amplitude (float): Maximum displacement in volts of bias
+            noise (float): Standard deviation of the camera noise in counts
+            seed (int): Seed of the random generator
+            bias_gain (float): Volts of bias per volt of lock-in offset
+                (`InstrumentManager.bias_gain`)
+        """
+        self.frame_shape = tuple(frame_shape)
+        self.rng = np.random.default_rng(seed)
+        # Bright enough for the exposure check of the acquisition at 1 ms
+        self.offset = self.rng.uniform(600, 700, frame_shape).astype(np.float32)
+        self.contrast = self.rng.uniform(250, 330, frame_shape).astype(np.float32)
+        self.k = self.rng.uniform(1.2, 2.0, frame_shape).astype(np.float32)
+        self.phase = self.rng.uniform(0, 2 * np.pi, frame_shape).astype(np.float32)
+        self.shape = amplitude * sum(
+            weight * membrane_mode(frame_shape, m, n) for m, n, weight in modes
+        )
+        "The true mode shape (displacement in volts)"
+        self._shape = self.shape.astype(np.float32)
+        # a few noise images drawn once: the camera must render in real time
+        self.noise = self.rng.normal(scale=noise, size=(8, *frame_shape)).astype(
+            np.float32
+        )
+        self.bias_gain = bias_gain
+        self.daq = SimulatedDAQ(daq_latency)
+        self.hf2 = SimulatedHF2(self.daq)
+        self.rigol = SimulatedRigol()
+        self.camera = SimulatedCamera(self, frame_rate, latency, drop_rate)
+
+    def instruments(self):
+        """
+        An `InstrumentManager` using the simulated instruments
+        """
+        from .acquisition import InstrumentManager
+
+        return InstrumentManager(
+            hf2=self.hf2,
+            rigol=self.rigol,
+            camera_sdk=lambda: SimulatedCameraSDK(self.camera),
+        )
+
+    @property
+    def bias(self):
+        return self.daq.nodes["/dev1224/sigouts/1/offset"] / self.bias_gain
+
+    def render(self, t, exposure_time_us):
+        """
+        Camera image at time `t` (10 bits in `uint16`)
+        """
+        nodes = self.daq.nodes
+        bias = np.float32(self.bias)
+        if nodes["/dev1224/sigouts/0/enables/6"] and self.rigol.output:
+            detuning = self.rigol.frequency - nodes["/dev1224/oscs/0/freq"]
+            bias = bias + self._shape * np.float32(
+                np.sin(2 * np.pi * detuning * t)
+            )
+        image = self.k * bias
+        image += self.phase
+        np.cos(image, out=image)
+        image *= self.contrast
+        image += self.offset
+        image *= np.float32(exposure_time_us / 1000)
+        image += self.noise[self.rng.integers(len(self.noise))]
+        return image.clip(0, 1023).astype(np.uint16)
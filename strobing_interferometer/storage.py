@@ -0,0 +1,196 @@
+"""
+Storage layout (chunking and compression) of the image datasets of an
+acquisition.
+"""
+import h5py
+import hdf5plugin  # registers the Blosc and Bitshuffle filters
+import numpy as np
+
+CHUNK_CACHE_BYTES = 64 * 2**20
+"Size of the chunk cache of each dataset when reading an acquisition"
+
+
+def open_acquisition(path, mode="r", **kwargs):
+    """
+    Open an acquisition file with a chunk cache big enough to hold a slab of
+    chunks of a row band.
+
+    Old contiguous files and chunked ones are read the same way (the Blosc
+    and Bitshuffle filters come from `hdf5plugin`).
+    """
+    kwargs.setdefault("rdcc_nbytes", CHUNK_CACHE_BYTES)
+    kwargs.setdefault("rdcc_nslots", 10007)  # prime, ~100 times the chunk count
+    return h5py.File(path, mode, **kwargs)
+
+
+def aligned(length, chunk):
+    """
+    Round `length` down to a multiple of `chunk` (if it is at least `chunk`)
+    so that reads cover whole chunks.
+    """
+    if not chunk or length < chunk:
+        return length
+    return length - length % chunk
+
+
+class StorageLayout:
+    """
+    How the image datasets (`photos`, calibration `videos` and
+    `stroboscopic/videoN`) are chunked and compressed.
+
+    Chunks span `frames` images (time, or bias for the calibration) of a
+    tile of pixels, so that the analysis, which reads the time traces of
+    bands of pixels, reads whole chunks. The first axes of the calibration
+    `videos` dataset (bias and frame) are both chunked.
+
+    The camera data is 10 bits in `uint16` so the shuffle (or bitshuffle)
+    filter, which groups the always-zero high bits together, makes it very
+    compressible:
+        - `"blosc"`: Blosc + zstd with bitshuffle, fast and small (default)
+        - `"bitshuffle"`: Bitshuffle + LZ4
+        - `"lzf"`: built in h5py, but several times slower to compress: its
+          writes hold the GIL long enough to make the camera reader miss
+          frames
+        - `"gzip"`: smaller, slower (`level` 1 to 9)
+        - `None`: no compression
+
+    Blosc and Bitshuffle come from `hdf5plugin`, which must be imported (as
+    this module does) to read the files with h5py.
+    """
+
+    def __init__(
+        self,
+        tile=(64, 64),
+        frames=32,
+        compression="blosc",
+        level=None,
+        shuffle=True,
+        max_chunk_bytes=2**20,
+    ):
+        """
+        Args:
+            tile (tuple[int, int]): Maximum rows and columns of a chunk (the
+                image is split in equal tiles of at most this size). `None` for a
+                contiguous dataset (no chunking and no compression, the
+                layout of the first acquisitions).
+            frames (int): Number of images in a chunk (reduced if the chunk
+                would be bigger than `max_chunk_bytes`)
+            compression (str): Compression filter (see above)
+            level (int): Compression level of `"gzip"` and `"blosc"`
+            shuffle (bool): Use the shuffle filter (ignored by `"blosc"` and
+                `"bitshuffle"` that shuffle bits themselves)
+            max_chunk_bytes (int): Maximum size of an uncompressed chunk
+        """
+        if compression not in (None, "lzf", "gzip", "blosc", "bitshuffle"):
+            raise ValueError(f"Unknown compression: {compression}")
+        self.tile = tile
+        self.frames = frames
+        self.compression = compression
+        self.level = level
+        self.shuffle = shuffle
+        self.max_chunk_bytes = max_chunk_bytes
+
+    @classmethod
+    def contiguous(cls):
+        """
+        Layout of the first acquisitions: no chunking nor compression
+        """
+        return cls(tile=None, compression=None)
+
+    def chunks(self, shape, dtype, frames=None):
+        """
+        Chunk shape of an image dataset (images on the last two axes)
+
+        Args:
+            frames (int): Chunk length on the first axis, instead of
+                `self.frames` (e.g. 1 for a dataset written image by image)
+        """
+        leading = list(shape[:-2])
+        if leading:
+            leading[0] = min(leading[0], frames or self.frames)
+        # split each image axis in equal tiles of at most `self.tile` pixels
+        # so that the border chunks are not mostly padding
+        tile = [
+            -(-n // max(1, -(-n // t))) for t, n in zip(self.tile, shape[-2:])
+        ]
+        chunk = [*leading, *tile]
+        itemsize = np.dtype(dtype).itemsize
+        axis = 0
+        while axis < len(leading):
+            if int(np.prod(chunk)) * itemsize <= self.max_chunk_bytes:
+                break
+            if chunk[axis] > 1:
+                chunk[axis] = (chunk[axis] + 1) // 2
+            else:
+                axis += 1
+        return tuple(max(1, n) for n in chunk)
+
+    def filters(self):
+        """
+        Compression keyword arguments of `h5py.Group.create_dataset`
+        """
+        if self.compression is None:
+            return {}
+        if self.compression == "blosc":
+            return dict(
+                hdf5plugin.Blosc(
+                    cname="zstd",
+                    clevel=self.level or 1,
+                    shuffle=hdf5plugin.Blosc.BITSHUFFLE,
+                )
+            )
+        if self.compression == "bitshuffle":
+            return dict(hdf5plugin.Bitshuffle(cname="lz4"))
+        options = {"compression": self.compression, "shuffle": self.shuffle}
+        if self.compression == "gzip" and self.level is not None:
+            options["compression_opts"] = self.level
+        return options
+
+    def dataset_options(self, shape, dtype, frames=None):
+        """
+        Keyword arguments of `h5py.Group.create_dataset` for an image
+        dataset of this `shape` and `dtype` (see `StorageLayout.chunks`)
+        """
+        if self.tile is None:
+            return {}
+        return {"chunks": self.chunks(shape, dtype, frames), **self.filters()}
+
+    def create_dataset(
+        self,
+        group,
+        name,
+        shape=None,
+        dtype=None,
+        data=None,
+        frames=None,
+        resizable=False,
+    ):
+        """
+        Create an image dataset with this layout in `group` (see
+        `StorageLayout.chunks` for `frames`)
+
+        Args:
+            resizable (bool): Allow to resize the first axis (a contiguous
+                layout is then chunked by image)
+        """
+        if data is not None:
+            data = np.asarray(data, dtype=dtype)
+            shape, dtype = data.shape, data.dtype
+        options = self.dataset_options(shape, dtype, frames)
+        if resizable:
+            options.setdefault("chunks", (*(1 for _ in shape[:-2]), *shape[-2:]))
+            options["maxshape"] = (None, *shape[1:])
+        return group.create_dataset(
+            name, shape=shape, dtype=dtype, data=data, **options
+        )
+
+    def describe(self):
+        """
+        Description of the layout (stored in the acquisition attributes)
+        """
+        if self.tile is None:
+            return "contiguous"
+        return (
+            f"tile {self.tile[0]}x{self.tile[1]}, {self.frames} frames, "
+            f"{self.compression or 'no'} compression"
+        )
@@ -0,0 +1,125 @@
+"""
+Synthetic acquisitions, written in the layout of the acquisition script (see
+`docs/docs/programs/file_format.md`), for benchmarks and for trying the
+analysis without the setup.
+"""
+import h5py
+import numpy as np
+
+from .storage import StorageLayout
+
+
+def membrane_mode(frame_shape, m, n):
+    """
+    (m, n) mode of a square membrane clamped on the border of the frame
+
+    Args:
+        frame_shape (tuple): `(height, width)` of the sensor
+        m (int): Number of antinodes along the rows
+        n (int): Number of antinodes along the columns
+    """
+    y = np.linspace(0, 1, frame_shape[0])[:, None]
+    x = np.linspace(0, 1, frame_shape[1])[None, :]
+    return np.sin(m * np.pi * y) * np.sin(n * np.pi * x)
+
+
+def make_acquisition(
+    path,
+    frame_shape=(120, 160),
+    n_biases=100,
+    n_calibration_frames=2,
+    n_videos=10,
+    n_frames=100,
+    fps=20.0,
+    strobe_detuning=0.4,
+    modes=((1, 2, 1.0),),
+    amplitude=0.02,
+    noise=3.0,
+    seed=0,
+    layout=None,
+):
+    """
+    Write a synthetic acquisition in `path`.
+
+    Every pixel sees a fringe `offset + contrast * cos(k * bias + phase)`
+    with random pixel to pixel `offset`, `contrast`, `k` and `phase`. The
+    membrane displacement (in volts of equivalent bias) is the sum of `modes`
+    scaled by `amplitude`, oscillating at `strobe_detuning` in the strobed
+    videos.
+
+    Args:
+        path (Path | str): The hdf5 file to create (overwritten)
+        frame_shape (tuple): `(height, width)` of the sensor
+        n_biases (int): Number of calibration biases
+        n_calibration_frames (int): Frames recorded per calibration bias
+        n_videos (int): Number of strobed videos
+        n_frames (int): Frames per video
+        fps (float): Frame rate of the videos
+        strobe_detuning (float): Apparent frequency of the motion in Hz
+        modes (tuple): `(m, n, weight)` of the membrane modes
+        amplitude (float): Maximum displacement in volts
+        noise (float): Standard deviation of the camera noise in counts
+        seed (int): Seed of the random generator
+        layout (StorageLayout): Chunking and compression of the image
+            datasets (contiguous by default)
+
+    Returns:
+        np.ndarray: The true mode shape (displacement in volts)
+    """
+    if layout is None:
+        layout = StorageLayout.contiguous()
+    rng = np.random.default_rng(seed)
+    height, width = frame_shape
+    biases = np.linspace(-3, 3, n_biases)
+    offset = rng.uniform(400, 600, frame_shape)
+    contrast = rng.uniform(150, 300, frame_shape)
+    k = rng.uniform(1.2, 2.0, frame_shape)
+    phase = rng.uniform(0, 2 * np.pi, frame_shape)
+    shape = amplitude * sum(
+        weight * membrane_mode(frame_shape, m, n) for m, n, weight in modes
+    )
+
+    def frames(bias, count):
+        clean = offset + contrast * np.cos(k * bias + phase)
+        noisy = clean + rng.normal(scale=noise, size=(count, height, width))
+        return noisy.clip(0, 2**16 - 1).astype(np.uint16)
+
+    with h5py.File(path, "w") as f:
+        f.attrs["frame_shape"] = np.array(frame_shape)
+        f.attrs["membrane"] = "synthetic"
+
+        calibration = f.create_group("bias calibration")
+        calibration["biases"] = biases
+        photos = layout.create_dataset(
+            calibration, "photos", (n_biases, height, width), np.float64
+        )
+        videos = layout.create_dataset(
+            calibration,
+            "videos",
+            (n_biases, n_calibration_frames, height, width),
+            np.uint16,
+        )
+        for i, bias in enumerate(biases):
+            video = frames(bias, n_calibration_frames)
+            videos[i] = video
+            photos[i] = video.mean(axis=0)
+
+        stroboscopic = f.create_group("stroboscopic")
+        stroboscopic.attrs["strobe detuning"] = strobe_detuning
+        stroboscopic.attrs["acquisition time"] = n_videos * n_frames / fps
+        video_indices = (np.arange(n_videos) + 0.5) * n_biases // n_videos
+        time = np.arange(n_frames) / fps
+        for i, index in enumerate(video_indices.astype(int)):
+            bias = biases[index]
+            video = layout.create_dataset(
+                stroboscopic, f"video{i}", (n_frames, height, width), np.uint16
+            )
+            batch = video.chunks[0] if video.chunks else 1
+            for start in range(0, n_frames, batch):
+                # write whole chunks at once
+                t = time[start : start + batch, None, None]
+                motion = shape * np.sin(2 * np.pi * strobe_detuning * t)
+                video[start : start + batch] = frames(bias + motion, len(t))
+            video.attrs["bias(V)"] = bias
+            video.attrs["fps"] = fps
+    return shape
@@ -0,0 +1,211 @@
+"""
+Runtime data of an acquisition: every frame received from the camera, the
+dropped frames, the duration of each phase and the write throughput. It is
+kept in memory for live inspection (`Telemetry.snapshot`) and stored in the
+`telemetry` group of the acquisition file.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from .pipeline import FRAME_LOG_DTYPE
+
+RUN_DTYPE = np.dtype(
+    [
+        ("run", np.int32),
+        ("bias", np.float64),
+        ("received", np.int64),
+        ("written", np.int64),
+        ("camera_dropped", np.int64),
+        ("dropped", np.int64),
+        ("polls", np.int64),
+        ("duration", np.float64),
+        ("write_time", np.float64),
+        ("write_throughput", np.float64),
+        ("high_water", np.int64),
+        ("put_wait", np.float64),
+    ]
+)
+"One row per pipeline run (a calibration bias or a video)"
+
+WRITE_DTYPE = np.dtype(
+    [
+        ("run", np.int32),
+        ("first_frame", np.int64),
+        ("frames", np.int64),
+        ("duration", np.float64),
+    ]
+)
+"One row per batch of frames given to the sink"
+
+PHASE_DTYPE = np.dtype(
+    [("phase", "S16"), ("start", np.float64), ("duration", np.float64)]
+)
+"One row per phase of the `PhaseTimer` (start since the beginning)"
+
+
+def measured_frame_rate(frame_log):
+    """
+    Frame rate fitted on the camera frame numbers and the host timestamps of
+    a `FramePipeline.frame_log` (dropped frames don't bias it). `nan` with
+    less than two frames.
+    """
+    if len(frame_log) < 2:
+        return float("nan")
+    slope = np.polyfit(
+        frame_log["frame_count"].astype(np.float64),
+        frame_log["timestamp"] - frame_log["timestamp"][0],
+        1,
+    )[0]
+    return 1 / slope
+
+
+class Telemetry:
+    """
+    Telemetry of the stages of an acquisition (`"calibration"` and
+    `"stroboscopic"`).
+
+    Each stage records the pipeline runs (`Telemetry.record`), the drop
+    events and its `PhaseTimer`. The object can be inspected from another
+    thread while the acquisition runs (see `Telemetry.snapshot`).
+
+    In the file, `telemetry/<stage>` holds:
+        - `runs`: statistics of each pipeline run (`RUN_DTYPE`)
+        - `frames`: every received frame (`FRAME_LOG_DTYPE` and its `run`)
+        - `writes`: every batch given to the file (`WRITE_DTYPE`)
+        - `phases`: every phase (`PHASE_DTYPE`)
+        - the `phase budget` and the drop `events` as JSON attributes
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.stage = None
+        "Name of the running stage"
+        self.pipeline = None
+        "Pipeline of the running stage"
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def recording(self, file, stage, timer, pipeline):
+        """
+        Context manager recording a stage and storing it in `file` when it
+        exits, even on errors. The pipeline is joined before (its error is
+        not raised again).
+        """
+        with self._lock:
+            self.stages[stage] = {
+                "timer": timer,
+                "runs": [],
+                "frames": [],
+                "writes": [],
+                "events": [],
+            }
+            self.stage = stage
+            self.pipeline = pipeline
+        try:
+            yield self
+        finally:
+            if pipeline.running:
+                try:
+                    pipeline.join()
+                except Exception:  # the error being raised is more relevant
+                    pass
+            self.stage = None
+            self.store(file, stage)
+
+    def record(self, run, pipeline, bias=np.nan):
+        """
+        Record a pipeline run of the current stage (after
+        `FramePipeline.join`, which may have failed)
+
+        Args:
+            run (int): Index of the bias or of the video
+            pipeline (FramePipeline): The pipeline
+            bias (float): Bias of the run
+        """
+        stats = pipeline.stats
+        row = np.zeros((), dtype=RUN_DTYPE)
+        row["run"] = run
+        row["bias"] = bias
+        for name in RUN_DTYPE.names[2:]:
+            row[name] = stats.get(name, 0)
+        frames = pipeline.frame_log[: pipeline.received].copy()
+        writes = np.array(
+            [(run, *write) for write in pipeline.write_log], dtype=WRITE_DTYPE
+        )
+        now = time.time()
+        with self._lock:
+            stage = self.stages[self.stage]
+            stage["runs"].append(row)
+            stage["frames"].append((run, frames))
+            stage["writes"].append(writes)
+            stage["events"].extend(
+                {"time": now, "run": run, **event} for event in pipeline.events
+            )
+
+    def snapshot(self):
+        """
+        Summary of the telemetry so far: for each stage, the statistics of
+        the runs, the drop events and the phase budget. While a stage runs,
+        `live` gives the frames received and waiting in the ring buffer.
+        """
+        with self._lock:
+            snapshot = {
+                name: {
+                    "runs": np.array(stage["runs"], dtype=RUN_DTYPE),
+                    "events": list(stage["events"]),
+                    "phases": stage["timer"].report(),
+                }
+                for name, stage in self.stages.items()
+            }
+            if self.stage is not None:
+                ring = self.pipeline.ring
+                snapshot["live"] = {
+                    "stage": self.stage,
+                    "received": self.pipeline.received,
+                    "waiting": len(ring),
+                    "high_water": ring.high_water,
+                    "dropped": ring.dropped,
+                }
+        return snapshot
+
+    def store(self, file, stage):
+        """
+        Write the telemetry of `stage` in `telemetry/<stage>` (replaced)
+        """
+        with self._lock:
+            record = self.stages[stage]
+            runs = np.array(record["runs"], dtype=RUN_DTYPE)
+            frame_dtype = np.dtype([("run", np.int32)] + FRAME_LOG_DTYPE.descr)
+            frames = np.zeros(
+                sum(len(log) for _, log in record["frames"]), dtype=frame_dtype
+            )
+            start = 0
+            for run, log in record["frames"]:
+                rows = frames[start : start + len(log)]
+                rows["run"] = run
+                for name in FRAME_LOG_DTYPE.names:
+                    rows[name] = log[name]
+                start += len(log)
+            writes = np.concatenate(
+                [np.zeros(0, dtype=WRITE_DTYPE), *record["writes"]]
+            )
+            timer = record["timer"]
+            phases = np.array(
+                [(name.encode(), begin, length) for name, begin, length in timer.log],
+                dtype=PHASE_DTYPE,
+            )
+            events = list(record["events"])
+        group = file.require_group("telemetry")
+        if stage in group:
+            del group[stage]
+        group = group.create_group(stage)
+        group.create_dataset("runs", data=runs)
+        group.create_dataset("frames", data=frames)
+        group.create_dataset("writes", data=writes)
+        group.create_dataset("phases", data=phases)
+        group.attrs["phase budget"] = timer.to_json()
+        group.attrs["events"] = json.dumps(events, default=float)
@@ -0,0 +1,171 @@
+"""
+`Acquisition` and `InstrumentManager` on the simulated setup
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from strobing_interferometer.acquisition import Acquisition, AcquisitionCancelled
+from strobing_interferometer.analysis import StdAnalysis
+from strobing_interferometer.pipeline import FRAME_LOG_DTYPE
+from strobing_interferometer.sampling import AdaptiveBiasSampling
+from strobing_interferometer.simulator import SimulatedSetup
+from strobing_interferometer.storage import open_acquisition
+from strobing_interferometer.telemetry import measured_frame_rate
+
+BIAS_RANGE = (-3, 3)
+
+
+@pytest.fixture
+def setup():
+    return SimulatedSetup(frame_shape=(60, 80), frame_rate=500, latency=0.0)
+
+
+@pytest.fixture
+def acquisition(setup, tmp_path):
+    return Acquisition(
+        tmp_path / "acquisition.h5",
+        exposure_time_us=1000,
+        n_calib=4,
+        bias_range=BIAS_RANGE,
+        instruments_manager=setup.instruments(),
+        ramp_speed=50.0,
+        calibration_settle_time=0.0,
+        frame_rate=500,
+    )
+
+
+def test_cancel_during_a_ramp_records_no_bias(acquisition):
+    biases = np.linspace(*BIAS_RANGE, 100)
+    manager = acquisition.instruments_manager
+    go_to_bias = manager.goToBias
+
+    def cancelled_ramp(bias, *args, **kwargs):
+        if bias == biases[5]:
+            acquisition.cancel()  # the ramp stops after its first step
+        go_to_bias(bias, *args, **kwargs)
+
+    manager.goToBias = cancelled_ramp
+    with pytest.raises(AcquisitionCancelled):
+        acquisition.acquire_calibration()
+    with open_acquisition(acquisition.path) as f:
+        calibration = f["bias calibration"]
+        # nothing recorded on the way to the 6th bias
+        np.testing.assert_array_equal(calibration["biases"][...], biases[:5])
+        assert len(calibration["photos"]) == 5
+
+
+def test_cancelled_ramp_stops_where_it_is(acquisition, setup):
+    async def ramp():
+        task = asyncio.ensure_future(acquisition.go_to_bias_async(2.0, speed=0.5))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(ramp())
+    stopped = setup.bias
+    assert 0 < stopped < 2.0
+    asyncio.run(asyncio.sleep(0.1))
+    assert setup.bias == stopped
+
+
+def test_ramp_keeps_the_cancel_of_a_running_acquisition(acquisition):
+    async def cancel_then_ramp():
+        task = asyncio.ensure_future(acquisition.acquire_calibration_async())
+        await asyncio.sleep(0)  # the acquisition is running
+        acquisition.cancel()
+        await acquisition.go_to_bias_async(0.0)
+        await task
+
+    with pytest.raises(AcquisitionCancelled):
+        asyncio.run(cancel_then_ramp())
+
+
+def test_batch_sends_the_drive_settings_in_one_request(setup):
+    manager = setup.instruments()
+    calls = setup.daq.calls
+    manager.set_drive(frequency=1.2e5, amplitude=0.2, enabled=True)
+    assert setup.daq.calls == calls + 1
+    assert setup.daq.nodes["/dev1224/oscs/0/freq"] == 1.2e5
+    assert setup.daq.nodes["/dev1224/sigouts/0/enables/6"] == 1
+    assert manager.get_drive_amplitude() == 0.2
+    assert setup.daq.calls == calls + 1  # from the cache
+
+
+def test_batch_sends_nothing_if_it_raises(setup):
+    manager = setup.instruments()
+    with pytest.raises(ValueError):
+        with manager.batch():
+            manager.set_drive(frequency=1.2e5)
+            assert manager.get_drive_freq() == 1.2e5  # the pending value
+            raise ValueError
+    assert setup.daq.nodes["/dev1224/oscs/0/freq"] == 1.0e5
+    assert manager.get_drive_freq() == 1.0e5
+
+
+def test_refresh_detects_the_settings_changed_by_hand(setup):
+    manager = setup.instruments()
+    manager.set_freqs(1.0e5, detun=2)
+    setup.daq.nodes["/dev1224/oscs/0/freq"] = 1.1e5
+    assert manager.get_drive_freq() == 1.0e5
+    assert manager.refresh() == {"/dev1224/oscs/0/freq": (1.0e5, 1.1e5)}
+    assert manager.get_drive_freq() == 1.1e5
+    manager.strobe_at(detun=2)  # always reads the drive frequency
+    assert setup.rigol.frequency == 1.1e5 + 2
+
+
+def test_adaptive_calibration_chooses_the_video_biases(acquisition):
+    sampling = AdaptiveBiasSampling(coarse=11, max_biases=27, batch=8)
+    acquisition.acquire_calibration(sampling=sampling)
+    assert len(acquisition.video_biases) == 10
+    with open_acquisition(acquisition.path) as f:
+        calibration = f["bias calibration"]
+        assert calibration.attrs["bias sampling"] == sampling.describe()
+        np.testing.assert_array_equal(calibration["biases"][...], sampling.biases)
+        assert len(calibration["photos"]) == len(sampling.biases)
+        analysis = StdAnalysis(f)
+        biases = analysis.get_calibration_biases()
+        photos = analysis.get_calibration_photos()
+    order = np.argsort(sampling.biases)
+    np.testing.assert_array_equal(biases, np.array(sampling.biases)[order])
+    for photo, sample in zip(photos, np.array(sampling.samples)[order]):
+        stride = sampling.stride
+        np.testing.assert_allclose(photo[::stride, ::stride].ravel(), sample)
+    assert np.isin(acquisition.video_biases, biases).all()
+
+
+def test_telemetry_of_a_cancelled_calibration_is_stored(acquisition):
+    live_runs = []
+
+    def on_progress(event):
+        if event["event"] == "bias" and event["index"] == 4:
+            snapshot = acquisition.telemetry.snapshot()
+            live_runs.append(len(snapshot["calibration"]["runs"]))
+            acquisition.cancel()
+
+    with pytest.raises(AcquisitionCancelled):
+        acquisition.acquire_calibration(on_progress=on_progress)
+    with open_acquisition(acquisition.path) as f:
+        telemetry = f["telemetry"]["calibration"]
+        runs = telemetry["runs"][...]
+        frames = telemetry["frames"][...]
+        n_runs = len(f["bias calibration"]["biases"])
+        phases = {phase.decode() for phase in telemetry["phases"]["phase"]}
+    assert live_runs[0] >= 5
+    assert len(runs) == n_runs
+    np.testing.assert_array_equal(runs["run"], np.arange(n_runs))
+    assert (runs["received"] == 4).all() and (runs["dropped"] == 0).all()
+    assert len(frames) == 4 * n_runs
+    np.testing.assert_array_equal(np.bincount(frames["run"]), [4] * n_runs)
+    assert {"ramp", "settle", "record"} <= phases
+
+
+def test_measured_frame_rate_ignores_the_dropped_frames():
+    frame_counts = np.delete(np.arange(60), [3, 17, 18, 40, 41, 42, 50, 51, 52, 53])
+    frame_log = np.zeros(len(frame_counts), dtype=FRAME_LOG_DTYPE)
+    frame_log["frame_count"] = frame_counts
+    frame_log["timestamp"] = 100 + frame_log["frame_count"] / 25.0
+    assert measured_frame_rate(frame_log) == pytest.approx(25.0)
+    assert np.isnan(measured_frame_rate(frame_log[:1]))
@@ -0,0 +1,247 @@
+"""
+`StdAnalysis` on synthetic acquisitions: the optimized paths give the
+results of the straightforward ones
+"""
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from strobing_interferometer.analysis import StdAnalysis
+from strobing_interferometer.binning import BinnedGroup
+from strobing_interferometer.storage import StorageLayout, open_acquisition
+from strobing_interferometer.synthetic import make_acquisition
+
+pytestmark = pytest.mark.filterwarnings("ignore:divide by zero:RuntimeWarning")
+
+
+@pytest.fixture(scope="module", params=["contiguous", "chunked"])
+def acquisition(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp("acquisition") / "membrane.h5"
+    layout = StorageLayout(tile=(16, 16), frames=8)
+    if request.param == "contiguous":
+        layout = StorageLayout.contiguous()
+    shape = make_acquisition(
+        path, frame_shape=(48, 64), n_biases=60, n_frames=40, layout=layout
+    )
+    return path, shape
+
+
+def analysed(path, method="compute_all", *args, **options):
+    with open_acquisition(path) as f:
+        analysis = StdAnalysis(f, **options)
+        getattr(analysis, method)(*args)
+    return analysis
+
+
+def test_mode_image_matches_the_mode_shape(acquisition):
+    path, shape = acquisition
+    analysis = analysed(path)
+    correlation = np.corrcoef(analysis.mode_image.ravel(), shape.ravel())[0, 1]
+    assert abs(correlation) > 0.8
+
+
+def test_combine_images_matches_the_pixel_loop(acquisition):
+    path, _ = acquisition
+    analysis = analysed(path)
+    analysis.combine_images()  # before the masking
+    # the per pixel loop the vectorized `combine_images` replaced
+    absolute_slopes = np.abs(analysis.calibration_slopes_video_indexed)
+    to_flip = np.array(
+        [
+            np.vdot(analysis.phase_corrected_images[0], image)
+            for image in analysis.phase_corrected_images
+        ]
+    )
+    corrected = np.where(
+        to_flip[:, None, None] > 0,
+        analysis.fully_calibrated_images,
+        -analysis.fully_calibrated_images,
+    )
+    mode_image = np.empty(corrected.shape[1:])
+    best_video_index = np.empty(corrected.shape[1:], dtype=np.uint64)
+    for row, column in np.ndindex(*mode_image.shape):
+        best = np.argmax(absolute_slopes[:, row, column])
+        mode_image[row, column] = corrected[best, row, column]
+        best_video_index[row, column] = best
+    np.testing.assert_array_equal(analysis.mode_image, mode_image)
+    np.testing.assert_array_equal(analysis.best_video_index, best_video_index)
+
+
+def test_weighted_fusion_is_finite_with_zero_slopes(acquisition):
+    path, _ = acquisition
+    with open_acquisition(path) as f:
+        analysis = StdAnalysis(f)
+        analysis.compute_all()
+        slopes = analysis.calibration_slopes_video_indexed.copy()
+        slopes[3, 5, 5] = 0
+        analysis.calibrate_video_images(np.array(analysis.video_images()), slopes)
+    analysis.combine_images("weighted")
+    assert np.all(np.isfinite(analysis.mode_image))
+
+
+def test_process_pool_matches_serial(acquisition):
+    path, _ = acquisition
+    serial = analysed(path)
+    pool = analysed(path, n_workers=2)
+    np.testing.assert_array_equal(pool.mode_image, serial.mode_image)
+
+
+def test_tiled_matches_compute_all(acquisition):
+    path, _ = acquisition
+    full = analysed(path)
+    with open_acquisition(path) as f:
+        analysis = StdAnalysis(f)
+        n_pixels = int(np.prod(analysis.get_frame_shape()))
+        n_videos = len(analysis.get_video_names())
+        # stitched images, then room for about a quarter of the frame
+        resident = (6 * n_videos + 8) * n_pixels * analysis.dtype.itemsize
+        tile_memory = analysis.tile_pixel_memory() * n_pixels // 4
+        assert len(analysis.plan_tiles(tile_memory)) > 1
+        analysis.compute_all_tiled(
+            resident + tile_memory, executor="thread", n_workers=1
+        )
+    np.testing.assert_allclose(analysis.mode_image, full.mode_image, rtol=1e-12)
+
+
+def test_tile_first_pass_fits_its_memory_estimate(tmp_path):
+    path = tmp_path / "long_videos.h5"
+    # videos longer than the calibration: the video term of the estimate wins
+    make_acquisition(path, frame_shape=(32, 64), n_biases=60, n_frames=200)
+    with open_acquisition(path) as f:
+        analysis = StdAnalysis(f)
+        estimate = analysis.tile_pixel_memory() * 32 * 64
+        tracemalloc.start()
+        try:
+            analysis.tile_first_pass(np.array([0.1, 0.25, 0.3, 0.25, 0.1]))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    assert peak <= 1.05 * estimate  # a few kB of small objects
+
+
+def oscillating_video(harmonics=(1, 2), n_frames=96, frequency=2.5, fps=40.0):
+    """
+    Video of pixels oscillating at the `harmonics` of `frequency` (6 whole
+    periods), with the complex amplitude of each harmonic
+    """
+    rng = np.random.default_rng(0)
+    time = np.arange(n_frames)[:, None, None] / fps
+    video = np.full((n_frames, 6, 8), 500.0)
+    amplitudes = []
+    for harmonic in harmonics:
+        amplitude = rng.uniform(20, 40, (6, 8)) / harmonic
+        amplitude = amplitude * np.exp(1j * rng.uniform(-np.pi, np.pi, (6, 8)))
+        video += np.real(amplitude * np.exp(2j * np.pi * harmonic * frequency * time))
+        amplitudes.append(amplitude)
+    return video, np.array(amplitudes)
+
+
+@pytest.mark.parametrize("memory_limit", [None, 10_000])
+def test_lockin_components_recover_the_oscillations(memory_limit):
+    video, amplitudes = oscillating_video()
+    components = StdAnalysis.lockin_components(
+        video, 2.5, 40.0, harmonics=(1, 2), memory_limit=memory_limit, slab=7
+    )
+    np.testing.assert_allclose(components, amplitudes, atol=1e-9)
+
+
+def test_lockin_image_matches_std_image_on_a_sinusoid():
+    video, _ = oscillating_video(harmonics=(1,))
+    components = StdAnalysis.lockin_components(video, 2.5, 40.0)[0]
+    np.testing.assert_allclose(
+        StdAnalysis.lockin_image(components), StdAnalysis.std_image(video), rtol=1e-9
+    )
+
+
+@pytest.mark.parametrize("spacing", ["even", "uneven"])
+def test_fit_fringes_recovers_the_fringes(spacing):
+    rng = np.random.default_rng(1)
+    biases = np.linspace(-3, 3, 60)
+    if spacing == "uneven":  # as an adaptive calibration
+        biases = np.sort(np.concatenate([biases[::2], rng.uniform(-3, 3, 30)]))
+    k = rng.uniform(1.2, 2.0, 50)
+    phase = rng.uniform(0, 2 * np.pi, 50)
+    fringes = 600 + 300 * np.cos(np.multiply.outer(biases, k) + phase)
+    noisy = fringes + rng.normal(scale=1.0, size=fringes.shape)
+    offset, a, b, fitted_k = StdAnalysis.fit_fringes(biases, noisy)
+    np.testing.assert_allclose(fitted_k, k, rtol=1e-3)
+    angle = np.multiply.outer(biases, fitted_k)
+    model = offset + a * np.cos(angle) + b * np.sin(angle)
+    np.testing.assert_allclose(model, fringes, atol=3.0)  # 3 sigma of the noise
+
+
+def test_fringe_fit_slopes_give_the_mode_shape(acquisition):
+    path, shape = acquisition
+    with open_acquisition(path) as f:
+        analysis = StdAnalysis(f)
+        analysis.fit_calibration_fringes()
+        analysis.compute_independant_video_images()
+        analysis.combine_images()
+    correlation = np.corrcoef(analysis.mode_image.ravel(), shape.ravel())[0, 1]
+    assert abs(correlation) > 0.8
+
+
+def test_binned_video_is_read_as_block_means(acquisition):
+    path, _ = acquisition
+    with open_acquisition(path) as f:
+        video = f["stroboscopic"]["video0"]
+        binned = BinnedGroup(f, binning=4, frame_step=2)["stroboscopic"]["video0"]
+        assert binned.shape == (len(video[::2]), 12, 16)
+        assert binned.attrs["fps"] == video.attrs["fps"] / 2
+        expected = video[2:10:2, 8:24, 12:36].reshape(4, 4, 4, 6, 4).mean(axis=(2, 4))
+        np.testing.assert_allclose(binned[1:5, 2:6, 3:9], expected)
+
+
+def test_preview_shows_the_mode_shape(acquisition):
+    path, shape = acquisition
+    with open_acquisition(path) as f:
+        preview = StdAnalysis(f).preview(binning=4, frame_step=2)
+    assert preview.shape == (12, 16)
+    binned_shape = shape.reshape(12, 4, 16, 4).mean(axis=(1, 3))
+    correlation = np.corrcoef(preview.ravel(), binned_shape.ravel())[0, 1]
+    # the clipped image at full resolution only reaches about 0.64
+    assert abs(correlation) > 0.5
+
+
+def test_roi_analysis_matches_the_full_frame(acquisition):
+    path, _ = acquisition
+    roi = (slice(8, 40), slice(16, 48))
+    mask = np.zeros((48, 64), dtype=bool)
+    mask[8:40, 16:48] = np.eye(32, dtype=bool)  # same bounding box
+    assert StdAnalysis.roi_slices(mask) == roi
+    assert StdAnalysis.roi_slices((8, 40, 16, 48)) == roi
+    results = []
+    for region in (None, mask):
+        with open_acquisition(path) as f:
+            analysis = StdAnalysis(f, roi=region)
+            analysis.smooth_calibration()
+            analysis.compute_calibration_slopes()
+            analysis.compute_independant_video_images()
+            full_frame = analysis.to_full_frame(analysis.fully_calibrated_images)
+        results.append((analysis, full_frame))
+    (full, _), (cropped, placed) = results
+    np.testing.assert_array_equal(
+        cropped.calibration_slopes, full.calibration_slopes[(Ellipsis, *roi)]
+    )
+    # the sign of each video image depends on its reference pixel
+    np.testing.assert_allclose(
+        np.abs(cropped.fully_calibrated_images),
+        np.abs(full.fully_calibrated_images[(Ellipsis, *roi)]),
+        rtol=1e-12,
+    )
+    assert np.isnan(placed[:, :8]).all()
+    np.testing.assert_array_equal(
+        placed[(Ellipsis, *roi)], cropped.fully_calibrated_images
+    )
+
+
+@pytest.mark.parametrize("memory_limit", [1, 40_000, 10**9])
+def test_streaming_std_image_matches_std_image(acquisition, memory_limit):
+    path, _ = acquisition
+    roi = (slice(4, 40), slice(8, 60))
+    with open_acquisition(path) as f:
+        video = f["stroboscopic"]["video3"]
+        expected = StdAnalysis.std_image(video[(Ellipsis, *roi)])
+        streamed = StdAnalysis.std_image_streaming(video, memory_limit, roi)
+    np.testing.assert_allclose(streamed, expected, rtol=1e-9)
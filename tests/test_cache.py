@@ -0,0 +1,74 @@
+"""
+`StageCache` and the cached stages of `StdAnalysis`
+"""
+import os
+
+import numpy as np
+import pytest
+
+from strobing_interferometer.analysis import StdAnalysis
+from strobing_interferometer.cache import StageCache
+from strobing_interferometer.storage import open_acquisition
+from strobing_interferometer.synthetic import make_acquisition
+
+pytestmark = pytest.mark.filterwarnings("ignore:divide by zero:RuntimeWarning")
+
+
+@pytest.fixture
+def acquisition(tmp_path):
+    path = tmp_path / "membrane.h5"
+    make_acquisition(path, frame_shape=(24, 32), n_biases=40, n_frames=24)
+    return path
+
+
+def analysed(path, cache, **options):
+    with open_acquisition(path) as f:
+        analysis = StdAnalysis(f, cache=cache, **options)
+        analysis.compute_all()
+    return analysis
+
+
+def test_second_run_is_read_from_the_cache(acquisition, tmp_path, monkeypatch):
+    cache = StageCache(tmp_path / "cache")
+    first = analysed(acquisition, cache)
+    n_entries = len(cache.entries())
+    assert n_entries > 0
+
+    def not_cached(*args, **kwargs):
+        raise AssertionError("computed instead of read from the cache")
+
+    monkeypatch.setattr(StdAnalysis, "std_image", staticmethod(not_cached))
+    second = analysed(acquisition, cache)
+    assert len(cache.entries()) == n_entries
+    np.testing.assert_array_equal(second.mode_image, first.mode_image)
+
+
+def test_engines_do_not_share_their_video_images(acquisition, tmp_path):
+    cache = StageCache(tmp_path / "cache")
+    analysed(acquisition, cache)
+    lockin = analysed(acquisition, cache, engine="lockin")
+    uncached = analysed(acquisition, None, engine="lockin")
+    np.testing.assert_array_equal(lockin.mode_image, uncached.mode_image)
+
+
+def test_modified_acquisition_is_recomputed(acquisition, tmp_path):
+    cache = StageCache(tmp_path / "cache")
+    analysed(acquisition, cache)
+    n_entries = len(cache.entries())
+    stat = os.stat(acquisition)
+    os.utime(acquisition, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    analysed(acquisition, cache)
+    assert len(cache.entries()) == 2 * n_entries
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = StageCache(tmp_path / "cache")
+    keys = [cache.key("stage", index=i) for i in range(3)]
+    for last_use, key in enumerate(keys):
+        cache.store(key, "stage", {"image": np.zeros(1000)})
+        os.utime(cache._path(key), (last_use, last_use))
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    assert cache.load(keys[0]) is None
+    assert cache.load(keys[1]) is not None
+    assert cache.load(keys[2]) is not None
@@ -0,0 +1,49 @@
+"""
+The `strobe-analyze` batch analysis command
+"""
+import h5py
+import pytest
+
+from strobing_interferometer.cli import main, parse_size
+from strobing_interferometer.synthetic import make_acquisition
+
+pytestmark = pytest.mark.filterwarnings("ignore:divide by zero:RuntimeWarning")
+
+
+@pytest.fixture
+def directory(tmp_path):
+    for name in ("first", "second"):
+        make_acquisition(
+            tmp_path / f"{name}.h5", frame_shape=(24, 32), n_biases=40, n_frames=24
+        )
+    return tmp_path
+
+
+def test_parse_size():
+    assert parse_size("512") == 512
+    assert parse_size("16K") == 16 * 2**10
+    assert parse_size("1.5g") == 3 * 2**29
+    assert parse_size("2GB") == 2 * 2**30
+
+
+def test_directory_is_analysed_once(directory, capsys):
+    assert main([str(directory), "-j", "2", "-m", "256M"]) == 0
+    for name in ("first", "second"):
+        with h5py.File(directory / f"{name}.results.h5", "r") as f:
+            assert f["mode_image"].shape == (24, 32)
+            assert f["mask"].shape == (24, 32)
+    capsys.readouterr()
+    assert main([str(directory), "-m", "256M"]) == 0
+    assert capsys.readouterr().out.count("up to date") == 2
+    # other options: analysed again
+    assert main([str(directory), "-m", "256M", "--engine", "lockin"]) == 0
+    assert "up to date" not in capsys.readouterr().out
+
+
+def test_failure_does_not_stop_the_batch(directory, capsys):
+    (directory / "broken.h5").write_bytes(b"not an hdf5 file")
+    assert main([str(directory), "-m", "256M"]) == 1
+    assert "broken.h5: failed" in capsys.readouterr().err
+    assert (directory / "first.results.h5").exists()
+    assert (directory / "second.results.h5").exists()
+    assert not (directory / "broken.results.h5").exists()
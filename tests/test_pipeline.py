@@ -0,0 +1,143 @@
+"""
+`strobing_interferometer.pipeline` with the simulated camera
+"""
+import time
+
+import numpy as np
+import pytest
+
+from strobing_interferometer.pipeline import FramePipeline, FrameRingBuffer
+from strobing_interferometer.simulator import SimulatedSetup
+
+FRAME_SHAPE = (16, 20)
+
+
+def armed_camera(n_frames, frame_rate=200.0, drop_rate=0.0, trigger=True):
+    setup = SimulatedSetup(
+        frame_shape=FRAME_SHAPE,
+        frame_rate=frame_rate,
+        latency=0.0,
+        drop_rate=drop_rate,
+    )
+    camera = setup.camera
+    camera.image_poll_timeout_ms = 50
+    camera.frames_per_trigger_zero_for_unlimited = n_frames
+    camera.arm(n_frames)  # the camera buffer never overflows
+    if trigger:
+        camera.issue_software_trigger()
+    return camera
+
+
+class Recorder:
+    """
+    Sink keeping a copy of the frame numbers, stalling on some batches
+    """
+
+    def __init__(self, stalls=(), stall=0.0):
+        self.frame_counts = []
+        self.stalls = stalls
+        self.stall = stall
+        self.calls = 0
+
+    def __call__(self, index, frames, frame_counts):
+        if self.calls in self.stalls:
+            time.sleep(self.stall)
+        self.calls += 1
+        assert frames.shape[1:] == FRAME_SHAPE
+        self.frame_counts.extend(frame_counts)
+
+
+def test_frames_arrive_in_order():
+    camera = armed_camera(300)
+    sink = Recorder()
+    stats = FramePipeline(FRAME_SHAPE, capacity=64, batch=16).run(camera, 300, sink)
+    camera.disarm()
+    assert sink.frame_counts == list(range(1, 301))
+    assert stats["received"] == stats["written"] == 300
+    assert stats["dropped"] == stats["camera_dropped"] == 0
+
+
+def test_backpressure_absorbs_sink_stalls():
+    camera = armed_camera(300)
+    sink = Recorder(stalls=(2, 10), stall=0.5)
+    pipeline = FramePipeline(FRAME_SHAPE, capacity=128, batch=16, put_timeout=None)
+    stats = pipeline.run(camera, 300, sink)
+    camera.disarm()
+    assert sink.frame_counts == list(range(1, 301))
+    assert stats["dropped"] == 0
+    # the frames piled up in the ring buffer during the stalls
+    assert stats["high_water"] > 16
+    assert len(pipeline.frame_log) == 300
+
+
+def test_full_ring_buffer_drops_are_counted():
+    camera = armed_camera(200)
+    sink = Recorder(stalls=(1,), stall=0.5)
+    pipeline = FramePipeline(FRAME_SHAPE, capacity=16, batch=8, put_timeout=0.05)
+    stats = pipeline.run(camera, 200, sink)
+    camera.disarm()
+    assert stats["dropped"] > 0
+    assert stats["received"] == 200
+    assert stats["written"] == 200 - stats["dropped"]
+    events = [event for event in pipeline.events if event["kind"] == "ring buffer full"]
+    assert len(events) == stats["dropped"]
+    # the frames written are still in order
+    assert sink.frame_counts == sorted(sink.frame_counts)
+
+
+def test_camera_drops_are_counted():
+    camera = armed_camera(300, drop_rate=0.05)
+    pipeline = FramePipeline(FRAME_SHAPE, capacity=64, batch=16)
+    stats = pipeline.run(camera, 300, Recorder())
+    camera.disarm()
+    assert stats["camera_dropped"] == camera.dropped > 0
+    assert stats["received"] + stats["camera_dropped"] == 300
+    missing = sum(e["missing"] for e in pipeline.events if e["kind"] == "camera")
+    assert missing == stats["camera_dropped"]
+
+
+def test_sink_error_is_raised():
+    camera = armed_camera(200)
+
+    def sink(index, frames, frame_counts):
+        if index >= 32:
+            raise ValueError("disk full")
+
+    pipeline = FramePipeline(FRAME_SHAPE, capacity=32, batch=16)
+    with pytest.raises(ValueError, match="disk full"):
+        pipeline.run(camera, 200, sink)
+    camera.disarm()
+    assert not pipeline.running
+    assert pipeline.stats["written"] == 32
+
+
+def test_camera_timeout_is_raised():
+    camera = armed_camera(10, trigger=False)  # no frame will ever come
+    pipeline = FramePipeline(FRAME_SHAPE, capacity=16, batch=8, frame_timeout=0.3)
+    with pytest.raises(TimeoutError):
+        pipeline.run(camera, 10, Recorder())
+    camera.disarm()
+    assert not pipeline.running
+
+
+def test_ring_buffer_wraps_around():
+    ring = FrameRingBuffer(4, (2, 2))
+    for count in range(1, 4):
+        assert ring.put(np.full((2, 2), count), count)
+    _, frames, counts = ring.peek()
+    assert list(counts) == [1, 2, 3]
+    ring.release(3)
+    for count in range(4, 7):
+        ring.put(np.full((2, 2), count), count)
+    # the batch stops at the end of the ring
+    start, frames, counts = ring.peek()
+    assert (start, list(counts)) == (3, [4])
+    ring.release(1)
+    _, frames, counts = ring.peek()
+    assert list(counts) == [5, 6]
+    assert frames[1, 0, 0] == 6
+    ring.put(np.full((2, 2), 7), 7)
+    ring.put(np.full((2, 2), 8), 8)
+    # full: dropped once the timeout expires
+    assert not ring.put(np.zeros((2, 2)), 9, timeout=0)
+    assert ring.dropped == 1
@@ -0,0 +1,76 @@
+"""
+`AdaptiveBiasSampling` on synthetic fringes
+"""
+import numpy as np
+import pytest
+
+from strobing_interferometer.sampling import AdaptiveBiasSampling
+
+FRAME_SHAPE = (20, 30)
+
+
+def fringes(k):
+    """
+    Photo of fringes of wavenumber `k` (per pixel) as a function of the bias
+    """
+    return lambda bias: 600 + 300 * np.cos(k * bias)
+
+
+def run(sampling, photo, bias_range=(-3, 3)):
+    """
+    Record the biases chosen by `sampling` as a calibration would
+    """
+    biases = sampling.start(bias_range, FRAME_SHAPE)
+    while len(biases):
+        for bias in biases:
+            sampling.add(bias, photo(bias))
+        biases = sampling.next_biases(current=biases[-1])
+    return np.array(sampling.biases)
+
+
+def test_linear_photos_converge_after_one_refinement():
+    sampling = AdaptiveBiasSampling(coarse=11, batch=4)
+    biases = sampling.start((-3, 3), FRAME_SHAPE)
+    for bias in biases:
+        sampling.add(bias, np.full(FRAME_SHAPE, 500.0) + 10 * bias)
+    refinement = sampling.next_biases(current=3.0)
+    assert len(refinement) == 4
+    assert np.all(np.diff(refinement) < 0)  # a single ramp down from 3 V
+    for bias in refinement:
+        sampling.add(bias, np.full(FRAME_SHAPE, 500.0) + 10 * bias)
+    assert len(sampling.next_biases()) == 0
+    assert sampling.converged
+
+
+def test_biases_are_denser_where_the_fringes_are():
+    k = np.random.default_rng(0).uniform(1.2, 2.0, FRAME_SHAPE)
+    # the membrane only moves with positive biases
+    sampling = AdaptiveBiasSampling(coarse=13, max_biases=40, batch=6)
+    biases = run(sampling, lambda bias: fringes(k)(max(bias, 0)))
+    assert len(np.unique(biases)) == len(biases) <= 40
+    assert np.min(np.diff(np.sort(biases))) >= sampling.step * (1 - 1e-9)
+    assert np.sum(biases > 0) > 1.5 * np.sum(biases < 0)
+
+
+def test_sampling_stops_at_max_biases():
+    rng = np.random.default_rng(0)
+    k = rng.uniform(1.2, 2.0, FRAME_SHAPE)
+    sampling = AdaptiveBiasSampling(coarse=11, max_biases=25, batch=8, tolerance=0)
+    biases = run(sampling, fringes(k))
+    assert len(biases) == 25
+    assert not sampling.converged
+    assert "25 biases, not converged" in sampling.describe()
+
+
+def test_video_biases_cover_the_pixels():
+    rng = np.random.default_rng(0)
+    k = rng.uniform(1.2, 2.0, FRAME_SHAPE)
+    sampling = AdaptiveBiasSampling(coarse=21, max_biases=60)
+    biases = np.sort(run(sampling, fringes(k)))
+    videos = sampling.video_biases(n_videos=6, margin=2)
+    assert len(videos) == 6
+    assert np.all(np.diff(videos) > 0)
+    assert np.isin(videos, biases[2:-2]).all()
+    assert sampling.coverage > 0.9
+    with pytest.raises(ValueError):
+        sampling.video_biases(margin=len(biases))
@@ -0,0 +1,60 @@
+"""
+Chunking and compression of the image datasets
+"""
+import numpy as np
+import pytest
+
+from strobing_interferometer.analysis import StdAnalysis
+from strobing_interferometer.storage import StorageLayout, open_acquisition
+from strobing_interferometer.synthetic import make_acquisition
+
+
+@pytest.mark.parametrize("compression", [None, "lzf", "gzip", "blosc", "bitshuffle"])
+def test_images_round_trip(tmp_path, compression):
+    layout = StorageLayout(compression=compression)
+    images = np.random.default_rng(0).integers(0, 1024, (40, 70, 90), np.uint16)
+    with open_acquisition(tmp_path / "images.h5", "w") as f:
+        layout.create_dataset(f, "images", data=images)
+    with open_acquisition(tmp_path / "images.h5") as f:
+        np.testing.assert_array_equal(f["images"][...], images)
+
+
+def test_chunks_split_the_images_in_equal_tiles():
+    layout = StorageLayout(tile=(64, 64), frames=32)
+    # 17 x 23 tiles of at most 64 x 64 pixels
+    assert layout.chunks((100, 1080, 1440), np.uint16) == (32, 64, 63)
+    assert layout.chunks((100, 100, 130), np.uint16) == (32, 50, 44)
+    assert layout.chunks((100, 20, 100, 130), np.uint16, frames=1) == (1, 20, 50, 44)
+    # halved on the leading axes to stay under max_chunk_bytes
+    layout = StorageLayout(tile=(64, 64), frames=32, max_chunk_bytes=2**18)
+    assert layout.chunks((100, 1080, 1440), np.float64) == (8, 64, 63)
+
+
+def test_resizable_datasets_shrink(tmp_path):
+    with open_acquisition(tmp_path / "images.h5", "w") as f:
+        for name, layout in [
+            ("contiguous", StorageLayout.contiguous()),
+            ("chunked", StorageLayout()),
+        ]:
+            dataset = layout.create_dataset(
+                f, name, (100, 2, 30, 40), np.uint16, frames=1, resizable=True
+            )
+            dataset[:11] = 7
+            dataset.resize(11, axis=0)
+            assert dataset.shape == (11, 2, 30, 40)
+            assert (dataset[...] == 7).all()
+
+
+@pytest.mark.filterwarnings("ignore:divide by zero:RuntimeWarning")
+def test_analysis_does_not_depend_on_the_layout(tmp_path):
+    mode_images = []
+    for layout in [StorageLayout.contiguous(), StorageLayout(tile=(16, 16))]:
+        path = tmp_path / f"{layout.describe()}.h5"
+        make_acquisition(
+            path, frame_shape=(24, 32), n_biases=40, n_frames=24, layout=layout
+        )
+        with open_acquisition(path) as f:
+            analysis = StdAnalysis(f)
+            analysis.compute_all()
+        mode_images.append(analysis.mode_image)
+    np.testing.assert_array_equal(*mode_images)